@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+"""
+Phase 0 benchmarks
+==================
+    python bench_phase0.py workers --products 20000 --workers 1 2 4
+    python bench_phase0.py fragrance --products 20000
+    python bench_phase0.py scaling --sizes 1000 10000 100000 1000000
+
+workers    — end-to-end phase0 wall time on a synthetic catalog for each
+             --workers setting; outputs are checked byte-identical to serial.
+fragrance  — parse_fragrance_notes against the original six-regex parser
+             (legacy_parse_fragrance_notes) on the catalog's descriptions.
+scaling    — phase0 at each catalog size (colourways and relisted SKUs
+             included), each size in a fresh process: seconds and peak
+             memory per phase, products/s, and µs/call per profiled stage.
+             Peak memory is the process's RSS high-water mark after each
+             phase (parent process only); --tracemalloc reports the Python
+             heap peak within each phase instead, at a large speed cost.
+"""
+
+import re, sys, time, argparse, tempfile, filecmp, json, contextlib, io, tracemalloc
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict
+
+try:
+    import resource
+    RESOURCE_AVAILABLE = True
+except ImportError:
+    RESOURCE_AVAILABLE = False
+
+import phase0_preprocessing_pipeline as phase0
+from synthetic_catalog import (make_catalog, iter_catalog, write_catalog, iter_fragrance_edge_cases,
+                               COLOURWAY_RATE, RELIST_RATE)
+
+OUTPUT_FILES = ["products_hierarchical.json", "bm25_corpus.json",
+                "products_attribute_indexed.json", "image_registry.json",
+                "products_flat.csv"]
+
+
+def bench_workers(args):
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        raw_path = tmp / "raw.json"
+        with open(raw_path, "w", encoding="utf-8") as f:
+            json.dump(make_catalog(args.products), f, ensure_ascii=False)
+
+        baseline = None
+        print(f"{'workers':>8} {'seconds':>9} {'products/s':>11}  identical")
+        for workers in args.workers:
+            out_dir = tmp / f"out_{workers}"
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                phase0.main(["--input", str(raw_path), "--output-dir", str(out_dir),
+                             "--workers", str(workers)])
+            elapsed = time.perf_counter() - start
+            if baseline is None:
+                baseline = out_dir
+            same = all(filecmp.cmp(baseline / n, out_dir / n, shallow=False)
+                       for n in OUTPUT_FILES)
+            print(f"{workers:>8} {elapsed:>9.2f} {args.products / elapsed:>11.0f}  {same}")
+
+
+def legacy_parse_fragrance_notes(desc: str) -> dict:
+    """The original phase0 parser — reference output for the optimised one."""
+    result = {
+        "notes_top": "",
+        "notes_heart": "",
+        "notes_base": "",
+        "main_accords": "",
+        "fragrance_category": "",
+        "size": "",
+    }
+
+    if not desc:
+        return result
+
+    m = re.search(r'Top Notes?:\s*(.+?)(?=Heart Notes?:|Base Notes?:|Dry Down|Size:|$)', desc, re.IGNORECASE)
+    if m:
+        result["notes_top"] = m.group(1).strip().rstrip(",. ")
+
+    m = re.search(r'Heart Notes?:\s*(.+?)(?=Base Notes?:|Dry Down|Size:|$)', desc, re.IGNORECASE)
+    if m:
+        result["notes_heart"] = m.group(1).strip().rstrip(",. ")
+
+    m = re.search(r'(?:Base Notes?|Dry Down\s*(?:Base Notes?)?)\s*:?\s*(.+?)(?=Size:|Bottle|$)', desc, re.IGNORECASE)
+    if m:
+        result["notes_base"] = m.group(1).strip().rstrip(",. ")
+
+    m = re.search(r'Main Accords?\s*(.+?)(?=Top Notes?:|$)', desc, re.IGNORECASE)
+    if m:
+        result["main_accords"] = m.group(1).strip().rstrip(",. ")
+
+    m = re.search(r'Category:\s*(.+?)(?=Main Accords?|Top Notes?|$)', desc, re.IGNORECASE)
+    if m:
+        result["fragrance_category"] = m.group(1).strip().rstrip(",. ")
+
+    m = re.search(r'Size:\s*(\d+(?:\.\d+)?)\s*ml', desc, re.IGNORECASE)
+    if m:
+        result["size"] = f"{m.group(1)}ml"
+
+    return result
+
+
+def bench_fragrance(args):
+    catalog = [p["description_text"] for p in make_catalog(args.products)
+               if "fragrances/" in p["category_source"]]
+    edge = list(iter_fragrance_edge_cases(args.products))
+
+    print(f"{'corpus':>8} {'texts':>7} {'legacy us':>10} {'new us':>8} {'speedup':>8}  identical")
+    for label, texts in (("catalog", catalog), ("edge", edge)):
+        timings = []
+        for parse in (legacy_parse_fragrance_notes, phase0.parse_fragrance_notes):
+            best = float("inf")
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                for text in texts:
+                    parse(text)
+                best = min(best, time.perf_counter() - start)
+            timings.append(best / len(texts) * 1e6)
+        same = all(legacy_parse_fragrance_notes(t) == phase0.parse_fragrance_notes(t) for t in texts)
+        print(f"{label:>8} {len(texts):>7} {timings[0]:>10.2f} {timings[1]:>8.2f} "
+              f"{timings[0] / timings[1]:>7.2f}x  {same}")
+
+
+def peak_rss_mb() -> float:
+    """RSS high-water mark of this process (ru_maxrss is KiB on Linux, bytes on macOS)."""
+    if not RESOURCE_AVAILABLE:
+        return float("nan")
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1 << 20) if sys.platform == "darwin" else peak / 1024
+
+
+def run_scale(products: int, tmp: str, workers: int, chunk_size: int,
+              colourways: float, relists: float, trace: bool) -> Dict:
+    """Run main()'s phases through the library API for one catalog size; called in a fresh process."""
+    tmp = Path(tmp)
+    raw_path, out_dir = tmp / "raw.json", tmp / "out"
+    phases = {}
+
+    def phase(name, fn, *args):
+        if trace:
+            tracemalloc.reset_peak()
+        start = time.perf_counter()
+        result = fn(*args)
+        peak = tracemalloc.get_traced_memory()[1] / (1 << 20) if trace else peak_rss_mb()
+        phases[name] = {"seconds": round(time.perf_counter() - start, 3), "peak_mb": round(peak, 1)}
+        return result
+
+    if trace:
+        tracemalloc.start()
+    phase("generate", write_catalog, raw_path,
+          iter_catalog(products, colourways=colourways, relists=relists), None)
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        sku_sources, _, shared_names = phase("scan_duplicates", phase0.scan_duplicates,
+                                             phase0.iter_json_array(raw_path))
+        profile = phase0.StageProfile()
+        stats = {**phase0.new_stats(), "profile": profile}
+        state = phase0.IncrementalState({})
+        near_dups = phase0.NearDuplicateIndex() if phase0.NUMPY_AVAILABLE else None
+        sinks = phase0.OutputSinks(out_dir, bm25_stats=phase0.NUMPY_AVAILABLE)
+        for w in sinks.writers:
+            w.write = profile.timed(f"write:{w.path.name}", w.write)
+        sinks.commit = profile.timed("commit_outputs", sinks.commit)
+        if near_dups is not None:
+            near_dups.assign = profile.timed("near_duplicate_assign", near_dups.assign)
+        raws = phase0.merge_sku_duplicates(phase0.iter_json_array(raw_path), sku_sources)
+        rows = phase0.iter_processed(profile.timed_iter("read_input", raws), workers, chunk_size,
+                                     state, near_dups, lambda raw: phase0.name_group(raw) in shared_names,
+                                     stats, profile=True)
+        phase("process_and_write", phase0.write_outputs, rows, sinks)
+        phase("write_manifest", phase0.write_incremental_outputs, state, out_dir, True)
+
+    seconds = sum(p["seconds"] for name, p in phases.items() if name != "generate")
+    report = profile.report(stats["total"], seconds, workers)
+    return {
+        "records": products,
+        "products": stats["total"],
+        "seconds": round(seconds, 3),
+        "products_per_sec": report["products_per_sec"],
+        "output_mb": round(sum(f.stat().st_size for f in out_dir.iterdir()) / (1 << 20), 1),
+        "phases": phases,
+        "stages": report["stages"],
+    }
+
+
+def bench_scaling(args):
+    memory = "Python heap peak per phase (tracemalloc)" if args.tracemalloc else "peak RSS after phase"
+    print(f"workers={args.workers}  colourways={args.colourways}  relists={args.relists}  memory: {memory}")
+    results = []
+    spawn = multiprocessing.get_context("spawn")
+    for n in args.sizes:
+        with tempfile.TemporaryDirectory(dir=args.tmp_dir) as tmp, \
+                ProcessPoolExecutor(max_workers=1, mp_context=spawn) as fresh:
+            result = fresh.submit(run_scale, n, tmp, args.workers, args.chunk_size,
+                                  args.colourways, args.relists, args.tracemalloc).result()
+        results.append(result)
+        print(f"\n{n:>10,} records → {result['products']:,} products, {result['seconds']:.1f}s, "
+              f"{result['products_per_sec']:,.0f} products/s, {result['output_mb']:,.0f} MB written")
+        for name, p in result["phases"].items():
+            print(f"   {name:20s} {p['seconds']:9.2f}s {p['peak_mb']:9.1f} MB")
+
+    largest = results[-1]["stages"]
+    print(f"\n{'µs/call':40s}" + "".join(f"{n:>12,}" for n in args.sizes))
+    for stage in list(largest)[:args.stages]:
+        cells = (r["stages"].get(stage, {}).get("us_per_call") for r in results)
+        print(f"{stage:40s}" + "".join(f"{c:>12.1f}" if c is not None else f"{'-':>12}" for c in cells))
+
+    if args.report:
+        args.report.write_text(json.dumps({
+            "workers": args.workers, "colourways": args.colourways, "relists": args.relists,
+            "memory": memory, "sizes": results,
+        }, indent=2), encoding="utf-8")
+        print(f"\n✓ {args.report}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Phase 0 benchmarks")
+    sub = parser.add_subparsers(dest="bench", required=True)
+
+    p = sub.add_parser("workers", help="serial vs process-pool wall time")
+    p.add_argument("--products", type=int, default=20000)
+    p.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    p.set_defaults(func=bench_workers)
+
+    p = sub.add_parser("fragrance", help="fragrance description parser vs the original")
+    p.add_argument("--products", type=int, default=20000)
+    p.add_argument("--repeat", type=int, default=3)
+    p.set_defaults(func=bench_fragrance)
+
+    p = sub.add_parser("scaling", help="throughput and peak memory per phase at growing catalog sizes")
+    p.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000, 1000000])
+    p.add_argument("--workers", type=int, default=1)
+    p.add_argument("--chunk-size", type=int, default=phase0.DEFAULT_CHUNK_SIZE)
+    p.add_argument("--colourways", type=float, default=COLOURWAY_RATE)
+    p.add_argument("--relists", type=float, default=RELIST_RATE)
+    p.add_argument("--tracemalloc", action="store_true",
+                   help="measure Python heap peaks per phase (much slower)")
+    p.add_argument("--stages", type=int, default=15, help="stages shown in the µs/call table")
+    p.add_argument("--tmp-dir", type=Path, default=None,
+                   help="where catalogs and outputs are written (1M products needs ~8 GB)")
+    p.add_argument("--report", type=Path, default=None, help="also write the results as JSON")
+    p.set_defaults(func=bench_scaling)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
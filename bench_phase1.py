@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+"""
+Phase 1 benchmarks
+==================
+    python bench_phase1.py averaging --products 20000
+    python bench_phase1.py averaging --input enriched_data/products_hierarchical.json
+    python bench_phase1.py dims --products 5000
+    python bench_phase1.py dims --store enriched_data/vector_store
+
+averaging — the per-product vector work of phase1 over a whole catalog:
+            zero-fill for failed requests and the HyDE query/answer
+            averages. The original pure-Python list code
+            (legacy_average_vectors) runs against assign_vectors(), which
+            averages every group of --group completed products as one
+            segmented mean. Vectors are random unit float32 rows drawn
+            from a fixed pool, so no API calls are made; the largest
+            difference between the two averages is reported.
+
+dims      — recall and latency of reduced-dimension (Matryoshka) search:
+            documents and queries are truncate()d to each of --dims and
+            searched exactly (one query at a time, matrix-vector product);
+            recall@k is measured against the full-size search. "two-stage"
+            takes k * --factor candidates at the reduced size and rescores
+            them at full size, as phase3 does. With --store the documents
+            are a phase1 vector store's chunk rows and the queries a sample
+            of its HyDE query rows; otherwise primary chunks and HyDE
+            queries of the catalog are embedded with --provider (default:
+            the offline hashing provider at 1024 dims, whose truncation only
+            shows the mechanics — use a real store for real numbers).
+
+Without --input the catalog is synthetic (synthetic_catalog.py) run
+through phase0's library API.
+"""
+
+import json, time, argparse, contextlib, io
+from pathlib import Path
+from typing import Dict, List
+
+import numpy as np
+
+import phase0_preprocessing_pipeline as phase0
+import phase1_embedding as phase1
+from embedding_providers import make_provider, truncate
+from vector_store import VectorStore
+from synthetic_catalog import iter_catalog
+
+POOL_SIZE = 1024
+
+
+def legacy_average_vectors(vecs: List[List[float]]) -> List[float]:
+    """phase1's original average_vectors (Python lists)."""
+    if not vecs:
+        return [0.0] * phase1.DIMS
+    if len(vecs) == 1:
+        return vecs[0]
+    avg = [sum(col) / len(vecs) for col in zip(*vecs)]
+    norm = sum(x * x for x in avg) ** 0.5
+    if norm > 0:
+        avg = [x / norm for x in avg]
+    return avg
+
+
+def load_products(args) -> List[Dict]:
+    if args.input:
+        with open(args.input, encoding="utf-8") as f:
+            return json.load(f)
+    with contextlib.redirect_stdout(io.StringIO()):
+        return [p.product.to_dict() for p in phase0.iter_processed(iter_catalog(args.products))]
+
+
+def bench_averaging(args):
+    products = load_products(args)
+    dims = phase1.DIMS
+    rng = np.random.default_rng(7)
+    pool = rng.standard_normal((POOL_SIZE, dims), dtype=np.float32)
+    pool /= np.linalg.norm(pool, axis=1, keepdims=True)
+    pool_lists = pool.tolist()
+
+    slots = []                    # per product: {section: [(index, pool row)]}
+    draw = 0
+    for product in products:
+        sections = {section: [] for section in phase1.SECTIONS}
+        for section, index, _ in phase1.collect_texts(product):
+            sections[section].append((index, draw % POOL_SIZE))
+            draw += 1
+        slots.append(sections)
+    texts = draw
+    print(f"{len(products)} products, {texts} texts, {dims} dims, groups of {args.group}")
+
+    # zero-fill: one failed request's worth of filler per 50 texts
+    fills = max(1, texts // 50)
+    start = time.perf_counter()
+    for _ in range(fills):
+        [[0.0] * dims for _ in range(50)]
+    legacy_fill = time.perf_counter() - start
+    start = time.perf_counter()
+    for _ in range(fills):
+        np.zeros((50, dims), dtype=np.float32)
+    numpy_fill = time.perf_counter() - start
+
+    legacy_avg = numpy_avg = 0.0
+    max_diff = 0.0
+    for lo in range(0, len(products), args.group):
+        group = slots[lo:lo + args.group]
+
+        start = time.perf_counter()
+        legacy = []
+        for sections in group:
+            for section in ("hyde_query", "hyde_answer"):
+                legacy.append(legacy_average_vectors([pool_lists[row] for _, row in sections[section]]))
+        legacy_avg += time.perf_counter() - start
+
+        shells = [{"searchable_chunks": [], "hyde_components": {}} for _ in group]
+        vectors = [{section: {index: pool[row] for index, row in sections[section]}
+                    for section in phase1.SECTIONS} for sections in group]
+        start = time.perf_counter()
+        phase1.assign_vectors(shells, vectors)
+        numpy_avg += time.perf_counter() - start
+
+        for k, shell in enumerate(shells):
+            for j, key in enumerate(("hyde_query_avg", "hyde_answer_avg")):
+                diff = np.abs(shell["hyde_components"][key] - np.asarray(legacy[2 * k + j])).max()
+                max_diff = max(max_diff, float(diff))
+
+    n = len(products)
+    print(f"{'step':<22} {'legacy s':>9} {'numpy s':>9} {'legacy us/prod':>15} {'numpy us/prod':>14} {'speedup':>8}")
+    for label, old, new in (("zero-fill", legacy_fill, numpy_fill), ("HyDE averages", legacy_avg, numpy_avg)):
+        print(f"{label:<22} {old:>9.2f} {new:>9.2f} {old / n * 1e6:>15.1f} {new / n * 1e6:>14.1f} "
+              f"{old / new:>7.1f}x")
+    print(f"max |legacy - numpy| over all averages: {max_diff:.2e}")
+
+
+def top_k(docs: np.ndarray, query: np.ndarray, k: int) -> np.ndarray:
+    """Row ids of the k best dot products, best first."""
+    scores = docs @ query
+    best = np.argpartition(-scores, k - 1)[:k]
+    return best[np.argsort(-scores[best])]
+
+
+def dims_inputs(args):
+    """Full-size (documents, queries, label), both L2-normalised."""
+    rng = np.random.default_rng(7)
+    if args.store:
+        store = VectorStore(args.store)
+        docs = np.asarray(store.matrix("chunk"), dtype=np.float32)
+        queries = store.matrix("hyde_query")
+        pick = rng.choice(len(queries), size=min(args.queries, len(queries)), replace=False)
+        queries = np.asarray(queries[np.sort(pick)], dtype=np.float32)
+        label = f"{args.store}: {store.model}"
+    else:
+        provider = make_provider(args.provider, dims=args.full_dims)
+        products = load_products(args)
+        primary = [p["searchable_chunks"][0]["content"] for p in products if p.get("searchable_chunks")]
+        asked = [q for p in products for q in p.get("hyde_components", {}).get("hypothetical_queries", [])[:1]]
+        pick = rng.choice(len(asked), size=min(args.queries, len(asked)), replace=False)
+        docs = np.concatenate([provider.embed(primary[i:i + 256]) for i in range(0, len(primary), 256)])
+        queries = provider.embed([asked[i] for i in np.sort(pick)])
+        label = f"{len(products)} products, {provider.name} {provider.model}"
+    return truncate(docs, docs.shape[1]), truncate(queries, queries.shape[1]), label
+
+
+def bench_dims(args):
+    docs, queries, label = dims_inputs(args)
+    full = docs.shape[1]
+    k = args.k
+    print(f"{label}: {len(docs)} documents, {len(queries)} queries, {full} dims, recall@{k}")
+    # a found document counts when it scores at least the k-th best at full size (ties are common)
+    cutoff = [float((docs @ q)[top_k(docs, q, k)[-1]]) - 1e-6 for q in queries]
+
+    print(f"{'dims':>6} {'mode':<12} {'recall@k':>9} {'ms/query':>9} {'MB index':>9}")
+    for dims in [d for d in args.dims if d < full] + [full]:
+        small_docs, small_queries = truncate(docs, dims), truncate(queries, dims)
+        modes = ["single"] if dims == full else ["single", "two-stage"]
+        for mode in modes:
+            results, start = [], time.perf_counter()
+            for q, q_full in zip(small_queries, queries):
+                if mode == "single":
+                    results.append(top_k(small_docs, q, k))
+                else:
+                    candidates = top_k(small_docs, q, k * args.factor)
+                    results.append(candidates[top_k(docs[candidates], q_full, k)])
+            ms = (time.perf_counter() - start) / len(queries) * 1000
+            hits = sum(int((docs[found] @ q_full >= threshold).sum())
+                       for found, q_full, threshold in zip(results, queries, cutoff))
+            print(f"{dims:>6} {mode:<12} {hits / (k * len(queries)):>9.3f} {ms:>9.2f} "
+                  f"{small_docs.nbytes / 1e6:>9.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Phase 1 benchmarks")
+    sub = parser.add_subparsers(dest="bench", required=True)
+
+    p = sub.add_parser("averaging", help="NumPy segmented-mean averaging vs the original list code")
+    p.add_argument("--products", type=int, default=20000)
+    p.add_argument("--input", type=Path, default=None,
+                   help="a products_hierarchical.json to use instead of a synthetic catalog")
+    p.add_argument("--group", type=int, default=256,
+                   help="products averaged together (phase1 batches what completes together)")
+    p.set_defaults(func=bench_averaging)
+
+    p = sub.add_parser("dims", help="recall and latency of reduced-dimension and two-stage search")
+    p.add_argument("--store", type=Path, default=None, help="a phase1 vector store directory")
+    p.add_argument("--products", type=int, default=5000)
+    p.add_argument("--input", type=Path, default=None,
+                   help="a products_hierarchical.json to use instead of a synthetic catalog")
+    p.add_argument("--provider", default="hashing", help="embedding provider without --store")
+    p.add_argument("--full-dims", type=int, default=1024, help="provider dims without --store")
+    p.add_argument("--dims", type=int, nargs="+", default=[256, 512, 1024])
+    p.add_argument("--queries", type=int, default=200)
+    p.add_argument("--k", type=int, default=10)
+    p.add_argument("--factor", type=int, default=3,
+                   help="two-stage candidates per result kept (phase3's RESCORE_FACTOR)")
+    p.set_defaults(func=bench_dims)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
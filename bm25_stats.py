@@ -0,0 +1,177 @@
+"""
+Precomputed BM25 statistics
+===========================
+enriched_data/bm25_stats.npz — written by phase0 next to bm25_corpus.json.
+
+Phase 3 used to re-tokenize every document and build rank_bm25.BM25Okapi
+on each boot. Phase0 now runs the same analyzer once (bm25_tokens) and
+stores what the index needs:
+
+    vocab        str[V]    terms in first-seen order (BM25Okapi's order)
+    df, idf      [V]       document frequency, Okapi idf with the epsilon floor
+    doc_len      int32[N]  tokens per document
+    doc_ptr      int64[N+1], term_ids int32[nnz], term_tf int32[nnz]
+                           per-document distinct terms (CSR, first-seen order)
+    avgdl, average_idf, k1, b, epsilon, corpus_sha256
+
+corpus_sha256 is the digest of the bm25_corpus.json bytes the statistics
+were built from; BM25Stats.load() refuses a file built from another corpus.
+get_scores() returns exactly what BM25Okapi(...).get_scores() returns for
+the same corpus and query, but only touches documents containing a query term.
+
+    from bm25_stats import BM25Stats
+    index = BM25Stats.load(path, corpus_sha256=hashlib.sha256(raw).hexdigest())
+    scores = index.get_scores(query.lower().split())
+"""
+
+import os, math, hashlib
+from array import array
+from collections import Counter
+from pathlib import Path
+from typing import Dict, List, Optional
+
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+
+BM25_STATS_NAME = "bm25_stats.npz"
+
+# rank_bm25.BM25Okapi defaults
+K1      = 1.5
+B       = 0.75
+EPSILON = 0.25
+
+
+def bm25_tokens(doc: Dict) -> List[str]:
+    """The BM25 analyzer: lowercased whitespace tokens of the text, then the lowercased keywords."""
+    tokens = doc["text"].lower().split()
+    tokens += [k.lower() for k in doc.get("keywords", [])]
+    return tokens
+
+
+def okapi_idf(df: List[int], n_docs: int, epsilon: float = EPSILON):
+    """(idf list, average_idf) computed term by term in vocab order, as BM25Okapi does."""
+    idf = []
+    idf_sum = 0
+    for freq in df:
+        value = math.log(n_docs - freq + 0.5) - math.log(freq + 0.5)
+        idf.append(value)
+        idf_sum += value
+    average_idf = idf_sum / len(idf) if idf else 0.0
+    eps = epsilon * average_idf
+    return [eps if value < 0 else value for value in idf], average_idf
+
+
+class BM25StatsWriter:
+    """
+    Collects term ids per bm25_corpus document and writes the .npz on close().
+    corpus_path must be final (closed) by then: its sha256 is recorded.
+    Staged as <name>.tmp and renamed into place; abort() discards it.
+    """
+
+    def __init__(self, path: Path, corpus_path: Path):
+        if not NUMPY_AVAILABLE:
+            raise RuntimeError("numpy is required for BM25 statistics: pip install numpy")
+        self.path = path
+        self.corpus_path = corpus_path
+        self.count = 0
+        self.vocab: Dict[str, int] = {}
+        self.doc_len = array("i")
+        self.doc_ptr = array("q", [0])
+        self.term_ids = array("i")
+        self.term_tf = array("i")
+        self.num_tokens = 0
+
+    def write(self, bm25_entry: Dict) -> None:
+        tokens = bm25_tokens(bm25_entry)
+        frequencies = Counter(tokens)            # first-seen order, like BM25Okapi
+        vocab = self.vocab
+        self.term_ids.extend([vocab.setdefault(term, len(vocab)) for term in frequencies])
+        self.term_tf.extend(frequencies.values())
+        self.doc_len.append(len(tokens))
+        self.doc_ptr.append(len(self.term_ids))
+        self.num_tokens += len(tokens)
+        self.count += 1
+
+    def close(self) -> None:
+        term_ids = np.frombuffer(self.term_ids, dtype=np.int32)
+        df = np.bincount(term_ids, minlength=len(self.vocab))
+        idf, average_idf = okapi_idf(df.tolist(), self.count)
+        digest = hashlib.sha256()
+        with open(self.corpus_path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+        corpus_sha256 = digest.hexdigest()
+        arrays = {
+            "vocab":         np.array(list(self.vocab), dtype=str),
+            "df":            df,
+            "idf":           np.array(idf, dtype=np.float64),
+            "doc_len":       np.frombuffer(self.doc_len, dtype=np.int32),
+            "doc_ptr":       np.frombuffer(self.doc_ptr, dtype=np.int64),
+            "term_ids":      term_ids,
+            "term_tf":       np.frombuffer(self.term_tf, dtype=np.int32),
+            "avgdl":         np.float64(self.num_tokens / self.count if self.count else 0.0),
+            "average_idf":   np.float64(average_idf),
+            "k1":            np.float64(K1),
+            "b":             np.float64(B),
+            "epsilon":       np.float64(EPSILON),
+            "corpus_sha256": np.array(corpus_sha256),
+        }
+        tmp = self.path.with_name(self.path.name + ".tmp")
+        with open(tmp, "wb") as f:
+            np.savez(f, **arrays)
+        os.replace(tmp, self.path)
+
+    def abort(self) -> None:
+        self.path.with_name(self.path.name + ".tmp").unlink(missing_ok=True)
+
+
+class BM25Stats:
+    """BM25Okapi-compatible scorer over a bm25_stats.npz (term-major postings built at load)."""
+
+    def __init__(self, arrays: Dict[str, "np.ndarray"]):
+        self.vocab = {term: i for i, term in enumerate(arrays["vocab"].tolist())}
+        self.idf = arrays["idf"].tolist()
+        self.doc_len = arrays["doc_len"].astype(np.int64)
+        self.corpus_size = len(self.doc_len)
+        self.avgdl = float(arrays["avgdl"])
+        self.average_idf = float(arrays["average_idf"])
+        self.k1 = float(arrays["k1"])
+        self.b = float(arrays["b"])
+        self.epsilon = float(arrays["epsilon"])
+        self.corpus_sha256 = str(arrays["corpus_sha256"])
+
+        term_ids = arrays["term_ids"]
+        order = np.argsort(term_ids, kind="stable")
+        docs = np.repeat(np.arange(self.corpus_size), np.diff(arrays["doc_ptr"]))
+        self.post_docs = docs[order]
+        self.post_tf = arrays["term_tf"][order].astype(np.int64)
+        self.post_ptr = np.zeros(len(self.idf) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(term_ids, minlength=len(self.idf)), out=self.post_ptr[1:])
+
+    @classmethod
+    def load(cls, path: Path, corpus_sha256: Optional[str] = None) -> Optional["BM25Stats"]:
+        """The statistics in path, or None when they were built from a different corpus."""
+        if not NUMPY_AVAILABLE:
+            raise RuntimeError("numpy is required to read BM25 statistics: pip install numpy")
+        with np.load(path, allow_pickle=False) as npz:
+            if corpus_sha256 is not None and str(npz["corpus_sha256"]) != corpus_sha256:
+                return None
+            return cls({name: npz[name] for name in npz.files})
+
+    def get_scores(self, query: List[str]) -> "np.ndarray":
+        score = np.zeros(self.corpus_size)
+        k1, b, avgdl = self.k1, self.b, self.avgdl
+        for q in query:
+            term_id = self.vocab.get(q)
+            if term_id is None or not self.idf[term_id]:
+                continue
+            lo, hi = self.post_ptr[term_id], self.post_ptr[term_id + 1]
+            docs = self.post_docs[lo:hi]
+            q_freq = self.post_tf[lo:hi]
+            doc_len = self.doc_len[docs]
+            score[docs] += self.idf[term_id] * (q_freq * (k1 + 1) /
+                                                (q_freq + k1 * (1 - b + b * doc_len / avgdl)))
+        return score
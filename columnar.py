@@ -0,0 +1,118 @@
+"""
+Columnar product table
+======================
+enriched_data/products_columnar.npz — written by phase0 with --columnar.
+
+One NumPy array per column; row i is the i-th product of
+products_hierarchical.json and the i-th document of bm25_corpus.json.
+Categorical columns are dictionary-encoded: "<col>" holds int32 codes and
+"<col>__categories" the distinct values in first-seen order. An .npz is a
+zip of .npy members that is read lazily, so load_columns() only
+decompresses the columns asked for.
+
+    from columnar import load_columns
+    cols = load_columns(path, ["price", "gender"])
+"""
+
+import os
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional
+
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+
+COLUMNAR_NAME = "products_columnar.npz"
+
+STRING_COLUMNS      = ("product_id", "name")
+CATEGORICAL_COLUMNS = ("gender", "product_type", "category_l1", "color", "fabric")
+NUMERIC_COLUMNS     = {"price": "float64", "size_ml": "float64", "in_stock": "bool"}
+COLUMNS = STRING_COLUMNS + CATEGORICAL_COLUMNS + tuple(NUMERIC_COLUMNS)
+
+
+def product_columns(product) -> Dict[str, Any]:
+    """Column values of one processed phase0 product (a ProductRecord)."""
+    return {
+        "product_id":   product.product_id,
+        "name":         product.name,
+        "gender":       product.gender,
+        "product_type": product.product_type,
+        "category_l1":  product.category_l1,
+        "color":        product.color,
+        "fabric":       product.fabric,
+        "price":        product.price_numeric,
+        "size_ml":      product.size_ml,
+        "in_stock":     product.in_stock,
+    }
+
+
+class ColumnarWriter:
+    """
+    Collects one row per product and writes the .npz on close().
+    Rows are kept as codes and scalars, not product dicts. The file is
+    staged as <name>.tmp and renamed into place; abort() discards it.
+    """
+
+    def __init__(self, path: Path):
+        if not NUMPY_AVAILABLE:
+            raise RuntimeError("numpy is required for the columnar export: pip install numpy")
+        self.path = path
+        self.count = 0
+        self._values: Dict[str, List] = {c: [] for c in COLUMNS}
+        self._categories: Dict[str, Dict[str, int]] = {c: {} for c in CATEGORICAL_COLUMNS}
+
+    def write(self, product) -> None:
+        for column, value in product_columns(product).items():
+            if column in self._categories:
+                value = self._categories[column].setdefault(value, len(self._categories[column]))
+            self._values[column].append(value)
+        self.count += 1
+
+    def close(self) -> None:
+        arrays = {}
+        for column in STRING_COLUMNS:
+            arrays[column] = np.array(self._values[column], dtype=str)
+        for column in CATEGORICAL_COLUMNS:
+            arrays[column] = np.array(self._values[column], dtype=np.int32)
+            arrays[f"{column}__categories"] = np.array(list(self._categories[column]), dtype=str)
+        for column, dtype in NUMERIC_COLUMNS.items():
+            arrays[column] = np.array(self._values[column], dtype=dtype)
+
+        tmp = self.path.with_name(self.path.name + ".tmp")
+        with open(tmp, "wb") as f:
+            np.savez_compressed(f, **arrays)
+        os.replace(tmp, self.path)
+
+    def abort(self) -> None:
+        self.path.with_name(self.path.name + ".tmp").unlink(missing_ok=True)
+
+
+def load_columns(path: Path, columns: Optional[Iterable[str]] = None,
+                 decode: bool = True) -> Dict[str, "np.ndarray"]:
+    """
+    Read the requested columns (default: all) from a products_columnar.npz.
+    decode=True turns categorical codes back into string arrays; with
+    decode=False the int32 codes are returned together with
+    "<col>__categories" for each categorical column asked for.
+    """
+    if not NUMPY_AVAILABLE:
+        raise RuntimeError("numpy is required to read the columnar export: pip install numpy")
+    columns = list(COLUMNS if columns is None else columns)
+    unknown = [c for c in columns if c not in COLUMNS]
+    if unknown:
+        raise KeyError(f"unknown columns: {unknown}")
+
+    out = {}
+    with np.load(path, allow_pickle=False) as npz:
+        for column in columns:
+            values = npz[column]
+            if column in CATEGORICAL_COLUMNS:
+                categories = npz[f"{column}__categories"]
+                if decode:
+                    values = categories[values]
+                else:
+                    out[f"{column}__categories"] = categories
+            out[column] = values
+    return out
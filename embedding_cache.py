@@ -0,0 +1,99 @@
+"""
+Embedding cache
+===============
+EMBEDDINGS_DIR/embedding_cache.sqlite: one float32 vector per (model, dims, text).
+
+Phase1 looks every chunk, HyDE query and HyDE answer up here before calling
+the API and stores what it had to embed, so a rerun over an unchanged
+catalog sends nothing. Keys are sha256(model, dims, text); vectors are
+stored as raw little-endian float32 (4 bytes per dimension).
+
+    cache = EmbeddingCache(path, "text-embedding-3-large", 3072)
+    found = cache.get_many(texts)           # text -> vector, hits only
+    cache.put_many(zip(misses, vectors))
+    cache.evict(cache.key(t) for t in texts_in_catalog)
+
+`python phase1_embedding.py --evict-cache` drops the entries the current
+catalog no longer references.
+"""
+
+import sqlite3, hashlib
+from pathlib import Path
+from typing import Dict, Iterable, Tuple
+
+import numpy as np
+
+CACHE_NAME = "embedding_cache.sqlite"
+LOOKUP_CHUNK = 500               # keys per SELECT, below SQLite's variable limit
+
+
+class EmbeddingCache:
+    """Content-addressed float32 vectors for one model and dimension count."""
+
+    def __init__(self, path: Path, model: str, dims: int):
+        self.path = path
+        self.model = model
+        self.dims = dims
+        self.hits = 0
+        self.misses = 0
+        self.stored = 0
+        self._prefix = f"{model}\0{dims}\0".encode("utf-8")
+        self._db = sqlite3.connect(path)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS embeddings "
+                         "(key BLOB PRIMARY KEY, vector BLOB NOT NULL) WITHOUT ROWID")
+
+    def key(self, text: str) -> bytes:
+        return hashlib.sha256(self._prefix + text.encode("utf-8")).digest()
+
+    def get_many(self, texts: Iterable[str]) -> Dict[str, np.ndarray]:
+        """Cached float32 vector of every text that has one; counts hits and misses."""
+        keys: Dict[bytes, str] = {self.key(t): t for t in texts}
+        found: Dict[str, np.ndarray] = {}
+        pending = list(keys)
+        for i in range(0, len(pending), LOOKUP_CHUNK):
+            chunk = pending[i:i + LOOKUP_CHUNK]
+            rows = self._db.execute(
+                f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(chunk))})", chunk)
+            for key, blob in rows:
+                found[keys[key]] = np.frombuffer(blob, dtype="<f4")
+        self.hits += len(found)
+        self.misses += len(keys) - len(found)
+        return found
+
+    def put_many(self, items: Iterable[Tuple[str, np.ndarray]]) -> None:
+        """Store (text, vector) pairs in one transaction."""
+        rows = [(self.key(text), np.asarray(vector, dtype="<f4").tobytes()) for text, vector in items]
+        with self._db:
+            self._db.executemany("INSERT OR REPLACE INTO embeddings VALUES (?, ?)", rows)
+        self.stored += len(rows)
+
+    def __len__(self) -> int:
+        return self._db.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    def evict(self, keep: Iterable[bytes]) -> int:
+        """Delete every entry whose key is not in `keep`; returns how many went."""
+        with self._db:
+            self._db.execute("CREATE TEMP TABLE IF NOT EXISTS keep (key BLOB PRIMARY KEY) WITHOUT ROWID")
+            self._db.execute("DELETE FROM keep")
+            self._db.executemany("INSERT OR IGNORE INTO keep VALUES (?)", ((k,) for k in keep))
+            removed = self._db.execute(
+                "DELETE FROM embeddings WHERE key NOT IN (SELECT key FROM keep)").rowcount
+            self._db.execute("DROP TABLE keep")
+        self._db.execute("VACUUM")
+        return removed
+
+    def report(self) -> Dict:
+        lookups = self.hits + self.misses
+        return {
+            "path": str(self.path),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "stored": self.stored,
+            "entries": len(self),
+        }
+
+    def close(self) -> None:
+        self._db.close()
@@ -0,0 +1,325 @@
+"""
+Concurrent embedding engine
+===========================
+Used by phase1 to keep several embedding requests in flight without
+tripping the provider's rate limits.
+
+    engine = EmbeddingEngine(make_provider())      # embedding_providers.py
+    vectors = await engine.embed(["first text", "second text"])
+
+RateGovernor holds two token buckets, requests/min and tokens/min. A request
+waits until both can cover it. The buckets follow the provider:
+
+  • x-ratelimit-{limit,remaining}-{requests,tokens} on every response resize
+    the buckets and pull their level down to what the server says is left;
+  • a 429 pauses every request for retry-after seconds and halves the refill
+    rate, which then recovers by 5% of the limit per successful request.
+
+EmbeddingEngine.embed() takes one of max_in_flight slots, waits for the
+governor and retries transient failures (connection errors, timeouts, 408,
+409, 429, 5xx: see is_transient) up to max_retries times, with exponential
+backoff and jitter. A response without one row per text counts as a failed
+request (check_rows). The request itself is the provider's aembed(); only the
+OpenAI provider returns rate-limit headers, so the governor never holds
+back a local one. embed_isolated() splits a batch that fails for any other
+reason (the API rejecting it, a local model raising on an input) in half,
+recursively, so only the offending inputs fail; it reports them instead of
+raising.
+
+Tokenizer counts tokens with tiktoken when it is installed (the model's own
+encoding), otherwise with a byte-based estimate that errs high. It is the
+default provider.tokenizer; the engine counts a request's tokens for the
+governor with provider.count_tokens().
+"""
+
+import re, time, errno, random, asyncio
+from collections import Counter
+from typing import Dict, List, Mapping, Optional, Tuple
+
+import numpy as np
+
+try:
+    from openai import RateLimitError, APIConnectionError       # APITimeoutError is a subclass
+except ImportError:
+    RateLimitError = APIConnectionError = None
+
+try:
+    import tiktoken
+    TIKTOKEN_AVAILABLE = True
+except ImportError:
+    TIKTOKEN_AVAILABLE = False
+
+REQUESTS_PER_MINUTE = 3000
+TOKENS_PER_MINUTE   = 1_000_000
+MAX_IN_FLIGHT       = 8
+MAX_RETRIES         = 3
+RETRY_DELAY         = 2          # seconds, doubled every attempt
+MAX_BACKOFF         = 60         # seconds
+RATE_LIMIT_PAUSE    = 1.0        # 429 without a retry-after header
+MIN_RATE_SCALE      = 0.1
+RECOVERY_STEP       = 0.05
+MAX_INPUT_TOKENS    = 8191       # text-embedding-3-* context length
+BYTES_PER_TOKEN     = 3          # fallback estimate; English averages ~4
+
+_DURATION = re.compile(r"(\d+(?:\.\d+)?)(ms|s|m|h)")
+_UNIT_SECONDS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+
+
+def parse_duration(value: str) -> Optional[float]:
+    """Seconds in a rate-limit reset value such as "20ms", "1s" or "6m0s"."""
+    parts = _DURATION.findall(value or "")
+    if not parts:
+        return None
+    return sum(float(amount) * _UNIT_SECONDS[unit] for amount, unit in parts)
+
+
+def retry_after(headers: Mapping[str, str]) -> Optional[float]:
+    """retry-after-ms / retry-after of a 429 response, in seconds."""
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        if headers.get("retry-after"):
+            return float(headers["retry-after"])
+    except ValueError:
+        pass
+    return None
+
+
+def backoff(attempt: int, base: float = RETRY_DELAY, cap: float = MAX_BACKOFF) -> float:
+    """Seconds to wait before retry `attempt` + 1: base * 2**attempt (capped), half of it jittered."""
+    delay = min(cap, base * 2 ** attempt)
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+def is_transient(error: Exception) -> bool:
+    """
+    Worth retrying: a connection error or timeout (the API client's, asyncio's
+    or the OS's), or HTTP 408/409/429/5xx. Anything else, a 4xx or an error a
+    local model raised on its input, is taken to be about the texts sent.
+    """
+    if APIConnectionError is not None and isinstance(error, APIConnectionError):
+        return True
+    if isinstance(error, (asyncio.TimeoutError, TimeoutError, ConnectionError)):
+        return True
+    if isinstance(error, OSError) and error.errno == errno.ETIMEDOUT:
+        return True
+    status = getattr(error, "status_code", None)
+    return isinstance(status, int) and (status in (408, 409, 429) or status >= 500)
+
+
+def check_rows(vectors, texts: List[str]):
+    """
+    `vectors` if it has one row per text. A response with more or fewer rows
+    cannot be matched up with the texts sent, so it raises ValueError, which
+    is_transient() treats like a rejected request: split or reported, never
+    zipped short.
+    """
+    if len(vectors) != len(texts):
+        raise ValueError(f"provider returned {len(vectors)} vectors for {len(texts)} texts")
+    return vectors
+
+
+class Tokenizer:
+    """Token counts and token windows for one embedding model."""
+
+    def __init__(self, model: str):
+        self.encoding = None
+        if TIKTOKEN_AVAILABLE:
+            try:
+                self.encoding = tiktoken.encoding_for_model(model)
+            except KeyError:
+                self.encoding = tiktoken.get_encoding("cl100k_base")
+        self.name = self.encoding.name if self.encoding else f"estimate ({BYTES_PER_TOKEN} bytes/token)"
+
+    def count(self, text: str) -> int:
+        if self.encoding is not None:
+            return len(self.encoding.encode(text, disallowed_special=()))
+        return len(text.encode("utf-8")) // BYTES_PER_TOKEN + 1
+
+    def split(self, text: str, max_tokens: int = MAX_INPUT_TOKENS) -> List[str]:
+        """`text` cut into consecutive pieces of at most max_tokens tokens each."""
+        if self.encoding is not None:
+            ids = self.encoding.encode(text, disallowed_special=())
+            return [self.encoding.decode(ids[i:i + max_tokens]) for i in range(0, len(ids), max_tokens)]
+        pieces, piece, size = [], [], 0
+        for ch in text:
+            width = len(ch.encode("utf-8"))
+            if piece and size + width > (max_tokens - 1) * BYTES_PER_TOKEN:
+                pieces.append("".join(piece))
+                piece, size = [], 0
+            piece.append(ch)
+            size += width
+        if piece:
+            pieces.append("".join(piece))
+        return pieces
+
+
+class TokenBucket:
+    """`limit` units per minute, refilled continuously; starts full."""
+
+    def __init__(self, limit: float, clock=time.monotonic):
+        self.clock = clock
+        self.limit = float(limit)
+        self.scale = 1.0
+        self.level = float(limit)
+        self.updated = clock()
+
+    def _refill(self) -> None:
+        now = self.clock()
+        rate = self.limit * self.scale / 60
+        self.level = min(self.limit, self.level + (now - self.updated) * rate)
+        self.updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """Seconds until `amount` units are available (amounts above the limit wait for a full bucket)."""
+        self._refill()
+        missing = min(amount, self.limit) - self.level
+        return max(0.0, missing / (self.limit * self.scale / 60))
+
+    def take(self, amount: float) -> None:
+        self._refill()
+        self.level -= min(amount, self.limit)
+
+    def observe(self, limit: Optional[str], remaining: Optional[str]) -> None:
+        """Adopt the server's limit and remaining budget for this window."""
+        self._refill()
+        try:
+            if limit:
+                self.limit = max(1.0, float(limit))
+            if remaining is not None and remaining != "":
+                self.level = min(self.level, float(remaining))
+        except ValueError:
+            pass
+
+
+class RateGovernor:
+    """Requests/min and tokens/min buckets shared by all in-flight requests."""
+
+    def __init__(self, requests_per_minute: float = REQUESTS_PER_MINUTE,
+                 tokens_per_minute: float = TOKENS_PER_MINUTE, clock=time.monotonic):
+        self.clock = clock
+        self.requests = TokenBucket(requests_per_minute, clock)
+        self.tokens = TokenBucket(tokens_per_minute, clock)
+        self.paused_until = 0.0
+        self._turn = asyncio.Lock()          # waiters are served in arrival order
+
+    async def acquire(self, tokens: int) -> float:
+        """Wait until one request of `tokens` tokens fits; returns the seconds waited."""
+        start = self.clock()
+        async with self._turn:
+            while True:
+                wait = max(self.paused_until - self.clock(),
+                           self.requests.wait_time(1), self.tokens.wait_time(tokens))
+                if wait <= 0:
+                    self.requests.take(1)
+                    self.tokens.take(tokens)
+                    return self.clock() - start
+                await asyncio.sleep(wait)
+
+    def observe(self, headers: Mapping[str, str]) -> None:
+        """A successful response: sync with its rate-limit headers and recover the refill rate."""
+        self.requests.observe(headers.get("x-ratelimit-limit-requests"),
+                              headers.get("x-ratelimit-remaining-requests"))
+        self.tokens.observe(headers.get("x-ratelimit-limit-tokens"),
+                            headers.get("x-ratelimit-remaining-tokens"))
+        for bucket in (self.requests, self.tokens):
+            bucket._refill()
+            bucket.scale = min(1.0, bucket.scale + RECOVERY_STEP)
+
+    def throttled(self, headers: Mapping[str, str]) -> float:
+        """A 429: pause everyone for retry-after and halve the refill rate. Returns the pause."""
+        pause = retry_after(headers)
+        if pause is None:
+            pause = max(parse_duration(headers.get("x-ratelimit-reset-requests", "")) or 0,
+                        parse_duration(headers.get("x-ratelimit-reset-tokens", "")) or 0) or RATE_LIMIT_PAUSE
+        self.paused_until = max(self.paused_until, self.clock() + pause)
+        for bucket in (self.requests, self.tokens):
+            bucket._refill()
+            bucket.scale = max(MIN_RATE_SCALE, bucket.scale / 2)
+            bucket.level = 0.0
+        return pause
+
+
+class EmbeddingEngine:
+    """
+    Embeds lists of texts with an embedding provider (provider.aembed), at
+    most max_in_flight requests at a time and within the governor's budget.
+    """
+
+    def __init__(self, provider, max_in_flight: int = MAX_IN_FLIGHT,
+                 requests_per_minute: float = REQUESTS_PER_MINUTE,
+                 tokens_per_minute: float = TOKENS_PER_MINUTE,
+                 max_retries: int = MAX_RETRIES, retry_delay: float = RETRY_DELAY):
+        self.provider = provider
+        self.model = provider.model
+        self.max_in_flight = max_in_flight
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.governor = RateGovernor(requests_per_minute, tokens_per_minute)
+        self.tokenizer = provider.tokenizer
+        self.stats: Counter = Counter()
+        self._slots = asyncio.Semaphore(max_in_flight)
+
+    async def embed(self, texts: List[str], tokens: Optional[int] = None) -> np.ndarray:
+        """
+        float32 [len(texts), dims], one row per text, in order. `tokens` is the request's token count
+        when the caller has it. Raises the last error once retries are exhausted, or at once when the
+        error is not transient.
+        """
+        if tokens is None:
+            tokens = sum(self.provider.count_tokens(t) for t in texts)
+        async with self._slots:
+            for attempt in range(self.max_retries + 1):
+                self.stats["governor_wait_ms"] += round(await self.governor.acquire(tokens) * 1000)
+                self.stats["requests"] += 1
+                try:
+                    vectors, headers = await self.provider.aembed(texts)
+                    check_rows(vectors, texts)
+                except Exception as e:
+                    if attempt == self.max_retries or not is_transient(e):
+                        self.stats["failed_requests"] += 1
+                        raise
+                    if RateLimitError is not None and isinstance(e, RateLimitError):
+                        self.stats["rate_limited"] += 1
+                        self.governor.throttled(e.response.headers)
+                    else:
+                        self.stats["retries"] += 1
+                        await asyncio.sleep(backoff(attempt, self.retry_delay))
+                    continue
+                self.governor.observe(headers)
+                self.stats["inputs"] += len(texts)
+                self.stats["tokens"] += tokens
+                return vectors
+
+    async def embed_isolated(self, texts: List[str],
+                             tokens: List[int]) -> Tuple[List[Optional[np.ndarray]], Dict[int, str]]:
+        """
+        embed() that never raises: (vectors, errors), a vector per text or
+        None where it failed, and index → error message of each failure.
+        A batch rejected outright is split in half and each half sent again,
+        down to single texts; a transient error that outlasted the retries
+        fails the whole batch.
+        """
+        try:
+            return list(await self.embed(texts, tokens=sum(tokens))), {}
+        except Exception as e:
+            if len(texts) == 1 or is_transient(e):
+                self.stats["failed_inputs"] += len(texts)
+                message = f"{type(e).__name__}: {e}"
+                return [None] * len(texts), {i: message for i in range(len(texts))}
+        self.stats["bisections"] += 1
+        mid = len(texts) // 2
+        (left, left_errors), (right, right_errors) = await asyncio.gather(
+            self.embed_isolated(texts[:mid], tokens[:mid]),
+            self.embed_isolated(texts[mid:], tokens[mid:]))
+        return left + right, {**left_errors, **{mid + i: error for i, error in right_errors.items()}}
+
+    def report(self) -> Dict:
+        return {
+            **self.stats,
+            **self.provider.spec(),
+            "max_in_flight": self.max_in_flight,
+            "tokenizer": self.tokenizer.name,
+            "requests_per_minute": self.governor.requests.limit,
+            "tokens_per_minute": self.governor.tokens.limit,
+        }
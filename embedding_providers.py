@@ -0,0 +1,291 @@
+"""
+Embedding providers
+===================
+Where phase1 and phase3 get their vectors from. Pick one with EMBED_PROVIDER
+(and optionally EMBED_MODEL / EMBED_DIMS):
+
+    openai   text-embedding-3-large over the API (the default)
+    local    a sentence-transformers model on the CPU, no network; batches
+             run on a thread pool. EMBED_BACKEND=onnx runs it with
+             onnxruntime. Needs: pip install sentence-transformers
+    hashing  deterministic feature hashing of words and word pairs: no
+             model and no network, for tests and CI
+
+    provider = make_provider()
+    vectors = provider.embed(["first text", "second text"])   # float32 [2, dims]
+    vectors, headers = await provider.aembed(texts)           # EmbeddingEngine
+
+Every provider counts tokens and cuts texts into windows in its own units
+(count_tokens / split_text, at most max_input_tokens each): tiktoken or a
+byte estimate for the API models, the model's own tokenizer for a local one.
+Phase1 packs requests and splits oversized texts with them.
+
+Every provider has a spec(), {"provider", "model", "dims"}. Phase1 records
+model and dims in its vector store, phase2 writes the spec of what it
+ingested to EMBEDDINGS_DIR/ingested_embedding.json, and phase3 refuses to
+start when its own provider would produce vectors of another model or size.
+
+Reduced dimensions (Matryoshka): text-embedding-3-* vectors keep most of
+their quality when cut to their first 256/512/1024 components and
+renormalised — the API's `dimensions` parameter does exactly that. Set
+EMBED_DIMS to embed at that size throughout, or keep phase1 at full size and
+let phase2 ingest truncate()d vectors (EMBED_SEARCH_DIMS); phase3 then cuts
+its queries to match and can rescore candidates at full size.
+"""
+
+import os, re, abc, json, base64, asyncio, hashlib
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Mapping, Optional, Tuple
+
+import numpy as np
+
+from embedding_engine import Tokenizer
+
+try:
+    from sentence_transformers import SentenceTransformer
+    SENTENCE_TRANSFORMERS_AVAILABLE = True
+except ImportError:
+    SENTENCE_TRANSFORMERS_AVAILABLE = False
+
+OPENAI_MODEL   = "text-embedding-3-large"
+OPENAI_DIMS    = {"text-embedding-3-large": 3072, "text-embedding-3-small": 1536,
+                  "text-embedding-ada-002": 1536}
+OPENAI_MAX_INPUT_TOKENS = 8191
+LOCAL_MODEL    = "sentence-transformers/all-MiniLM-L6-v2"
+LOCAL_BATCH    = 64           # texts per encode() call
+HASHING_MODEL  = "hashing-v1"
+HASHING_DIMS   = 256
+INGESTED_SPEC_NAME = "ingested_embedding.json"
+
+_WORD = re.compile(r"\w+")
+
+
+def decode_embedding(embedding) -> np.ndarray:
+    """float32 vector of one response item: base64 little-endian float32, or a list of floats."""
+    if isinstance(embedding, str):
+        return np.frombuffer(base64.b64decode(embedding), dtype="<f4")
+    return np.asarray(embedding, dtype=np.float32)
+
+
+class EmbeddingProvider(abc.ABC):
+    """Base class: `model` produces `dims`-dimensional float32 vectors. Subclasses implement embed()."""
+
+    name = "base"
+    max_input_tokens = OPENAI_MAX_INPUT_TOKENS
+
+    def __init__(self, model: str, dims: int):
+        self.model = model
+        self.dims = dims
+        self.tokenizer = Tokenizer(model)
+
+    def spec(self) -> Dict:
+        return {"provider": self.name, "model": self.model, "dims": self.dims}
+
+    def count_tokens(self, text: str) -> int:
+        """Tokens `text` takes up of max_input_tokens."""
+        return self.tokenizer.count(text)
+
+    def split_text(self, text: str) -> List[str]:
+        """`text` cut into consecutive pieces of at most max_input_tokens tokens each."""
+        return self.tokenizer.split(text, self.max_input_tokens)
+
+    @abc.abstractmethod
+    def embed(self, texts: List[str]) -> np.ndarray:
+        """float32 [len(texts), dims], one row per text, in order (blocking)."""
+
+    async def aembed(self, texts: List[str]) -> Tuple[np.ndarray, Mapping[str, str]]:
+        """embed() for the event loop: the matrix and the response's rate-limit headers (none here)."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self.embed, texts), {}
+
+
+class OpenAIProvider(EmbeddingProvider):
+    """
+    OpenAI embeddings API. Vectors are requested base64-encoded; `dims`
+    below the model's own size is passed on as the API's `dimensions`.
+    Clients are created on first use unless given, with the SDK's own
+    retries off: EmbeddingEngine (and phase1's embed_batch) retry and back
+    off, and the governor has to see every 429.
+    """
+
+    name = "openai"
+
+    def __init__(self, model: str = OPENAI_MODEL, dims: Optional[int] = None,
+                 client=None, async_client=None):
+        native = OPENAI_DIMS.get(model)
+        if dims is None and native is None:
+            raise ValueError(f"dims must be given for {model!r}")
+        super().__init__(model, dims or native)
+        self._kwargs = {"dimensions": self.dims} if self.dims != native else {}
+        self._client = client
+        self._async_client = async_client
+
+    @property
+    def client(self):
+        if self._client is None:
+            from openai import OpenAI
+            self._client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"), max_retries=0)
+        return self._client
+
+    @property
+    def async_client(self):
+        if self._async_client is None:
+            from openai import AsyncOpenAI
+            self._async_client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"), max_retries=0)
+        return self._async_client
+
+    @staticmethod
+    def _matrix(data) -> np.ndarray:
+        return np.stack([decode_embedding(item.embedding) for item in sorted(data, key=lambda item: item.index)])
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        resp = self.client.embeddings.create(model=self.model, input=texts,
+                                             encoding_format="base64", **self._kwargs)
+        return self._matrix(resp.data)
+
+    async def aembed(self, texts: List[str]) -> Tuple[np.ndarray, Mapping[str, str]]:
+        raw = await self.async_client.embeddings.with_raw_response.create(
+            model=self.model, input=texts, encoding_format="base64", **self._kwargs)
+        return self._matrix(raw.parse().data), raw.headers
+
+
+class EncoderTokenizer:
+    """Tokenizer's count / split in a Hugging Face tokenizer's units, [CLS]/[SEP] included."""
+
+    def __init__(self, tokenizer):
+        self.tokenizer = tokenizer
+        self.name = getattr(tokenizer, "name_or_path", "") or type(tokenizer).__name__
+        self.special = tokenizer.num_special_tokens_to_add()
+
+    def _ids(self, text: str) -> List[int]:
+        return self.tokenizer.encode(text, add_special_tokens=False, verbose=False)
+
+    def count(self, text: str) -> int:
+        return len(self._ids(text)) + self.special
+
+    def split(self, text: str, max_tokens: int) -> List[str]:
+        ids = self._ids(text)
+        size = max(1, max_tokens - self.special)
+        return [self.tokenizer.decode(ids[i:i + size]) for i in range(0, len(ids), size)]
+
+
+class LocalProvider(EmbeddingProvider):
+    """
+    A sentence-transformers model on the CPU (backend "torch" or "onnx").
+    Texts are encoded LOCAL_BATCH at a time, batches spread over `threads`
+    workers; vectors are L2-normalised, truncated to `dims` when given.
+    Tokens are counted with the model's own tokenizer, so max_input_tokens
+    (its max_seq_length) and the counts are in the same units.
+    """
+
+    name = "local"
+
+    def __init__(self, model: str = LOCAL_MODEL, dims: Optional[int] = None,
+                 batch_size: int = LOCAL_BATCH, threads: Optional[int] = None,
+                 backend: Optional[str] = None):
+        if not SENTENCE_TRANSFORMERS_AVAILABLE:
+            raise RuntimeError("the local provider needs sentence-transformers: pip install sentence-transformers"
+                               " (and onnxruntime for EMBED_BACKEND=onnx)")
+        kwargs = {"backend": backend} if backend else {}
+        self.encoder = SentenceTransformer(model, device="cpu", truncate_dim=dims, **kwargs)
+        super().__init__(model, self.encoder.get_sentence_embedding_dimension())
+        self.max_input_tokens = self.encoder.max_seq_length
+        self.tokenizer = EncoderTokenizer(self.encoder.tokenizer)
+        self.batch_size = batch_size
+        self.pool = ThreadPoolExecutor(max_workers=threads or os.cpu_count() or 1)
+
+    def _encode(self, texts: List[str]) -> np.ndarray:
+        vectors = self.encoder.encode(texts, batch_size=self.batch_size, convert_to_numpy=True,
+                                      normalize_embeddings=True, show_progress_bar=False)
+        return vectors.astype(np.float32, copy=False)
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        if len(texts) <= self.batch_size:
+            return self._encode(texts)
+        batches = [texts[i:i + self.batch_size] for i in range(0, len(texts), self.batch_size)]
+        return np.concatenate(list(self.pool.map(self._encode, batches)))
+
+    async def aembed(self, texts: List[str]) -> Tuple[np.ndarray, Mapping[str, str]]:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.pool, self._encode, texts), {}
+
+
+class HashingProvider(EmbeddingProvider):
+    """
+    Signed feature hashing of lower-cased words and adjacent word pairs,
+    L2-normalised. Deterministic across processes and machines; texts that
+    share words get similar vectors, which is enough to exercise retrieval.
+    """
+
+    name = "hashing"
+    max_input_tokens = 1 << 30
+
+    def __init__(self, model: str = HASHING_MODEL, dims: Optional[int] = None):
+        super().__init__(model, dims or HASHING_DIMS)
+
+    def _features(self, text: str) -> List[str]:
+        words = _WORD.findall(text.lower())
+        return words + [f"{a} {b}" for a, b in zip(words, words[1:])] or [text]
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        matrix = np.zeros((len(texts), self.dims), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for feature in self._features(text):
+                h = int.from_bytes(hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest(), "little")
+                matrix[row, h % self.dims] += 1.0 if h >> 63 else -1.0
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        return matrix / np.where(norms > 0, norms, 1.0)
+
+
+PROVIDERS = {"openai": OpenAIProvider, "local": LocalProvider, "hashing": HashingProvider}
+
+
+def make_provider(name: Optional[str] = None, model: Optional[str] = None,
+                  dims: Optional[int] = None) -> EmbeddingProvider:
+    """The provider named by `name` or EMBED_PROVIDER (default openai), with EMBED_MODEL / EMBED_DIMS."""
+    name = name or os.getenv("EMBED_PROVIDER", "openai")
+    model = model or os.getenv("EMBED_MODEL") or None
+    if dims is None and os.getenv("EMBED_DIMS"):
+        dims = int(os.environ["EMBED_DIMS"])
+    if name not in PROVIDERS:
+        raise ValueError(f"unknown embedding provider {name!r}; expected one of {', '.join(PROVIDERS)}")
+    kwargs = {"model": model} if model else {}
+    if name == "local" and os.getenv("EMBED_BACKEND"):
+        kwargs["backend"] = os.environ["EMBED_BACKEND"]
+    return PROVIDERS[name](dims=dims, **kwargs)
+
+
+def truncate(vectors: np.ndarray, dims: int) -> np.ndarray:
+    """The first `dims` components of each vector (a row or a matrix), renormalised."""
+    cut = np.asarray(vectors, dtype=np.float32)[..., :dims]
+    norms = np.linalg.norm(cut, axis=-1, keepdims=True)
+    return cut / np.where(norms > 0, norms, 1.0)
+
+
+def query_dims(ingested: Dict, spec: Dict) -> Optional[int]:
+    """
+    Size queries from a provider with `spec` must be truncate()d to for the
+    vectors described by `ingested`: its dims, its search dims when it holds
+    truncated vectors of the provider's full size, or None if they do not mix.
+    """
+    if ingested.get("model") != spec.get("model"):
+        return None
+    if ingested.get("dims") == spec.get("dims"):
+        return spec["dims"]
+    if ingested.get("full_dims") == spec.get("dims") and ingested.get("dims", 0) < spec["dims"]:
+        return ingested["dims"]
+    return None
+
+
+def write_spec(path: Path, spec: Dict, **extra) -> None:
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({**spec, **extra, "written_at": datetime.now().isoformat()}, f, indent=2)
+
+
+def read_spec(path: Path) -> Optional[Dict]:
+    if not path.exists():
+        return None
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
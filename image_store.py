@@ -0,0 +1,194 @@
+"""
+Image tensor store
+==================
+enriched_data/image_store.npy        uint8 [N, 224, 224, 3], one row per image_registry.json entry
+enriched_data/image_store_index.json product_id → row, dHash per image, failures, duplicate groups
+
+Written by phase0 with --images. Every registered product image is decoded,
+resized (shorter side → SIZE, bicubic) and centre-cropped to SIZE x SIZE RGB
+in a process pool; workers write their rows straight into the memory-mapped
+.npy, so no pixel data passes between processes. Rows of images that are
+missing or unreadable stay zero and are listed under "failed".
+
+Each image also gets a 64-bit difference hash (dHash). Photos whose hashes
+differ in at most DUPLICATE_HAMMING bits are grouped under "duplicate_groups"
+— the same product photo reused across SKUs, or resaved at another size.
+
+    from image_store import load_image_store
+    images, index = load_image_store(enriched_dir)
+    pixels = images[index["rows"]["prod_J0000001"]]      # (224, 224, 3) uint8
+"""
+
+import os, json
+from pathlib import Path
+from datetime import datetime
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+
+try:
+    from PIL import Image, ImageOps
+    PIL_AVAILABLE = True
+except ImportError:
+    PIL_AVAILABLE = False
+
+IMAGE_STORE_NAME  = "image_store.npy"
+IMAGE_INDEX_NAME  = "image_store_index.json"
+SIZE              = 224
+DUPLICATE_HAMMING = 3      # 4 bands of 16 bits: any pair within 3 bits shares a band
+TASK_IMAGES       = 32
+
+
+def preprocess_image(path: Path, size: int = SIZE) -> Tuple["np.ndarray", int]:
+    """(uint8 [size, size, 3] centre crop, 64-bit dHash) of one image file."""
+    with Image.open(path) as img:
+        img.draft("RGB", (size, size))        # JPEG: decode at the smallest scale >= size
+        img = ImageOps.exif_transpose(img).convert("RGB")
+
+    gray = np.asarray(img.convert("L").resize((9, 8), Image.BILINEAR), dtype=np.int16)
+    bits = (gray[:, 1:] > gray[:, :-1]).ravel()
+    dhash = int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+    w, h = img.size
+    scale = size / min(w, h)
+    nw, nh = max(size, round(w * scale)), max(size, round(h * scale))
+    if (nw, nh) != (w, h):
+        img = img.resize((nw, nh), Image.BICUBIC)
+    left, top = (nw - size) // 2, (nh - size) // 2
+    img = img.crop((left, top, left + size, top + size))
+    return np.asarray(img, dtype=np.uint8), dhash
+
+
+def process_images(store_path: Path, tasks: List[Tuple[int, str]], size: int = SIZE
+                   ) -> List[Tuple[int, Optional[int], Optional[str]]]:
+    """
+    Preprocess (row, file) pairs into the store's rows. Runs in a pool worker.
+    Returns (row, dhash, None) per image, or (row, None, error) when it failed.
+    """
+    store = np.load(store_path, mmap_mode="r+")
+    results = []
+    for row, path in tasks:
+        try:
+            store[row], dhash = preprocess_image(Path(path), size)
+            results.append((row, dhash, None))
+        except Exception as e:
+            results.append((row, None, f"{type(e).__name__}: {e}"))
+    store.flush()
+    del store
+    return results
+
+
+def duplicate_groups(hashes: Dict[str, int], max_distance: int = DUPLICATE_HAMMING) -> List[List[str]]:
+    """
+    Groups of product_ids whose dHashes are within max_distance bits.
+    Identical hashes are grouped first; distinct hashes that share one of four
+    16-bit bands are compared and joined with union-find.
+    """
+    by_hash: Dict[int, List[str]] = {}
+    for pid, h in hashes.items():
+        by_hash.setdefault(h, []).append(pid)
+    distinct = list(by_hash)
+    parent = list(range(len(distinct)))
+
+    def find(i: int) -> int:
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    buckets: Dict[Tuple[int, int], List[int]] = {}
+    for i, h in enumerate(distinct):
+        for band in range(4):
+            bucket = buckets.setdefault((band, (h >> (16 * band)) & 0xFFFF), [])
+            for j in bucket:
+                if find(i) != find(j) and bin(h ^ distinct[j]).count("1") <= max_distance:
+                    parent[find(i)] = find(j)
+            bucket.append(i)
+
+    groups: Dict[int, List[str]] = {}
+    for i, h in enumerate(distinct):
+        groups.setdefault(find(i), []).extend(by_hash[h])
+    return [sorted(g) for g in groups.values() if len(g) > 1]
+
+
+def _chunks(items: List, size: int) -> Iterator[List]:
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def build_image_store(registry: Iterable[Dict], image_root: Path, output_dir: Path,
+                      workers: int = 1, size: int = SIZE) -> Dict:
+    """
+    Build image_store.npy + image_store_index.json from image_registry.json
+    entries. image_root resolves relative image paths (the scraper's working
+    directory). Both files are staged as <name>.tmp and renamed into place.
+    Returns the index.
+    """
+    if not (NUMPY_AVAILABLE and PIL_AVAILABLE):
+        raise RuntimeError("numpy and Pillow are required for the image store: pip install numpy pillow")
+
+    entries = [(e["product_id"], e.get("image_path") or "") for e in registry]
+    store_path = output_dir / IMAGE_STORE_NAME
+    index_path = output_dir / IMAGE_INDEX_NAME
+    tmp_store = store_path.with_name(store_path.name + ".tmp")
+    tmp_index = index_path.with_name(index_path.name + ".tmp")
+
+    store = np.lib.format.open_memmap(tmp_store, mode="w+", dtype=np.uint8,
+                                      shape=(len(entries), size, size, 3))
+    del store                                  # zero-filled; workers reopen it r+
+
+    tasks = [(row, str(image_root / path)) for row, (_, path) in enumerate(entries)]
+    results = []
+    try:
+        if workers <= 1:
+            for chunk in _chunks(tasks, TASK_IMAGES):
+                results.extend(process_images(tmp_store, chunk, size))
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                pending = deque()
+                for chunk in _chunks(tasks, TASK_IMAGES):
+                    pending.append(pool.submit(process_images, tmp_store, chunk, size))
+                    if len(pending) >= workers * 2:
+                        results.extend(pending.popleft().result())
+                while pending:
+                    results.extend(pending.popleft().result())
+    except BaseException:
+        tmp_store.unlink(missing_ok=True)
+        raise
+
+    rows, dhash, failed = {}, {}, {}
+    for row, h, error in sorted(results):
+        pid = entries[row][0]
+        if error is None:
+            rows[pid] = row
+            dhash[pid] = h
+        else:
+            failed[pid] = error
+
+    index = {
+        "generated_at": datetime.now().isoformat(),
+        "shape": [len(entries), size, size, 3],
+        "dtype": "uint8",
+        "rows": rows,
+        "dhash": {pid: f"{h:016x}" for pid, h in dhash.items()},
+        "failed": failed,
+        "duplicate_groups": duplicate_groups(dhash),
+    }
+    with open(tmp_index, "w", encoding="utf-8") as f:
+        json.dump(index, f, indent=2, ensure_ascii=False)
+    os.replace(tmp_store, store_path)
+    os.replace(tmp_index, index_path)
+    return index
+
+
+def load_image_store(output_dir: Path) -> Tuple["np.ndarray", Dict]:
+    """(read-only memmap of image_store.npy, its index)."""
+    with open(output_dir / IMAGE_INDEX_NAME, encoding="utf-8") as f:
+        index = json.load(f)
+    return np.load(output_dir / IMAGE_STORE_NAME, mmap_mode="r"), index
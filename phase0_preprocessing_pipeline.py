@@ -0,0 +1,2389 @@
+#!/usr/bin/env python3
+"""
+═══════════════════════════════════════════════════════════════════════════════
+  J. E-COMMERCE MULTIMODAL RAG — MASTER PREPROCESSING PIPELINE
+═══════════════════════════════════════════════════════════════════════════════
+
+  INPUT:  j_products_detailed.json  (raw scraped data, streamed element by element)
+  OUTPUT: enriched_data/
+            ├── products_hierarchical.json   → Phase 1 (embeddings)
+            ├── products_attribute_indexed.json
+            ├── products_flat.csv
+            ├── bm25_corpus.json             → Phase 2/3 (sparse retrieval)
+            ├── bm25_stats.npz               tokenized corpus + idf tables, see bm25_stats.py
+            ├── image_registry.json          → CLIP embeddings
+            ├── products_columnar.npz        (--columnar) typed filter columns, see columnar.py
+            ├── image_store.npy              (--images) uint8 224×224 RGB crops, see image_store.py
+            ├── image_store_index.json       (--images) product_id → row, dHashes, duplicate photos
+            ├── phase0_near_duplicates.json  representative → colourway/variant product_ids
+            ├── pipeline_profile.json        (--profile) per-stage time/calls, slowest records
+            ├── phase0_manifest.json         sku → sha256(raw record), for incremental runs
+            └── phase0_changes.json          changed / removed product_ids since last run
+
+  WHAT THIS DOES:
+    1. Extracts GENDER from category_source URL (Men/Women/Boys/Girls/Kids/Unisex)
+    2. Extracts PRODUCT TYPE from attributes["Product Category"] + URL fallback
+    3. Parses FRAGRANCE NOTES from description_text (Top/Heart/Base/Accords/Size)
+    4. Extracts COLOR, FABRIC, SEASON, WEAR TYPE from attributes
+    5. Parses PRICE to numeric
+    6. Builds RICH SEARCHABLE CHUNKS (primary + detailed) for embedding
+    7. Generates context-aware HyDE QUERIES per product type
+    8. Builds ENRICHED KEYWORDS for BM25 sparse retrieval
+    9. Exports ALL output formats with COMPLETE metadata for filtering
+   10. Merges records scraped once per category URL into one product per SKU
+       and marks near-duplicate variants (colourways) of a representative
+"""
+
+import json, re, csv, os, sys, time, heapq, random, hashlib, argparse, functools
+from pathlib import Path
+from typing import Dict, List, Optional, Set, Tuple, Union, Any, Callable, Iterable, Iterator, NamedTuple
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime
+
+from columnar import ColumnarWriter, COLUMNAR_NAME, NUMPY_AVAILABLE
+from bm25_stats import BM25StatsWriter, BM25_STATS_NAME
+from image_store import build_image_store, IMAGE_STORE_NAME, PIL_AVAILABLE
+
+if NUMPY_AVAILABLE:
+    import numpy as np
+
+# ═════════════════════════════════════════════════════════════════════════════
+#  PATHS
+# ═════════════════════════════════════════════════════════════════════════════
+BASE_DIR   = Path(__file__).parent
+INPUT_FILE = BASE_DIR / "j_products_detailed.json"
+OUTPUT_DIR = BASE_DIR / "enriched_data"
+
+
+# ═════════════════════════════════════════════════════════════════════════════
+#  KEYWORD RULE ENGINE — shared by gender / product-type classification
+# ═════════════════════════════════════════════════════════════════════════════
+#  A rule is (label, groups). Each group is a list of (field, keyword)
+#  alternatives and a rule fires when every group has at least one hit; the
+#  first firing rule wins, so table order is rule precedence. A keyword
+#  starting with "^" must be a prefix of the field, one starting with "=" must
+#  equal it, anything else is a substring test.
+#
+#  Category URL / Product Category values repeat across thousands of
+#  products, so those tables memoise their decision per distinct input and
+#  evaluate the rules once per value. Product-name tables see unique inputs;
+#  they are flattened into a priority-ordered keyword list instead.
+
+RULE_CACHE_LIMIT = 1 << 16
+_MISS = object()
+
+
+def _any(field: str, *keywords: str) -> List[Tuple[str, str]]:
+    return [(field, k) for k in keywords]
+
+
+class KeywordRules:
+    """Prioritised keyword rules over a fixed tuple of text fields."""
+
+    def __init__(self, rules: List[Tuple[str, List[List[Tuple[str, str]]]]],
+                 fields: Tuple[str, ...], memoize: bool = True):
+        self.fields = fields
+        position = {f: i for i, f in enumerate(fields)}
+        self.rules = []
+        for label, groups in rules:
+            compiled = []
+            for group in groups:
+                tests = []
+                for field, keyword in group:
+                    kind = keyword[0] if keyword[:1] in ("^", "=") else ""
+                    tests.append((position[field], kind, keyword[len(kind):]))
+                compiled.append(tuple(tests))
+            self.rules.append((label, tuple(compiled)))
+        # one field, one group per rule, plain substrings → first-hit keyword list
+        self.flat = None
+        if len(fields) == 1 and all(
+                len(groups) == 1 and all(kind == "" for _, kind, _ in groups[0])
+                for _, groups in self.rules):
+            self.flat = tuple((kw, label) for label, (tests,) in self.rules for _, _, kw in tests)
+        self.memoize = memoize
+        self._cache: Dict[Tuple[str, ...], Optional[str]] = {}
+
+    def _evaluate(self, values: Tuple[str, ...]) -> Optional[str]:
+        if self.flat is not None:
+            text = values[0]
+            for keyword, label in self.flat:
+                if keyword in text:
+                    return label
+            return None
+        for label, groups in self.rules:
+            # for/else: a group with no hit breaks out, otherwise the rule fires
+            for tests in groups:
+                for i, kind, keyword in tests:
+                    text = values[i]
+                    if (keyword in text if not kind else
+                            text.startswith(keyword) if kind == "^" else text == keyword):
+                        break
+                else:
+                    break
+            else:
+                return label
+        return None
+
+    def match(self, *values: str) -> Optional[str]:
+        """Label of the first rule satisfied by the field values, or None."""
+        if not self.memoize:
+            return self._evaluate(values)
+        label = self._cache.get(values, _MISS)
+        if label is _MISS:
+            label = self._evaluate(values)
+            if len(self._cache) >= RULE_CACHE_LIMIT:
+                self._cache.clear()
+            self._cache[values] = label
+        return label
+
+
+# ═════════════════════════════════════════════════════════════════════════════
+#  1. GENDER CLASSIFICATION — from category_source URL (ground truth)
+# ═════════════════════════════════════════════════════════════════════════════
+
+_INFANT   = _any("path", "infant")
+_KIDS_MIX = _any("path", "^boys-girls/")
+_SYNCC    = _any("path", "syncc")
+_FEATURED = _any("path", "featured-collection", "co-ord")
+
+# Product Category overrides the URL when it explicitly indicates children's
+# products (Infant Girl, Girls 2 Piece, etc.) because these items may appear
+# under womens/ URLs (e.g. mama-me collection).
+GENDER_RULES = [
+    ("Girls",  [_any("pc", "^infant girl", "^girls", "=teens kurti", "=teens 2 piece", "=teens 3 piece")]),
+    ("Boys",   [_any("pc", "^infant kameez", "^infant boy", "^boys", "=teens kameez shalwar", "=teens kurta")]),
+    ("Men",    [_any("path", "^mens/", "^cast-crew/men")]),
+    ("Women",  [_any("path", "^womens/", "^syncc/women")]),
+    ("Boys",   [_any("path", "teen-boys", "kids-boys")]),
+    ("Girls",  [_any("path", "teen-girls", "kids-girls")]),
+    ("Girls",  [_INFANT, _any("path", "infant-girls") + _any("pc", "infant girl")]),
+    ("Boys",   [_INFANT, _any("pc", "kameez") + _any("path", "kameez")]),
+    ("Kids",   [_INFANT]),
+    ("Girls",  [_KIDS_MIX, _any("pc", "girls")]),
+    ("Boys",   [_KIDS_MIX, _any("pc", "boys", "kameez", "kurta")]),
+    ("Kids",   [_KIDS_MIX]),
+    ("Men",    [_any("path", "fragrances/for-men")]),
+    ("Women",  [_any("path", "fragrances/for-women")]),
+    ("Kids",   [_any("path", "fragrances/for-kids")]),
+    ("Unisex", [_any("path", "fragrances/")]),
+    ("Unisex", [_any("path", "^makeup/", "^skin-care/")]),
+    ("Women",  [_SYNCC, _any("pc", "women", "ladies", "tops")]),
+    ("Unisex", [_SYNCC]),
+    ("Women",  [_FEATURED, _any("pc", "ladies", "women", "girl")]),
+    ("Men",    [_FEATURED, _any("pc", "men ", "kameez shalwar", "kurta")]),
+    ("Women",  [_any("path", "co-ord")]),
+    ("Unisex", [_any("path", "featured-collection")]),
+]
+_GENDER_RULES = KeywordRules(GENDER_RULES, fields=("path", "pc"))
+
+_MEN_TEXT_RE   = re.compile(r'\bpour homme\b|\bfor him\b')
+_WOMEN_TEXT_RE = re.compile(r'\bpour femme\b|\bfor her\b')
+
+
+def extract_gender(product: Dict) -> str:
+    """
+    Extract gender/audience from the J. website category URL.
+    Returns: 'Men', 'Women', 'Boys', 'Girls', 'Kids', 'Unisex'
+
+    Rules are evaluated in GENDER_RULES order; products whose URL and
+    Product Category say nothing fall back to "pour homme"/"for her" style
+    wording in the name and description.
+    """
+    url = product.get("category_source", "").lower()
+    path = url.replace("https://www.junaidjamshed.com/", "")
+    pc = product.get("attributes", {}).get("Product Category", "").lower()
+
+    label = _GENDER_RULES.match(path, pc)
+    if label:
+        return label
+
+    desc = product.get("description_text", "").lower()
+    name = product.get("name", "").lower()
+    combined = f"{name} {desc}"
+
+    if _MEN_TEXT_RE.search(combined):
+        return "Men"
+    if _WOMEN_TEXT_RE.search(combined):
+        return "Women"
+
+    return "Unisex"
+
+
+# ═════════════════════════════════════════════════════════════════════════════
+#  2. PRODUCT TYPE CLASSIFICATION — from Product Category attribute
+# ═════════════════════════════════════════════════════════════════════════════
+
+PC_MAP = {
+    "Casual Kameez Shalwar":          "Kameez Shalwar",
+    "Semi-Formal Kameez Shalwar":     "Kameez Shalwar",
+    "Formal Kameez Shalwar":          "Kameez Shalwar",
+    "Exclusive Kameez Shalwar":       "Kameez Shalwar",
+    "Kurta Trousers":                 "Kurta",
+    "Semi-Formal Kurta":              "Kurta",
+    "Special Kurta":                  "Kurta",
+    "Formal Kurta":                   "Kurta",
+    "Casual Kurta":                   "Kurta",
+    "Formal Shirt":                   "Shirt",
+    "Jubba/Thobe":                    "Jubba",
+    "Inner wear":                     "Underwear",
+    "Jackets & Sweaters":             "Jacket",
+    "Waistcoat":                      "Waistcoat",
+    "Unstitched Kameez Shalwar Fabric": "Unstitched Fabric",
+
+    "Unstitched 3 Piece":             "Unstitched Suit",
+    "Unstitched 1 Piece":             "Unstitched Suit",
+    "3 Piece Stitched":               "Stitched Suit",
+    "Shirt and Trouser":              "Co-ord Set",
+    "Shirt and Dupatta":              "Shirt & Dupatta",
+    "Trendy Shirt":                   "Kurti",
+    "Ladies Trousers":                "Trousers",
+    "Ladies Shalwar":                 "Shalwar",
+    "Ladies Dupatta":                 "Dupatta",
+    "Ladies Stole":                   "Stole",
+    "Ladies Bags":                    "Bag",
+    "Tops":                           "Top",
+    "Saree":                          "Saree",
+    "Co-ord Set":                     "Co-ord Set",
+
+    "Teens 2 Piece":                  "Stitched Suit",
+    "Teens 3 Piece":                  "Stitched Suit",
+    "Teens Kurti":                    "Kurti",
+    "Teens Kameez Shalwar":           "Kameez Shalwar",
+    "Teens Kurta":                    "Kurta",
+    "Infant Kameez Shalwar":          "Kameez Shalwar",
+    "Infant Girl":                    "Frock",
+    "Girls 3 Piece":                  "Stitched Suit",
+    "Girls 2 Piece":                  "Stitched Suit",
+    "Girls Trousers":                 "Trousers",
+    "Girls Kurti":                    "Kurti",
+    "Boys Kameez Shalwar":            "Kameez Shalwar",
+
+    "Men Peshawari Chappal":          "Peshawari Chappal",
+    "Men Footwear":                   "Sandals",
+    "Women Footwear":                 "Sandals",
+
+    "Lips":                           "Lip Makeup",
+    "Eyes":                           "Eye Makeup",
+    "Face":                           "Face Makeup",
+
+    "Bangles":                        "Bangles",
+    "Earrings":                       "Earrings",
+    "Ring":                           "Ring",
+    "Bracelet":                       "Bracelet",
+    "Necklace":                       "Necklace",
+}
+
+
+_FRAGRANCE = _any("url", "fragrances/")
+_PERFUME   = _any("url", "perfume", "for-men", "for-women")
+_FOOTWEAR  = "<footwear>"
+
+# Category-URL fallbacks for products whose Product Category is not in PC_MAP.
+TYPE_URL_RULES = [
+    ("Body Spray",        [_FRAGRANCE, _PERFUME, _any("url", "body-spray")]),
+    ("Body Mist",         [_FRAGRANCE, _PERFUME, _any("url", "body-mist", "body-mis")]),
+    ("Gift Set",          [_FRAGRANCE, _PERFUME, _any("url", "gift-se")]),
+    ("Beard Oil",         [_FRAGRANCE, _PERFUME, _any("url", "beard-oi")]),
+    ("Perfume",           [_FRAGRANCE, _PERFUME]),
+    ("Bakhoor",           [_FRAGRANCE, _any("url", "bakhoor")]),
+    ("Perfume",           [_FRAGRANCE, _any("url", "collection")]),
+    ("Fragrance",         [_FRAGRANCE]),
+    ("Perfume",           [_any("url", "cast-crew/men/perfume")]),
+    ("Kurta",             [_any("url", "cast-crew/men/kurta")]),
+    ("Jacket",            [_any("url", "cast-crew/men/jackets")]),
+    ("Eye Makeup",        [_any("url", "makeup/eyes")]),
+    ("Lip Makeup",        [_any("url", "makeup/lip")]),
+    ("Face Makeup",       [_any("url", "makeup/face")]),
+    ("Skincare",          [_any("url", "skin-care/")]),
+    ("Shower Gel",        [_any("url", "shower-ge")]),
+    (_FOOTWEAR,           [_any("url", "foot-wear", "footwear")]),
+    ("Streetwear",        [_any("url", "streetwear")]),
+    ("Kameez Shalwar",    [_any("url", "heritage")]),
+    ("Unstitched Fabric", [_any("url", "unstitched")]),
+]
+
+# Footwear category pages, decided by the lower-cased product name.
+FOOTWEAR_NAME_RULES = [
+    ("Peshawari Chappal", [_any("name", "sandal", "peshawari", "chappal")]),
+    ("Slides",            [_any("name", "slide")]),
+]
+
+# Last resort: keywords in the upper-cased product name.
+TYPE_NAME_RULES = [
+    ("Bakhoor",         [_any("name", "BAKHOOR")]),
+    ("Shower Gel",      [_any("name", "SHOWER GEL")]),
+    ("Hair Mist",       [_any("name", "HAIR MIST")]),
+    ("Skincare",        [_any("name", "HAND CREAM", "FOOT CREAM")]),
+    ("Lip Makeup",      [_any("name", "LIPSTICK", "LIP ")]),
+    ("Eye Makeup",      [_any("name", "EYESHADOW", "EYEBROW")]),
+    ("Face Makeup",     [_any("name", "HIGHLIGHTER", "CONCEALER", "BLUSHER")]),
+    ("Skincare",        [_any("name", "SERUM", "TONER", "CREAM")]),
+    ("Kurti",           [_any("name", "KURTI")]),
+    ("Kurta",           [_any("name", "KURTA")]),
+    ("Co-ord Set",      [_any("name", "CO-ORD")]),
+    ("Kameez Shalwar",  [_any("name", "KAMEEZ SHALWAR")]),
+    ("Shalwar",         [_any("name", "SHALWAR")]),
+    ("Trousers",        [_any("name", "TROUSER")]),
+    ("Unstitched Suit", [_any("name", "UNSTITCHED")]),
+    ("Stitched Suit",   [_any("name", "STITCHED")]),
+    ("Dupatta",         [_any("name", "DUPATTA")]),
+    ("Shirt",           [_any("name", "SHIRT")]),
+    ("Waistcoat",       [_any("name", "WAISTCOAT")]),
+    ("Jacket",          [_any("name", "JACKET")]),
+    ("Stole",           [_any("name", "STOLE")]),
+    ("Saree",           [_any("name", "SAREE", "SARI")]),
+    ("Bag",             [_any("name", "BAG", "TOTE", "CLUTCH")]),
+]
+
+_TYPE_URL_RULES      = KeywordRules(TYPE_URL_RULES, fields=("url",))
+_FOOTWEAR_NAME_RULES = KeywordRules(FOOTWEAR_NAME_RULES, fields=("name",), memoize=False)
+_TYPE_NAME_RULES     = KeywordRules(TYPE_NAME_RULES, fields=("name",), memoize=False)
+
+
+def classify_product_type(product: Dict) -> str:
+    """Classify product type from attributes and URL."""
+    pc = product.get("attributes", {}).get("Product Category", "")
+    if pc in PC_MAP:
+        return PC_MAP[pc]
+
+    url = product.get("category_source", "").lower()
+    name = product.get("name", "").upper()
+
+    label = _TYPE_URL_RULES.match(url)
+    if label == _FOOTWEAR:
+        return _FOOTWEAR_NAME_RULES.match(name.lower()) or "Sandals"
+    if label:
+        return label
+
+    return _TYPE_NAME_RULES.match(name) or "Other"
+
+
+# ═════════════════════════════════════════════════════════════════════════════
+#  3. FRAGRANCE METADATA PARSER — from description_text
+# ═════════════════════════════════════════════════════════════════════════════
+#  FRAGRANCE_PATTERNS define the format. IGNORECASE stops the regex engine
+#  from jumping to a header's literal prefix, so each field is searched in
+#  desc.lower() with a lower-cased, case-sensitive copy of its pattern and
+#  the value sliced from desc at the same offsets. That is exact as long as
+#  lower() keeps every offset and the text has no character IGNORECASE folds
+#  onto an ASCII letter that lower() leaves alone; anything else takes the
+#  original patterns.
+
+FRAGRANCE_PATTERNS = {
+    "notes_top":          re.compile(r'Top Notes?:\s*(.+?)(?=Heart Notes?:|Base Notes?:|Dry Down|Size:|$)', re.IGNORECASE),
+    "notes_heart":        re.compile(r'Heart Notes?:\s*(.+?)(?=Base Notes?:|Dry Down|Size:|$)', re.IGNORECASE),
+    "notes_base":         re.compile(r'(?:Base Notes?|Dry Down\s*(?:Base Notes?)?)\s*:?\s*(.+?)(?=Size:|Bottle|$)', re.IGNORECASE),
+    "main_accords":       re.compile(r'Main Accords?\s*(.+?)(?=Top Notes?:|$)', re.IGNORECASE),
+    "fragrance_category": re.compile(r'Category:\s*(.+?)(?=Main Accords?|Top Notes?|$)', re.IGNORECASE),
+    "size":               re.compile(r'Size:\s*(\d+(?:\.\d+)?)\s*ml', re.IGNORECASE),
+}
+_LOWER_PATTERNS = {field: re.compile(p.pattern.lower()) for field, p in FRAGRANCE_PATTERNS.items()}
+_FOLD_MISMATCH = ("\u0131", "\u017f", "\u212a")   # ı ſ K(elvin)
+
+
+def _parse_fragrance(desc: str) -> Tuple[Dict[str, str], Optional[float]]:
+    """parse_fragrance_notes() plus the numeric ml size, when the text has one."""
+    result = {
+        "notes_top": "",
+        "notes_heart": "",
+        "notes_base": "",
+        "main_accords": "",
+        "fragrance_category": "",
+        "size": "",
+    }
+
+    if not desc:
+        return result, None
+
+    lowered = desc.lower()
+    if len(lowered) == len(desc) and not any(c in desc for c in _FOLD_MISMATCH):
+        text, patterns = lowered, _LOWER_PATTERNS
+    else:
+        text, patterns = desc, FRAGRANCE_PATTERNS
+
+    size_ml = None
+    for field, pattern in patterns.items():
+        m = pattern.search(text)
+        if not m:
+            continue
+        value = desc[m.start(1):m.end(1)]
+        if field == "size":
+            result["size"] = f"{value}ml"
+            size_ml = float(value)
+        else:
+            result[field] = value.strip().rstrip(",. ")
+
+    return result, size_ml
+
+
+def parse_fragrance_notes(desc: str) -> Dict[str, str]:
+    """
+    Parse fragrance metadata from description text.
+    Returns dict with: notes_top, notes_heart, notes_base, main_accords,
+                       fragrance_category, size
+    """
+    return _parse_fragrance(desc)[0]
+
+
+# ═════════════════════════════════════════════════════════════════════════════
+#  4. PRICE PARSER
+# ═════════════════════════════════════════════════════════════════════════════
+
+def parse_price(price_str: str) -> Tuple[float, str]:
+    """'PKR 11,990.00' → (11990.0, 'above_10000')"""
+    numeric = 0.0
+    m = re.search(r'[\d,]+\.?\d*', price_str or "")
+    if m:
+        numeric = float(m.group().replace(",", ""))
+
+    if numeric < 1000:
+        bucket = "under_1000"
+    elif numeric < 3000:
+        bucket = "1000_3000"
+    elif numeric < 5000:
+        bucket = "3000_5000"
+    elif numeric < 7000:
+        bucket = "5000_7000"
+    elif numeric < 10000:
+        bucket = "7000_10000"
+    else:
+        bucket = "above_10000"
+
+    return numeric, bucket
+
+
+# ═════════════════════════════════════════════════════════════════════════════
+#  5. CHUNK BUILDER — rich searchable text for embedding
+# ═════════════════════════════════════════════════════════════════════════════
+
+def build_primary_chunk(product: Dict, gender: str, product_type: str,
+                        price_display: str, price_numeric: float,
+                        frag_meta: Dict) -> str:
+    """
+    Primary searchable chunk: dense combination of all key product signals.
+    This is what gets embedded as the main vector.
+    """
+    name = product.get("name", "")
+    stock = product.get("stock_status", "IN STOCK")
+    color = product.get("attributes", {}).get("Color", "")
+    fabric = product.get("attributes", {}).get("Fabric", "")
+    season = product.get("attributes", {}).get("Season", "")
+
+    parts = [f"{name}."]
+    parts.append(f"Product type: {product_type}.")
+    if gender and gender != "Unisex":
+        parts.append(f"For {gender}.")
+    if color:
+        parts.append(f"Color: {color}.")
+    if fabric:
+        parts.append(f"Fabric: {fabric}.")
+    parts.append(f"Price: {price_display}.")
+    parts.append(f"{stock}.")
+
+    if frag_meta.get("fragrance_category"):
+        parts.append(f"{frag_meta['fragrance_category']} fragrance.")
+    if frag_meta.get("size"):
+        parts.append(f"Size: {frag_meta['size']}.")
+    if season and season != "(missing)":
+        parts.append(f"Season: {season}.")
+
+    return " ".join(parts)
+
+
+def build_detailed_chunk(product: Dict, gender: str, product_type: str,
+                         frag_meta: Dict) -> str:
+    """
+    Detailed chunk: description + fragrance notes + fabric details.
+    For non-fragrance products, this uses the rich raw description.
+    """
+    desc = product.get("description_text", "") or ""
+    if desc.strip() == "N/A":
+        desc = ""
+
+    fabric = product.get("attributes", {}).get("Fabric", "")
+    wear_type = product.get("attributes", {}).get("Wear Type", "")
+    fit_type = product.get("attributes", {}).get("Fit Type", "")
+
+    parts = []
+
+    if frag_meta.get("notes_top"):
+        parts.append(f"Top Notes: {frag_meta['notes_top']}.")
+    if frag_meta.get("notes_heart"):
+        parts.append(f"Heart Notes: {frag_meta['notes_heart']}.")
+    if frag_meta.get("notes_base"):
+        parts.append(f"Base Notes: {frag_meta['notes_base']}.")
+    if frag_meta.get("main_accords"):
+        parts.append(f"Main Accords: {frag_meta['main_accords']}.")
+
+    if fabric:
+        parts.append(f"Fabric: {fabric}.")
+    if wear_type:
+        parts.append(f"Wear type: {wear_type}.")
+    if fit_type:
+        parts.append(f"Fit: {fit_type}.")
+
+    if desc:
+        clean_desc = re.sub(r'\(!\)\s*Fragrances and perfumes.*?policy\.?\s*', '', desc)
+        clean_desc = re.sub(r'Category:.*?(?=Main Accords|Top Notes|$)', '', clean_desc)
+        clean_desc = re.sub(r'Main Accords.*?(?=Top Notes|$)', '', clean_desc)
+        clean_desc = re.sub(r'Top Notes?:.*?(?=Size:|Bottle|$)', '', clean_desc)
+        clean_desc = re.sub(r'Heart Notes?:.*?(?=Base|Dry Down|Size:|$)', '', clean_desc)
+        clean_desc = re.sub(r'(?:Base Notes?|Dry Down).*?(?=Size:|Bottle|$)', '', clean_desc)
+        clean_desc = re.sub(r'Size:\s*\d+ml\s*(?:Bottle)?', '', clean_desc)
+        clean_desc = clean_desc.strip()
+        if clean_desc and len(clean_desc) > 10:
+            parts.append(clean_desc)
+
+    return " ".join(parts)
+
+
+# ═════════════════════════════════════════════════════════════════════════════
+#  6. HyDE QUERY GENERATOR — context-aware per product type
+# ═════════════════════════════════════════════════════════════════════════════
+
+def generate_hyde(product: Dict, gender: str, product_type: str,
+                  price_numeric: float, frag_meta: Dict) -> Dict:
+    """
+    Generate hypothetical user queries and answers for HyDE embedding.
+    Entirely context-aware — no more "fragrance" for sandals.
+    """
+    name = product.get("name", "")
+    color = product.get("attributes", {}).get("Color", "")
+    fabric = product.get("attributes", {}).get("Fabric", "")
+    price_upper = int(price_numeric * 1.15) if price_numeric else 5000
+
+    gender_prefix = ""
+    if gender == "Men":
+        gender_prefix = "men's "
+    elif gender == "Women":
+        gender_prefix = "women's "
+    elif gender == "Boys":
+        gender_prefix = "boys' "
+    elif gender == "Girls":
+        gender_prefix = "girls' "
+    elif gender == "Kids":
+        gender_prefix = "kids' "
+
+    type_lower = product_type.lower()
+    queries = []
+    answers = []
+
+    if product_type in ("Perfume", "Fragrance", "Body Spray", "Body Mist", "Attar"):
+        frag_cat = frag_meta.get("fragrance_category", "")
+        notes_top = frag_meta.get("notes_top", "")
+        size = frag_meta.get("size", "")
+
+        queries.append(f"Show me {gender_prefix}{frag_cat.lower()} {type_lower} under {price_upper} PKR".strip())
+        if notes_top:
+            first_note = notes_top.split(",")[0].strip()
+            queries.append(f"{gender_prefix}{type_lower} with {first_note} notes")
+        notes_base = frag_meta.get("notes_base", "")
+        if notes_base:
+            first_base = notes_base.split(",")[0].strip()
+            queries.append(f"I want a {gender_prefix}fragrance with {first_base} base")
+        if size:
+            queries.append(f"{size} {gender_prefix}{type_lower} in stock")
+
+        answers.append(
+            f"{name} is a {frag_cat.lower()} {type_lower} for {gender.lower()}, "
+            f"priced at PKR {price_numeric:,.0f}. "
+            + (f"Size: {size}. " if size else "")
+            + (f"Top notes include {notes_top}." if notes_top else "")
+        )
+
+    elif product_type in ("Kameez Shalwar", "Kurta", "Kurti", "Unstitched Suit",
+                          "Stitched Suit", "Co-ord Set", "Shirt & Dupatta",
+                          "Trousers", "Shalwar", "Jubba", "Frock",
+                          "Top", "Jacket", "Waistcoat", "Shirt", "Stole",
+                          "Streetwear", "Unstitched Fabric", "Dupatta"):
+        queries.append(f"{gender_prefix}{type_lower} under {price_upper} PKR")
+        if color:
+            queries.append(f"{color.lower()} {gender_prefix}{type_lower} available in stock")
+        if fabric:
+            queries.append(f"{fabric.lower()} {gender_prefix}{type_lower}")
+        else:
+            queries.append(f"best {gender_prefix}{type_lower} at J.")
+
+        answers.append(
+            f"{name} is a {gender_prefix}{type_lower}"
+            + (f" in {color.lower()}" if color else "")
+            + (f", made from {fabric.lower()} fabric" if fabric else "")
+            + f", priced at PKR {price_numeric:,.0f}."
+        )
+
+    elif product_type in ("Peshawari Chappal", "Sandals", "Slides"):
+        queries.append(f"{gender_prefix}{type_lower} under {price_upper} PKR")
+        if color:
+            queries.append(f"{color.lower()} {gender_prefix}{type_lower}")
+        queries.append(f"comfortable {gender_prefix}{type_lower} in stock")
+
+        answers.append(
+            f"{name} is a {gender_prefix}{type_lower}"
+            + (f" in {color.lower()}" if color else "")
+            + f" priced at PKR {price_numeric:,.0f}."
+        )
+
+    elif product_type in ("Lip Makeup", "Eye Makeup", "Face Makeup", "Skincare",
+                          "Shower Gel", "Hair Mist", "Bakhoor"):
+        queries.append(f"{type_lower} under {price_upper} PKR")
+        queries.append(f"J. {type_lower} products")
+        if color:
+            queries.append(f"{color.lower()} {type_lower}")
+
+        answers.append(f"{name} is a {type_lower} product priced at PKR {price_numeric:,.0f}.")
+
+    elif product_type in ("Bangles", "Earrings", "Ring", "Bracelet", "Necklace", "Bag"):
+        queries.append(f"{gender_prefix}{type_lower} under {price_upper} PKR")
+        if color:
+            queries.append(f"{color.lower()} {type_lower}")
+        queries.append(f"J. {gender_prefix}{type_lower} in stock")
+
+        answers.append(
+            f"{name} is a {gender_prefix}{type_lower}"
+            + (f" in {color.lower()}" if color else "")
+            + f", priced at PKR {price_numeric:,.0f}."
+        )
+
+    else:
+        queries.append(f"{gender_prefix}{type_lower} under {price_upper} PKR")
+        queries.append(f"J. {gender_prefix}{type_lower} available")
+
+        answers.append(f"{name} is priced at PKR {price_numeric:,.0f} and is currently in stock.")
+
+    queries = [re.sub(r'\s+', ' ', q).strip() for q in queries if q.strip()]
+    answers = [re.sub(r'\s+', ' ', a).strip() for a in answers if a.strip()]
+
+    return {
+        "hypothetical_queries": queries[:3],
+        "hypothetical_answers": answers[:2],
+        "hyde_embedding_placeholder": "<to_be_embedded>",
+    }
+
+
+# ═════════════════════════════════════════════════════════════════════════════
+#  7. KEYWORD BUILDER — for BM25 sparse retrieval
+# ═════════════════════════════════════════════════════════════════════════════
+
+STOPWORDS = {
+    "the", "a", "an", "is", "are", "was", "were", "and", "or", "but", "in",
+    "on", "at", "to", "for", "of", "with", "from", "by", "as", "it", "its",
+    "that", "this", "these", "those", "not", "all", "each", "every", "both",
+    "has", "have", "had", "been", "be", "will", "can", "may", "very", "just",
+    "than", "then", "into", "over", "such", "more", "some", "other", "any",
+    "due", "when", "how", "our", "your", "about", "through",
+}
+
+def build_keywords(product: Dict, gender: str, product_type: str,
+                   frag_meta: Dict) -> List[str]:
+    """Build enriched keyword list for BM25 matching."""
+    kws = set()
+
+    name = product.get("name", "")
+    for word in name.split():
+        w = re.sub(r'[^a-zA-Z0-9]', '', word).lower()
+        if w and len(w) > 1 and w not in STOPWORDS:
+            kws.add(w)
+
+    if gender:
+        kws.add(gender.lower())
+        if gender == "Men":
+            kws.update(["men", "mens", "gents"])
+        elif gender == "Women":
+            kws.update(["women", "womens", "ladies"])
+        elif gender == "Boys":
+            kws.update(["boys", "kids", "teen"])
+        elif gender == "Girls":
+            kws.update(["girls", "kids", "teen"])
+        elif gender == "Kids":
+            kws.update(["kids", "children", "infant"])
+
+    for word in product_type.lower().split():
+        w = re.sub(r'[^a-zA-Z0-9]', '', word)
+        if w and len(w) > 1:
+            kws.add(w)
+
+    color = product.get("attributes", {}).get("Color", "")
+    if color:
+        for word in color.lower().split():
+            w = re.sub(r'[^a-zA-Z0-9]', '', word)
+            if w and len(w) > 1:
+                kws.add(w)
+
+    fabric = product.get("attributes", {}).get("Fabric", "")
+    if fabric:
+        for word in fabric.lower().split():
+            w = re.sub(r'[^a-zA-Z0-9]', '', word)
+            if w and len(w) > 2 and w not in STOPWORDS:
+                kws.add(w)
+
+    season = product.get("attributes", {}).get("Season", "")
+    if season:
+        for word in season.lower().split():
+            w = re.sub(r'[^a-zA-Z0-9]', '', word)
+            if w and len(w) > 2 and w not in STOPWORDS:
+                kws.add(w)
+
+    if frag_meta.get("fragrance_category"):
+        for word in frag_meta["fragrance_category"].lower().replace(",", " ").split():
+            w = word.strip()
+            if w and len(w) > 2:
+                kws.add(w)
+    if frag_meta.get("notes_top"):
+        for note in frag_meta["notes_top"].split(","):
+            n = note.strip().lower()
+            if n and len(n) > 2:
+                kws.add(n)
+
+    return sorted(kws)
+
+
+# ═════════════════════════════════════════════════════════════════════════════
+#  8. PRODUCT ID GENERATOR
+# ═════════════════════════════════════════════════════════════════════════════
+
+def make_product_id(sku: str) -> str:
+    return f"prod_{sku}" if sku else f"prod_unknown_{hashlib.md5(str(id).encode()).hexdigest()[:8]}"
+
+
+# ═════════════════════════════════════════════════════════════════════════════
+#  PRODUCT RECORD — one flat, slotted object per processed product
+# ═════════════════════════════════════════════════════════════════════════════
+#  The hierarchical schema repeats values (colour three times, gender twice,
+#  image presence twice) and wraps constants (placeholders, chunk ids) in
+#  per-product dicts. A ProductRecord stores each value once; to_dict() and
+#  to_json() rebuild the products_hierarchical.json schema on demand.
+#  Categorical strings are interned and repeated lists (sizes, category
+#  URLs) shared, so a catalog held in memory keeps one copy of each value.
+#
+#  json.dump(indent=2) cannot use the C encoder and is the slowest writer;
+#  to_json() fills a fixed template with C-encoded leaves and produces the
+#  same bytes.
+
+_encode_str = json.encoder.encode_basestring      # ensure_ascii=False
+_shared_tuples: Dict[Tuple, Tuple] = {}
+
+
+def _interned(value: Any) -> Any:
+    return sys.intern(value) if type(value) is str else value
+
+
+def _shared_tuple(items: Any) -> Any:
+    """One tuple object per distinct list of values (lists of strings only)."""
+    if type(items) is not list or not all(type(v) is str for v in items):
+        return items
+    key = tuple(items)
+    return _shared_tuples.setdefault(key, key)
+
+
+def _json(value: Any, pad: str) -> str:
+    """json.dumps(value, indent=2, ensure_ascii=False) for a value nested at indentation pad."""
+    if type(value) is str:
+        return _encode_str(value)
+    if type(value) in (list, tuple) and value and all(type(v) is str for v in value):
+        sep = ",\n" + pad + "  "
+        return "[" + sep[1:] + sep.join(map(_encode_str, value)) + "\n" + pad + "]"
+    if isinstance(value, (list, tuple, dict)):
+        return json.dumps(value, indent=2, ensure_ascii=False).replace("\n", "\n" + pad)
+    return json.dumps(value)                         # number, bool or None
+
+
+@dataclass(slots=True)
+class ProductRecord:
+    """A processed product. to_dict() is the products_hierarchical.json entry."""
+    product_id: str
+    name: str
+    sku: str
+    article_code: str
+    price_display: str
+    price_numeric: float
+    stock_status: str
+    product_link: str
+    category_l1: str
+    gender: str
+    product_type: str
+    primary_text: str
+    detailed_text: str
+    notes_top: str
+    notes_heart: str
+    notes_base: str
+    main_accords: str
+    fragrance_category: str
+    size: str
+    notes_combined: str
+    hypothetical_queries: List[str]
+    hypothetical_answers: List[str]
+    keywords: List[str]
+    image_local_path: Optional[str]
+    image_url: str
+    color: str
+    fabric: str
+    season: str
+    wear_type: str
+    fit_type: str
+    sole_type: str
+    upper_type: str
+    sizes_available: Tuple[str, ...]
+    raw_product_category: str
+    price_bucket: str
+    in_stock: bool
+    size_ml: float
+    raw_description: str
+    category_source: str
+    category_sources: Tuple[str, ...]
+    scraped_at: str
+    near_duplicate_of: Optional[str] = None
+
+    def __post_init__(self):
+        for attr in ("stock_status", "color", "fabric", "season", "wear_type", "fit_type",
+                      "sole_type", "upper_type", "raw_product_category", "price_bucket",
+                      "fragrance_category", "size", "category_source"):
+            setattr(self, attr, _interned(getattr(self, attr)))
+        self.sizes_available = _shared_tuple(self.sizes_available)
+        self.category_sources = _shared_tuple(self.category_sources)
+
+    @property
+    def fragrance_metadata(self) -> Dict[str, str]:
+        return {
+            "notes_top": self.notes_top,
+            "notes_heart": self.notes_heart,
+            "notes_base": self.notes_base,
+            "main_accords": self.main_accords,
+            "fragrance_category": self.fragrance_category,
+            "size": self.size,
+        }
+
+    def to_dict(self) -> Dict:
+        product_id = self.product_id
+        has_image = bool(self.image_local_path)
+        sizes, sources = self.sizes_available, self.category_sources
+        return {
+            "product_id": product_id,
+            "product_core": {
+                "name": self.name,
+                "sku": self.sku,
+                "article_code": self.article_code,
+                "price_display": self.price_display,
+                "price_numeric": self.price_numeric,
+                "stock_status": self.stock_status,
+                "product_link": self.product_link,
+                "category_hierarchy": {
+                    "level_1": self.category_l1,
+                    "level_2": self.gender,
+                    "level_3": self.product_type,
+                },
+            },
+            "searchable_chunks": [
+                {
+                    "chunk_id": f"{product_id}_primary",
+                    "chunk_type": "primary_description",
+                    "content": self.primary_text,
+                    "embedding_placeholder": "<to_be_embedded>",
+                },
+                {
+                    "chunk_id": f"{product_id}_detailed",
+                    "chunk_type": "detailed_description",
+                    "content": self.detailed_text,
+                    "embedding_placeholder": "<to_be_embedded>",
+                },
+            ],
+            "fragrance_metadata": self.fragrance_metadata,
+            "notes_combined": self.notes_combined,
+            "hyde_components": {
+                "hypothetical_queries": list(self.hypothetical_queries),
+                "hypothetical_answers": list(self.hypothetical_answers),
+                "hyde_embedding_placeholder": "<to_be_embedded>",
+            },
+            "sparse_retrieval": {
+                "keywords": list(self.keywords),
+                "bm25_ready": True,
+            },
+            "image_data": {
+                "local_path": self.image_local_path,
+                "online_url": self.image_url,
+                "clip_embedding_placeholder": "<to_be_embedded>",
+                "image_exists": has_image,
+            },
+            "product_attributes": {
+                "color": self.color,
+                "fabric": self.fabric,
+                "season": self.season,
+                "wear_type": self.wear_type,
+                "fit_type": self.fit_type,
+                "sole_type": self.sole_type,
+                "upper_type": self.upper_type,
+                "sizes_available": list(sizes) if type(sizes) is tuple else sizes,
+                "raw_product_category": self.raw_product_category,
+            },
+            "filter_metadata": {
+                "price_range_bucket": self.price_bucket,
+                "in_stock": self.in_stock,
+                "category_l1": self.category_l1,
+                "category_l2": self.gender,
+                "product_type": self.product_type,
+                "color": self.color,
+                "fabric": self.fabric,
+                "season": self.season,
+                "has_image": has_image,
+                "size_ml_numeric": self.size_ml,
+                "size_category": self.size or "N/A",
+            },
+            "raw_description": self.raw_description,
+            "category_source": self.category_source,
+            "category_sources": list(sources) if type(sources) is tuple else sources,
+            "near_duplicate_of": self.near_duplicate_of,
+            "scraped_at": self.scraped_at,
+        }
+
+    def to_json(self, pad: str = "") -> str:
+        """json.dumps(self.to_dict(), indent=2, ensure_ascii=False), every line after the first prefixed by pad."""
+        p1, p2, p3, p4 = pad + "  ", pad + "    ", pad + "      ", pad + "        "
+        s, j = _encode_str, _json
+        pid = self.product_id
+        has_image = "true" if self.image_local_path else "false"
+        return (
+            f'{{\n{p1}"product_id": {j(pid, p1)},\n'
+            f'{p1}"product_core": {{\n'
+            f'{p2}"name": {j(self.name, p2)},\n'
+            f'{p2}"sku": {j(self.sku, p2)},\n'
+            f'{p2}"article_code": {j(self.article_code, p2)},\n'
+            f'{p2}"price_display": {j(self.price_display, p2)},\n'
+            f'{p2}"price_numeric": {j(self.price_numeric, p2)},\n'
+            f'{p2}"stock_status": {j(self.stock_status, p2)},\n'
+            f'{p2}"product_link": {j(self.product_link, p2)},\n'
+            f'{p2}"category_hierarchy": {{\n'
+            f'{p3}"level_1": {s(self.category_l1)},\n'
+            f'{p3}"level_2": {s(self.gender)},\n'
+            f'{p3}"level_3": {s(self.product_type)}\n'
+            f'{p2}}}\n'
+            f'{p1}}},\n'
+            f'{p1}"searchable_chunks": [\n'
+            f'{p2}{{\n'
+            f'{p3}"chunk_id": {s(f"{pid}_primary")},\n'
+            f'{p3}"chunk_type": "primary_description",\n'
+            f'{p3}"content": {s(self.primary_text)},\n'
+            f'{p3}"embedding_placeholder": "<to_be_embedded>"\n'
+            f'{p2}}},\n'
+            f'{p2}{{\n'
+            f'{p3}"chunk_id": {s(f"{pid}_detailed")},\n'
+            f'{p3}"chunk_type": "detailed_description",\n'
+            f'{p3}"content": {s(self.detailed_text)},\n'
+            f'{p3}"embedding_placeholder": "<to_be_embedded>"\n'
+            f'{p2}}}\n'
+            f'{p1}],\n'
+            f'{p1}"fragrance_metadata": {{\n'
+            f'{p2}"notes_top": {s(self.notes_top)},\n'
+            f'{p2}"notes_heart": {s(self.notes_heart)},\n'
+            f'{p2}"notes_base": {s(self.notes_base)},\n'
+            f'{p2}"main_accords": {s(self.main_accords)},\n'
+            f'{p2}"fragrance_category": {j(self.fragrance_category, p2)},\n'
+            f'{p2}"size": {j(self.size, p2)}\n'
+            f'{p1}}},\n'
+            f'{p1}"notes_combined": {s(self.notes_combined)},\n'
+            f'{p1}"hyde_components": {{\n'
+            f'{p2}"hypothetical_queries": {j(self.hypothetical_queries, p2)},\n'
+            f'{p2}"hypothetical_answers": {j(self.hypothetical_answers, p2)},\n'
+            f'{p2}"hyde_embedding_placeholder": "<to_be_embedded>"\n'
+            f'{p1}}},\n'
+            f'{p1}"sparse_retrieval": {{\n'
+            f'{p2}"keywords": {j(self.keywords, p2)},\n'
+            f'{p2}"bm25_ready": true\n'
+            f'{p1}}},\n'
+            f'{p1}"image_data": {{\n'
+            f'{p2}"local_path": {j(self.image_local_path, p2)},\n'
+            f'{p2}"online_url": {j(self.image_url, p2)},\n'
+            f'{p2}"clip_embedding_placeholder": "<to_be_embedded>",\n'
+            f'{p2}"image_exists": {has_image}\n'
+            f'{p1}}},\n'
+            f'{p1}"product_attributes": {{\n'
+            f'{p2}"color": {j(self.color, p2)},\n'
+            f'{p2}"fabric": {j(self.fabric, p2)},\n'
+            f'{p2}"season": {j(self.season, p2)},\n'
+            f'{p2}"wear_type": {j(self.wear_type, p2)},\n'
+            f'{p2}"fit_type": {j(self.fit_type, p2)},\n'
+            f'{p2}"sole_type": {j(self.sole_type, p2)},\n'
+            f'{p2}"upper_type": {j(self.upper_type, p2)},\n'
+            f'{p2}"sizes_available": {j(self.sizes_available, p2)},\n'
+            f'{p2}"raw_product_category": {j(self.raw_product_category, p2)}\n'
+            f'{p1}}},\n'
+            f'{p1}"filter_metadata": {{\n'
+            f'{p2}"price_range_bucket": {s(self.price_bucket)},\n'
+            f'{p2}"in_stock": {"true" if self.in_stock else "false"},\n'
+            f'{p2}"category_l1": {s(self.category_l1)},\n'
+            f'{p2}"category_l2": {s(self.gender)},\n'
+            f'{p2}"product_type": {s(self.product_type)},\n'
+            f'{p2}"color": {j(self.color, p2)},\n'
+            f'{p2}"fabric": {j(self.fabric, p2)},\n'
+            f'{p2}"season": {j(self.season, p2)},\n'
+            f'{p2}"has_image": {has_image},\n'
+            f'{p2}"size_ml_numeric": {j(self.size_ml, p2)},\n'
+            f'{p2}"size_category": {j(self.size or "N/A", p2)}\n'
+            f'{p1}}},\n'
+            f'{p1}"raw_description": {j(self.raw_description, p1)},\n'
+            f'{p1}"category_source": {j(self.category_source, p1)},\n'
+            f'{p1}"category_sources": {j(self.category_sources, p1)},\n'
+            f'{p1}"near_duplicate_of": {j(self.near_duplicate_of, p1)},\n'
+            f'{p1}"scraped_at": {j(self.scraped_at, p1)}\n'
+            f'{pad}}}'
+        )
+
+    @classmethod
+    def from_dict(cls, d: Dict) -> "ProductRecord":
+        """Inverse of to_dict(), for products read back from products_hierarchical.json."""
+        core = d["product_core"]
+        chunks = d["searchable_chunks"]
+        fm = d["fragrance_metadata"]
+        hyde = d["hyde_components"]
+        img = d["image_data"]
+        pa = d["product_attributes"]
+        filt = d["filter_metadata"]
+        return cls(
+            product_id=d["product_id"],
+            name=core["name"],
+            sku=core["sku"],
+            article_code=core["article_code"],
+            price_display=core["price_display"],
+            price_numeric=core["price_numeric"],
+            stock_status=core["stock_status"],
+            product_link=core["product_link"],
+            category_l1=filt["category_l1"],
+            gender=filt["category_l2"],
+            product_type=filt["product_type"],
+            primary_text=chunks[0]["content"],
+            detailed_text=chunks[1]["content"],
+            notes_top=fm["notes_top"],
+            notes_heart=fm["notes_heart"],
+            notes_base=fm["notes_base"],
+            main_accords=fm["main_accords"],
+            fragrance_category=fm["fragrance_category"],
+            size=fm["size"],
+            notes_combined=d["notes_combined"],
+            hypothetical_queries=hyde["hypothetical_queries"],
+            hypothetical_answers=hyde["hypothetical_answers"],
+            keywords=d["sparse_retrieval"]["keywords"],
+            image_local_path=img["local_path"],
+            image_url=img["online_url"],
+            color=pa["color"],
+            fabric=pa["fabric"],
+            season=pa["season"],
+            wear_type=pa["wear_type"],
+            fit_type=pa["fit_type"],
+            sole_type=pa["sole_type"],
+            upper_type=pa["upper_type"],
+            sizes_available=pa["sizes_available"],
+            raw_product_category=pa["raw_product_category"],
+            price_bucket=filt["price_range_bucket"],
+            in_stock=filt["in_stock"],
+            size_ml=filt["size_ml_numeric"],
+            raw_description=d["raw_description"],
+            category_source=d["category_source"],
+            category_sources=d["category_sources"],
+            scraped_at=d["scraped_at"],
+            near_duplicate_of=d["near_duplicate_of"],
+        )
+
+
+# ═════════════════════════════════════════════════════════════════════════════
+#  MAIN PIPELINE
+# ═════════════════════════════════════════════════════════════════════════════
+
+def process_product(raw: Dict) -> ProductRecord:
+    """Process a single raw product into a ProductRecord (the full hierarchical structure)."""
+
+    sku = raw.get("sku", "")
+    product_id = make_product_id(sku)
+    price_display = raw.get("price", "PKR 0")
+    price_numeric, price_bucket = parse_price(price_display)
+    gender = extract_gender(raw)
+    product_type = classify_product_type(raw)
+
+    is_fragrance = product_type in ("Perfume", "Fragrance", "Body Spray", "Body Mist",
+                                     "Attar", "Gift Set", "Bakhoor", "Hair Mist",
+                                     "Beard Oil", "Shower Gel")
+    frag_meta, size_ml = _parse_fragrance(raw.get("description_text", "")) if is_fragrance else ({
+        "notes_top": "", "notes_heart": "", "notes_base": "",
+        "main_accords": "", "fragrance_category": "", "size": "",
+    }, None)
+
+    attrs = raw.get("attributes", {})
+    if not frag_meta["fragrance_category"] and attrs.get("Fragrance Category"):
+        frag_meta["fragrance_category"] = attrs["Fragrance Category"]
+    if not frag_meta["size"] and attrs.get("Size"):
+        frag_meta["size"] = attrs["Size"]
+
+    if size_ml is None:
+        size_str = frag_meta.get("size", "") or attrs.get("Size", "")
+        size_ml = 0.0
+        m = re.search(r'(\d+(?:\.\d+)?)\s*ml', size_str, re.IGNORECASE)
+        if m:
+            size_ml = float(m.group(1))
+
+    color = attrs.get("Color", "")
+    fabric = attrs.get("Fabric", "")
+    season = attrs.get("Season", "")
+    wear_type = attrs.get("Wear Type", "")
+    fit_type = attrs.get("Fit Type", "")
+    sole_type = attrs.get("Sole Type", "")
+    upper_type = attrs.get("Upper Type", "")
+    raw_product_category = attrs.get("Product Category", "")
+
+    primary_text = build_primary_chunk(raw, gender, product_type, price_display,
+                                       price_numeric, frag_meta)
+    detailed_text = build_detailed_chunk(raw, gender, product_type, frag_meta)
+
+    hyde = generate_hyde(raw, gender, product_type, price_numeric, frag_meta)
+
+    keywords = build_keywords(raw, gender, product_type, frag_meta)
+
+    notes_parts = [frag_meta.get("notes_top", ""), frag_meta.get("notes_heart", ""),
+                   frag_meta.get("notes_base", ""), frag_meta.get("main_accords", "")]
+    notes_combined = " | ".join(p for p in notes_parts if p.strip())
+
+    if is_fragrance:
+        cat_l1 = "Fragrances"
+    elif product_type in ("Lip Makeup", "Eye Makeup", "Face Makeup"):
+        cat_l1 = "Makeup"
+    elif product_type in ("Skincare", "Shower Gel", "Hair Mist"):
+        cat_l1 = "Beauty"
+    elif product_type in ("Bangles", "Earrings", "Ring", "Bracelet", "Necklace", "Bag"):
+        cat_l1 = "Accessories"
+    elif product_type in ("Peshawari Chappal", "Sandals", "Slides"):
+        cat_l1 = "Footwear"
+    else:
+        cat_l1 = "Clothing"
+
+    return ProductRecord(
+        product_id=product_id,
+        name=raw.get("name", ""),
+        sku=sku,
+        article_code=raw.get("article_code", ""),
+        price_display=price_display,
+        price_numeric=price_numeric,
+        stock_status=raw.get("stock_status", ""),
+        product_link=raw.get("product_link", ""),
+        category_l1=cat_l1,
+        gender=gender,
+        product_type=product_type,
+        primary_text=primary_text,
+        detailed_text=detailed_text,
+        notes_top=frag_meta["notes_top"],
+        notes_heart=frag_meta["notes_heart"],
+        notes_base=frag_meta["notes_base"],
+        main_accords=frag_meta["main_accords"],
+        fragrance_category=frag_meta["fragrance_category"],
+        size=frag_meta["size"],
+        notes_combined=notes_combined,
+        hypothetical_queries=hyde["hypothetical_queries"],
+        hypothetical_answers=hyde["hypothetical_answers"],
+        keywords=keywords,
+        image_local_path=raw.get("image_local_path", ""),
+        image_url=raw.get("image_url_online", ""),
+        color=color,
+        fabric=fabric,
+        season=season,
+        wear_type=wear_type,
+        fit_type=fit_type,
+        sole_type=sole_type,
+        upper_type=upper_type,
+        sizes_available=raw.get("sizes", []),
+        raw_product_category=raw_product_category,
+        price_bucket=price_bucket,
+        in_stock=raw.get("stock_status", "").upper() == "IN STOCK",
+        size_ml=size_ml,
+        raw_description=raw.get("description_text", ""),
+        category_source=raw.get("category_source", ""),
+        category_sources=raw.get("category_sources") or [raw.get("category_source", "")],
+        scraped_at=raw.get("scraped_at", ""),
+    )
+
+
+def project_product(product: ProductRecord) -> Tuple[Dict, Dict, Optional[Dict], Dict]:
+    """
+    Every flat output of one processed product:
+    (bm25_entry, attr_entry, image_entry_or_None, csv_row). The hierarchical
+    output is product.to_json().
+    """
+    return (build_bm25_entry(product), build_attr_indexed_entry(product),
+            build_image_registry_entry(product), product_to_csv_row(product))
+
+
+def _as_record(product: Union[ProductRecord, Dict]) -> ProductRecord:
+    """The projections read a ProductRecord; a products_hierarchical.json dict is converted."""
+    return product if isinstance(product, ProductRecord) else ProductRecord.from_dict(product)
+
+
+def build_bm25_entry(product: Union[ProductRecord, Dict]) -> Dict:
+    """Build a rich BM25 document from processed product."""
+    product = _as_record(product)
+    gender = product.gender
+    pt = product.product_type
+    in_stock = product.in_stock
+
+    text_parts = [
+        product.name,
+        pt,
+        gender,
+        product.primary_text,
+        product.detailed_text,
+        product.notes_combined,
+        product.fragrance_category,
+        product.color,
+        product.fabric,
+        product.season,
+        product.raw_description,
+    ]
+    text = " ".join(p for p in text_parts if p and p.strip() and p.strip() != "N/A")
+
+    return {
+        "doc_id": product.product_id,
+        "text": text,
+        "keywords": product.keywords,
+        "metadata": {
+            "name":          product.name,
+            "price":         product.price_numeric,
+            "in_stock":      in_stock,
+            "stock":         in_stock,
+            "category_l1":   product.category_l1,
+            "category_l2":   gender,
+            "product_type":  pt,
+            "color":         product.color,
+            "fabric":        product.fabric,
+            "season":        product.season,
+            "fragrance_cat": product.fragrance_category,
+            "size":          product.size,
+            "notes_top":     product.notes_top,
+            "notes_heart":   product.notes_heart,
+            "notes_base":    product.notes_base,
+            "price_bucket":  product.price_bucket,
+        },
+    }
+
+
+def build_attr_indexed_entry(product: Union[ProductRecord, Dict]) -> Dict:
+    """Build attribute-indexed multi-vector format entry."""
+    product = _as_record(product)
+    price = product.price_numeric
+    gender = product.gender
+    pt = product.product_type
+    in_stock = product.in_stock
+    color = product.color
+    fabric = product.fabric
+
+    notes_text = " | ".join(
+        f"{k}: {v}" for k, v in [
+            ("Top", product.notes_top),
+            ("Heart", product.notes_heart),
+            ("Base", product.notes_base),
+        ] if v
+    )
+
+    return {
+        "product_id": product.product_id,
+        "searchable_facets": {
+            "by_name": {
+                "text": product.name,
+                "embedding_placeholder": "<vector_by_name>",
+            },
+            "by_category": {
+                "text": f"{gender} {pt}".strip(),
+                "embedding_placeholder": "<vector_by_category>",
+            },
+            "by_price": {
+                "text": f"{product.price_bucket.replace('_', ' to ')} PKR",
+                "numeric_filter": price,
+            },
+            "by_fragrance_notes": {
+                "text": notes_text if notes_text else "N/A",
+                "embedding_placeholder": "<vector_by_notes>",
+            },
+            "by_availability": {
+                "text": f"{gender} {pt} in stock" if in_stock else f"{gender} {pt} out of stock",
+                "filter": {
+                    "size": product.size,
+                    "stock": in_stock,
+                },
+            },
+            "by_color": {
+                "text": color,
+            },
+            "by_fabric": {
+                "text": fabric,
+            },
+        },
+        "image_embedding_placeholder": "<CLIP_vector>",
+        "local_image": product.image_local_path,
+        "metadata": {
+            "price": price,
+            "stock": in_stock,
+            "category": f"{product.category_l1}_{gender}",
+            "product_type": pt,
+            "color": color,
+            "fabric": fabric,
+        },
+    }
+
+
+def build_image_registry_entry(product: Union[ProductRecord, Dict]) -> Optional[Dict]:
+    """Build image registry entry for CLIP embedding."""
+    product = _as_record(product)
+    if not product.image_local_path:
+        return None
+    name, pt, gender = product.name, product.product_type, product.gender
+    return {
+        "product_id": product.product_id,
+        "product_name": name,
+        "image_path": product.image_local_path,
+        "image_url": product.image_url,
+        "caption_generated": f"{name} — {pt} for {gender}",
+        "category": pt,
+        "gender": gender,
+        "clip_embedding_status": "pending",
+    }
+
+
+# ═════════════════════════════════════════════════════════════════════════════
+#  CSV EXPORT
+# ═════════════════════════════════════════════════════════════════════════════
+
+CSV_FIELDS = [
+    "product_id", "name", "sku", "article_code",
+    "price_display", "price_numeric", "stock_status",
+    "category_l1", "category_l2", "product_type",
+    "color", "fabric", "season", "wear_type", "fit_type",
+    "sizes_available",
+    "fragrance_category", "notes_top", "notes_heart", "notes_base",
+    "main_accords", "size_ml",
+    "primary_text", "detailed_text", "raw_description",
+    "keywords", "image_local_path", "price_bucket",
+    "in_stock", "product_link",
+]
+
+def product_to_csv_row(product: Union[ProductRecord, Dict]) -> Dict:
+    product = _as_record(product)
+    return {
+        "product_id":       product.product_id,
+        "name":             product.name,
+        "sku":              product.sku,
+        "article_code":     product.article_code,
+        "price_display":    product.price_display,
+        "price_numeric":    product.price_numeric,
+        "stock_status":     product.stock_status,
+        "category_l1":      product.category_l1,
+        "category_l2":      product.gender,
+        "product_type":     product.product_type,
+        "color":            product.color,
+        "fabric":           product.fabric,
+        "season":           product.season,
+        "wear_type":        product.wear_type,
+        "fit_type":         product.fit_type,
+        "sizes_available":  "|".join(product.sizes_available),
+        "fragrance_category": product.fragrance_category,
+        "notes_top":        product.notes_top,
+        "notes_heart":      product.notes_heart,
+        "notes_base":       product.notes_base,
+        "main_accords":     product.main_accords,
+        "size_ml":          product.size_ml,
+        "primary_text":     product.primary_text,
+        "detailed_text":    product.detailed_text,
+        "raw_description":  product.raw_description,
+        "keywords":         "|".join(product.keywords),
+        "image_local_path": product.image_local_path,
+        "price_bucket":     product.price_bucket,
+        "in_stock":         product.in_stock,
+        "product_link":     product.product_link,
+    }
+
+
+# ═════════════════════════════════════════════════════════════════════════════
+#  STREAMING I/O — bounded-memory JSON array reader / writer
+# ═════════════════════════════════════════════════════════════════════════════
+
+READ_BUFFER_CHARS = 1 << 16
+_WS = " \t\n\r"
+_DELIMS = _WS + ",]"
+
+
+def iter_json_array(path: Path, buffer_chars: int = READ_BUFFER_CHARS) -> Iterator[Any]:
+    """
+    Yield the elements of a top-level JSON array one at a time.
+    Only the current element plus one read buffer is held in memory,
+    so peak RSS does not grow with the size of the scrape.
+    """
+    decoder = json.JSONDecoder()
+    with open(path, "r", encoding="utf-8") as f:
+        buf = f.read(buffer_chars)
+        pos = 0
+        eof = not buf
+
+        def fill():
+            nonlocal buf, pos, eof
+            more = f.read(buffer_chars)
+            if not more:
+                eof = True
+            buf = buf[pos:] + more
+            pos = 0
+
+        def skip_ws():
+            nonlocal pos
+            while True:
+                while pos < len(buf) and buf[pos] in _WS:
+                    pos += 1
+                if pos < len(buf) or eof:
+                    return
+                fill()
+
+        skip_ws()
+        if pos >= len(buf) or buf[pos] != "[":
+            raise ValueError(f"{path}: expected a JSON array")
+        pos += 1
+        skip_ws()
+        if pos < len(buf) and buf[pos] == "]":
+            return
+
+        while True:
+            skip_ws()
+            try:
+                item, end = decoder.raw_decode(buf, pos)
+                # A number cut off at the buffer edge ("-1." of "-1.5") still
+                # decodes; only accept once the following delimiter is buffered.
+                while not eof and (end >= len(buf) or buf[end] not in _DELIMS):
+                    fill()
+                    item, end = decoder.raw_decode(buf, 0)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                fill()
+                continue
+            pos = end
+            yield item
+
+            skip_ws()
+            if pos >= len(buf):
+                raise ValueError(f"{path}: unterminated JSON array")
+            if buf[pos] == "]":
+                return
+            if buf[pos] != ",":
+                raise ValueError(f"{path}: expected ',' or ']' at element boundary")
+            pos += 1
+
+
+def staging_path(path: Path) -> Path:
+    """Sibling temp file that is renamed over `path` once it is complete."""
+    return path.with_name(path.name + ".tmp")
+
+
+def write_json_atomic(path: Path, obj: Any) -> None:
+    tmp = staging_path(path)
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(obj, f, indent=2, ensure_ascii=False)
+    os.replace(tmp, path)
+
+
+class JsonArrayWriter:
+    """
+    Streams items to a JSON array file, one at a time.
+    Output is byte-identical to json.dump(items, f, indent=2, ensure_ascii=False).
+    Items go to a staging file that close() renames over `path`; abort()
+    discards it and leaves any previous `path` untouched.
+    encode(item), when given, must return that same text for one item with
+    continuation lines indented by two spaces (ProductRecord.to_json("  ")).
+    """
+
+    def __init__(self, path: Path, encode: Optional[Callable[[Any], str]] = None):
+        self.path = path
+        self.count = 0
+        self.encode = encode or (lambda item: json.dumps(item, indent=2, ensure_ascii=False)
+                                 .replace("\n", "\n  "))
+        self._f = open(staging_path(path), "w", encoding="utf-8")
+
+    def write(self, item: Any) -> None:
+        self._f.write("[\n  " if self.count == 0 else ",\n  ")
+        self._f.write(self.encode(item))
+        self.count += 1
+
+    def close(self) -> None:
+        self._f.write("\n]" if self.count else "[]")
+        self._f.close()
+        os.replace(staging_path(self.path), self.path)
+
+    def abort(self) -> None:
+        self._f.close()
+        staging_path(self.path).unlink(missing_ok=True)
+
+
+class CsvRowWriter:
+    """Streams product_to_csv_row() rows to products_flat.csv, staged like JsonArrayWriter."""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.count = 0
+        self._f = open(staging_path(path), "w", newline="", encoding="utf-8")
+        self._writer = csv.DictWriter(self._f, fieldnames=CSV_FIELDS)
+        self._writer.writeheader()
+
+    def write(self, row: Dict) -> None:
+        self._writer.writerow(row)
+        self.count += 1
+
+    def close(self) -> None:
+        self._f.close()
+        os.replace(staging_path(self.path), self.path)
+
+    def abort(self) -> None:
+        self._f.close()
+        staging_path(self.path).unlink(missing_ok=True)
+
+
+class OutputSinks:
+    """
+    The five phase0 outputs (plus the BM25 statistics and the columnar
+    export when enabled), fed one processed product at a time.
+    write() takes the product and its project_product() projections, so
+    nothing is buffered per format. commit() publishes every file;
+    abort() drops the staged files and keeps the previous run's outputs.
+    """
+
+    def __init__(self, output_dir: Path, columnar: bool = False, bm25_stats: bool = False):
+        output_dir.mkdir(parents=True, exist_ok=True)
+        self.hierarchical   = JsonArrayWriter(output_dir / "products_hierarchical.json",
+                                              encode=lambda product: product.to_json("  "))
+        self.bm25_corpus    = JsonArrayWriter(output_dir / "bm25_corpus.json")
+        self.attr_indexed   = JsonArrayWriter(output_dir / "products_attribute_indexed.json")
+        self.image_registry = JsonArrayWriter(output_dir / "image_registry.json")
+        self.flat_csv       = CsvRowWriter(output_dir / "products_flat.csv")
+        self.writers = [self.hierarchical, self.bm25_corpus, self.attr_indexed,
+                        self.image_registry, self.flat_csv]
+        self.columnar = ColumnarWriter(output_dir / COLUMNAR_NAME) if columnar else None
+        if self.columnar:
+            self.writers.append(self.columnar)
+        # after bm25_corpus in self.writers: it hashes the closed corpus file
+        self.bm25_stats = (BM25StatsWriter(output_dir / BM25_STATS_NAME, self.bm25_corpus.path)
+                           if bm25_stats else None)
+        if self.bm25_stats:
+            self.writers.append(self.bm25_stats)
+
+    def write(self, product: ProductRecord, bm25_entry: Dict, attr_entry: Dict,
+              img_entry: Optional[Dict], csv_row: Dict) -> None:
+        self.hierarchical.write(product)
+        self.bm25_corpus.write(bm25_entry)
+        self.attr_indexed.write(attr_entry)
+        if img_entry:
+            self.image_registry.write(img_entry)
+        self.flat_csv.write(csv_row)
+        if self.columnar:
+            self.columnar.write(product)
+        if self.bm25_stats:
+            self.bm25_stats.write(bm25_entry)
+
+    def commit(self) -> None:
+        for w in self.writers:
+            w.close()
+
+    def abort(self) -> None:
+        for w in self.writers:
+            w.abort()
+
+
+# ═════════════════════════════════════════════════════════════════════════════
+#  PROFILING — per-stage wall time and call counts (--profile)
+# ═════════════════════════════════════════════════════════════════════════════
+#  The extractor functions are called through module globals, so profiling
+#  rebinds those names to timing wrappers. A wrapper charges the StageProfile
+#  of the chunk being processed (_active_profile); chunk profiles travel back
+#  in the chunk stats and merge_stats() folds them together, so timings from
+#  pool workers add up like every other counter. Stage seconds are therefore
+#  summed over workers; products/sec uses the parent's wall clock.
+
+PROFILE_NAME    = "pipeline_profile.json"
+PROFILE_STAGES  = ("extract_gender", "classify_product_type", "_parse_fragrance",
+                   "build_primary_chunk", "build_detailed_chunk", "generate_hyde",
+                   "build_keywords", "project_product", "near_duplicate_key")
+SLOWEST_RECORDS = 20
+
+_active_profile: Optional["StageProfile"] = None
+
+
+class StageProfile:
+    """Cumulative seconds and calls per stage, plus the slowest records."""
+
+    def __init__(self):
+        self.seconds: Counter = Counter()
+        self.calls: Counter = Counter()
+        self.slowest: List[Tuple[float, str]] = []   # min-heap of (seconds, product_id)
+
+    def add(self, stage: str, seconds: float) -> None:
+        self.seconds[stage] += seconds
+        self.calls[stage] += 1
+
+    def add_record(self, product_id: str, seconds: float) -> None:
+        self.add("process_product", seconds)
+        if len(self.slowest) < SLOWEST_RECORDS:
+            heapq.heappush(self.slowest, (seconds, product_id))
+        elif seconds > self.slowest[0][0]:
+            heapq.heapreplace(self.slowest, (seconds, product_id))
+
+    def timed(self, stage: str, fn):
+        """fn wrapped to charge its wall time to this profile."""
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                self.add(stage, time.perf_counter() - start)
+        return wrapper
+
+    def timed_iter(self, stage: str, items: Iterable) -> Iterator:
+        """items re-yielded with the time spent producing each one charged to stage."""
+        it = iter(items)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(it)
+            except StopIteration:
+                return
+            self.add(stage, time.perf_counter() - start)
+            yield item
+
+    def __iadd__(self, other: "StageProfile") -> "StageProfile":
+        self.seconds += other.seconds
+        self.calls += other.calls
+        self.slowest = heapq.nsmallest(SLOWEST_RECORDS, self.slowest + other.slowest,
+                                       key=lambda r: -r[0])
+        heapq.heapify(self.slowest)
+        return self
+
+    def report(self, products: int, wall_seconds: float, workers: int) -> Dict:
+        return {
+            "generated_at": datetime.now().isoformat(),
+            "workers": workers,
+            "products": products,
+            "wall_seconds": round(wall_seconds, 3),
+            "products_per_sec": round(products / wall_seconds, 1) if wall_seconds else None,
+            "stages": {
+                stage: {
+                    "seconds": round(seconds, 4),
+                    "calls": self.calls[stage],
+                    "us_per_call": round(seconds / self.calls[stage] * 1e6, 2),
+                }
+                for stage, seconds in self.seconds.most_common()
+            },
+            "slowest_records": [
+                {"product_id": pid, "ms": round(seconds * 1e3, 3)}
+                for seconds, pid in sorted(self.slowest, reverse=True)
+            ],
+        }
+
+
+def _stage_wrapper(stage: str, fn):
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        profile = _active_profile
+        if profile is None:
+            return fn(*args, **kwargs)
+        start = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            profile.add(stage, time.perf_counter() - start)
+    wrapper.__profiled__ = True
+    return wrapper
+
+
+def install_stage_timers() -> None:
+    """Rebind PROFILE_STAGES to timing wrappers (idempotent, per process)."""
+    module = globals()
+    for stage in PROFILE_STAGES:
+        if not getattr(module[stage], "__profiled__", False):
+            module[stage] = _stage_wrapper(stage, module[stage])
+
+
+# ═════════════════════════════════════════════════════════════════════════════
+#  PARALLEL EXECUTION — ordered chunks fanned out across a process pool
+# ═════════════════════════════════════════════════════════════════════════════
+
+DEFAULT_CHUNK_SIZE = 200
+
+
+def new_stats() -> Dict:
+    return {
+        "total": 0,
+        "gender": Counter(),
+        "product_type": Counter(),
+        "category_l1": Counter(),
+        "with_fragrance_notes": 0,
+        "with_detailed_chunk": 0,
+        "with_image": 0,
+        "with_color": 0,
+        "with_fabric": 0,
+    }
+
+
+def update_stats(stats: Dict, product: ProductRecord) -> None:
+    stats["total"] += 1
+    stats["gender"][product.gender] += 1
+    stats["product_type"][product.product_type] += 1
+    stats["category_l1"][product.category_l1] += 1
+    if product.notes_top:
+        stats["with_fragrance_notes"] += 1
+    if product.detailed_text.strip():
+        stats["with_detailed_chunk"] += 1
+    if product.image_local_path:
+        stats["with_image"] += 1
+    if product.color:
+        stats["with_color"] += 1
+    if product.fabric:
+        stats["with_fabric"] += 1
+
+
+def merge_stats(into: Dict, other: Dict) -> Dict:
+    """Fold a per-chunk stats dict into the running totals (Counters and StageProfiles add)."""
+    for key, value in other.items():
+        if key in into:
+            into[key] += value
+        else:
+            into[key] = value
+    return into
+
+
+def process_chunk(raws: List[Dict], reused: Optional[List[Optional[ProductRecord]]] = None,
+                  near_dup: Optional[List[bool]] = None,
+                  profile: bool = False) -> Tuple[List[Tuple], Dict]:
+    """
+    Process one chunk of raw products.
+    Returns ([(product, bm25_entry, attr_entry, image_entry_or_None, csv_row, near_dup_key), ...],
+    stats) in input order — the first five are OutputSinks.write() arguments. Runs unchanged
+    in the parent or in a pool worker.
+    reused[i], when given and not None, is the prior enriched product for raws[i]
+    and is passed through instead of calling process_product().
+    near_dup_key is near_duplicate_key(product) when near_dup[i] is true, else None.
+    With profile, stats["profile"] is this chunk's StageProfile.
+    """
+    global _active_profile
+    rows = []
+    stats = new_stats()
+    if profile:
+        install_stage_timers()
+        stats["profile"] = _active_profile = StageProfile()
+    try:
+        for i, raw in enumerate(raws):
+            if reused and reused[i] is not None:
+                product = reused[i]
+            elif profile:
+                start = time.perf_counter()
+                product = process_product(raw)
+                _active_profile.add_record(product.product_id, time.perf_counter() - start)
+            else:
+                product = process_product(raw)
+            rows.append((product, *project_product(product),
+                         near_duplicate_key(product) if near_dup and near_dup[i] else None))
+            update_stats(stats, product)
+    finally:
+        _active_profile = None
+    return rows, stats
+
+
+def iter_chunks(items: Iterable[Dict], size: int) -> Iterator[List[Dict]]:
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def run_chunks(raw_products: Iterable[Dict], workers: int = 1,
+               chunk_size: int = DEFAULT_CHUNK_SIZE,
+               reuse: Optional["IncrementalState"] = None,
+               near_dup: Optional[Callable[[Dict], bool]] = None,
+               profile: bool = False) -> Iterator[Tuple[List, Dict]]:
+    """
+    Yield process_chunk() results in input order.
+    workers <= 1 runs inline; otherwise chunks go to a process pool with at most
+    2 * workers chunks in flight, so results stream back in order without the
+    whole catalog being queued up front. With reuse, unchanged records are
+    resolved in the parent and skip process_product(). near_dup(raw) selects
+    the records that get a near_duplicate_key(); profile is passed through to
+    process_chunk().
+    """
+    def tasks():
+        for chunk in iter_chunks(raw_products, chunk_size):
+            yield (chunk, [reuse.lookup(raw) for raw in chunk] if reuse else None,
+                   [near_dup(raw) for raw in chunk] if near_dup else None, profile)
+
+    if workers <= 1:
+        for task in tasks():
+            yield process_chunk(*task)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        for task in tasks():
+            pending.append(pool.submit(process_chunk, *task))
+            if len(pending) >= workers * 2:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+# ═════════════════════════════════════════════════════════════════════════════
+#  INCREMENTAL RUNS — sku -> sha256(raw record) manifest
+# ═════════════════════════════════════════════════════════════════════════════
+
+MANIFEST_NAME = "phase0_manifest.json"
+CHANGES_NAME  = "phase0_changes.json"
+
+
+def record_hash(raw: Dict) -> str:
+    """Stable content hash of a raw scraped record (key order independent)."""
+    canonical = json.dumps(raw, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def pipeline_fingerprint() -> str:
+    """Hash of this file — any code change invalidates previously enriched output."""
+    return hashlib.sha256(Path(__file__).read_bytes()).hexdigest()
+
+
+class IncrementalState:
+    """
+    Decides per raw record whether the enriched product from the previous run
+    can be reused, and records the hashes that become the next manifest.
+
+    SKUs can repeat in a scrape (one record per category URL), but
+    merge_sku_duplicates() runs first and only the FIRST record per SKU
+    (with every URL in category_sources) reaches lookup(). Manifest and
+    prior-product lookup therefore hold that one merged record per SKU, so a
+    hash match always pairs with the product that was built from it. With
+    --no-dedup every record reaches lookup(): the manifest keeps the last
+    hash and lists the SKUs seen more than once, and the next run reprocesses
+    those rather than guess which of their prior products a hash belongs to.
+
+    Prior products are streamed, not held: `prior_products` yields the
+    previous run's records for the `reusable` SKUs in its output order, which
+    is the input order of that run. lookup() reads ahead to the SKU it needs and hands the
+    record over; records it reads past wait in a side table until their SKU
+    comes up. A catalog in the same order as last time keeps that table
+    empty; a reordered one can fill it up to every reusable product.
+    """
+
+    def __init__(self, prior_hashes: Dict[str, str], prior_products: Iterable[ProductRecord] = (),
+                 reusable: Optional[Set[str]] = None):
+        self.prior_hashes = prior_hashes
+        self.reusable = reusable if reusable is not None else set()
+        self._prior = iter(prior_products)
+        self._ahead: Dict[str, ProductRecord] = {}
+        self.max_ahead = 0
+        self.hashes: Dict[str, str] = {}
+        self.repeated: Dict[str, None] = {}
+        self.changed: Dict[str, None] = {}
+        self.reused = 0
+
+    def _take_prior(self, sku: str) -> Optional[ProductRecord]:
+        prior = self._ahead.pop(sku, None)
+        if prior is not None:
+            return prior
+        for product in self._prior:
+            if product.sku == sku:
+                return product
+            self._ahead[product.sku] = product
+            self.max_ahead = max(self.max_ahead, len(self._ahead))
+        return None
+
+    def lookup(self, raw: Dict) -> Optional[ProductRecord]:
+        sku = raw.get("sku", "")
+        if not sku:
+            self.changed[make_product_id(sku)] = None
+            return None
+        digest = record_hash(raw)
+        if sku in self.hashes:
+            self.repeated[sku] = None
+        self.hashes[sku] = digest
+        prior = None
+        if sku in self.reusable and self.prior_hashes.get(sku) == digest:
+            prior = self._take_prior(sku)
+            self.reusable.discard(sku)
+            if not self.reusable:
+                self.close()
+        if prior is not None:
+            self.reused += 1
+            return prior
+        self.changed[make_product_id(sku)] = None
+        return None
+
+    def close(self) -> None:
+        """Releases the prior output file and any records read ahead of their SKU."""
+        close = getattr(self._prior, "close", None)
+        if close is not None:
+            close()
+        self._prior = iter(())
+        self._ahead.clear()
+
+    def removed(self) -> List[str]:
+        return sorted(make_product_id(sku) for sku in self.prior_hashes if sku not in self.hashes)
+
+
+def load_incremental_state(raw_products: Iterable[Dict], output_dir: Path) -> Tuple[IncrementalState, bool]:
+    """
+    Returns (state, full_rebuild). Prior output is only trusted when the
+    manifest was written by this exact pipeline code. A hash pre-pass over
+    raw_products (the same stream the run will process) selects which prior
+    products are reusable; those are then read from the previous
+    products_hierarchical.json alongside the run instead of being loaded up
+    front (see IncrementalState). That file stays in place until the new
+    outputs are committed, after the last record has been looked up.
+    """
+    manifest_path = output_dir / MANIFEST_NAME
+    hier_path = output_dir / "products_hierarchical.json"
+    if not manifest_path.exists() or not hier_path.exists():
+        return IncrementalState({}), True
+
+    with open(manifest_path, "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    if manifest.get("pipeline_fingerprint") != pipeline_fingerprint():
+        print("   Pipeline code changed since last run — full rebuild")
+        return IncrementalState({}), True
+
+    prior_hashes = manifest.get("products", {})
+    repeated = set(manifest.get("repeated_skus", []))
+    reusable = set()
+    for raw in raw_products:
+        sku = raw.get("sku", "")
+        if sku and sku not in repeated and prior_hashes.get(sku) == record_hash(raw):
+            reusable.add(sku)
+
+    def prior_products() -> Iterator[ProductRecord]:
+        for product in iter_json_array(hier_path):
+            if product["product_core"]["sku"] in reusable:
+                yield ProductRecord.from_dict(product)
+
+    return IncrementalState(prior_hashes, prior_products(), reusable), False
+
+
+def write_incremental_outputs(state: IncrementalState, output_dir: Path, full_rebuild: bool) -> None:
+    now = datetime.now().isoformat()
+    write_json_atomic(output_dir / CHANGES_NAME, {
+        "generated_at": now,
+        "full_rebuild": full_rebuild,
+        "changed": list(state.changed),
+        "removed": state.removed(),
+        "unchanged_count": state.reused,
+    })
+    # written last: a manifest only exists next to the outputs it describes
+    write_json_atomic(output_dir / MANIFEST_NAME, {
+        "pipeline_fingerprint": pipeline_fingerprint(),
+        "generated_at": now,
+        "products": state.hashes,
+        "repeated_skus": list(state.repeated),
+    })
+
+
+# ═════════════════════════════════════════════════════════════════════════════
+#  DEDUP — one product per SKU, near-duplicate variants marked
+# ═════════════════════════════════════════════════════════════════════════════
+#  The scraper writes a SKU once per category URL it was listed under. A
+#  pre-pass collects those URLs; the stream then keeps the first record of
+#  each SKU with every URL in "category_sources".
+#
+#  Colourways of one design are separate SKUs whose text differs only in the
+#  colour. Each product gets a MinHash signature of its name/description
+#  with its own colour removed (colour, price and stock stay per-variant
+#  metadata); LSH banding finds earlier products with a similar signature and
+#  the first product of a cluster becomes the representative the others point
+#  to via "near_duplicate_of". Candidates must also share the colour-stripped
+#  name, type and gender, so templated text alone never merges two designs.
+
+NEAR_DUPS_NAME     = "phase0_near_duplicates.json"
+NEAR_DUP_THRESHOLD = 0.9    # estimated Jaccard over byte 5-gram shingles
+SHINGLE_CHARS      = 5      # bytes per shingle, at most 8
+MINHASH_PERMS      = 64
+LSH_BANDS          = 8      # 8 bands x 8 rows: J=0.9 pairs collide with p≈0.99, J=0.5 with p≈0.03
+
+if NUMPY_AVAILABLE:
+    # multiply-shift hashes h(x) = ((a*x + b) mod 2^64) >> 32, a odd; uint64 wraps
+    _rng = random.Random(20250101)
+    _MINHASH_A = np.array([_rng.getrandbits(64) | 1 for _ in range(MINHASH_PERMS)], dtype=np.uint64)[:, None]
+    _MINHASH_B = np.array([_rng.getrandbits(64) for _ in range(MINHASH_PERMS)], dtype=np.uint64)[:, None]
+
+
+def strip_color(text: str, color: str) -> str:
+    """Lowercased text with the (lowercased) colour removed and whitespace collapsed."""
+    text = text.lower()
+    if color:
+        text = text.replace(color, " ")
+    return " ".join(text.split())
+
+
+def name_group(raw: Dict) -> str:
+    """Colour-stripped name of a raw record — the name part of near_duplicate_key()'s group."""
+    return strip_color(raw.get("name", ""), raw.get("attributes", {}).get("Color", "").lower())
+
+
+def scan_duplicates(raw_products: Iterable[Dict]) -> Tuple[Dict[str, List[str]], int, set]:
+    """
+    Pre-pass over the raw input. Returns
+      • {sku: [category_source, ...]} for SKUs that occur more than once
+        (URLs in first-seen order, without repeats),
+      • the number of extra records those SKUs account for,
+      • the name_group() values shared by more than one product — only those
+        products can have a near duplicate, so only they need a signature.
+    """
+    first_source: Dict[str, str] = {}
+    sources: Dict[str, List[str]] = {}
+    extra = 0
+    names = Counter()
+    for raw in raw_products:
+        sku = raw.get("sku", "")
+        if sku:
+            url = sys.intern(raw.get("category_source", ""))
+            if sku in first_source:
+                extra += 1
+                urls = sources.setdefault(sku, [first_source[sku]])
+                if url not in urls:
+                    urls.append(url)
+                continue
+            first_source[sku] = url
+        names[name_group(raw)] += 1
+    return sources, extra, {name for name, count in names.items() if count > 1}
+
+
+def merge_sku_duplicates(raw_products: Iterable[Dict], sku_sources: Dict[str, List[str]]) -> Iterator[Dict]:
+    """Yield the first record of each repeated SKU with its category_sources; drop the rest."""
+    seen = set()
+    for raw in raw_products:
+        sku = raw.get("sku", "")
+        if sku in sku_sources:
+            if sku in seen:
+                continue
+            seen.add(sku)
+            raw = dict(raw, category_sources=sku_sources[sku])
+        yield raw
+
+
+def near_duplicate_key(product: ProductRecord) -> Tuple[Tuple[str, str, str], "np.ndarray"]:
+    """(group, MinHash signature) of a product's colour-independent text."""
+    color = product.color.lower()
+
+    name = strip_color(product.name, color)
+    text = strip_color(f"{product.name} {product.detailed_text}", color)
+    # shingles are byte k-grams of the UTF-8 text packed into one integer each
+    data = np.frombuffer(text.encode("utf-8").ljust(SHINGLE_CHARS), dtype=np.uint8).astype(np.uint64)
+    n = len(data) - SHINGLE_CHARS + 1
+    x = data[:n].copy()
+    for j in range(1, SHINGLE_CHARS):
+        x |= data[j:j + n] << np.uint64(8 * j)
+    # repeated shingles cannot change a minimum, and >> 32 commutes with min
+    h = _MINHASH_A * x
+    h += _MINHASH_B
+    signature = (h.min(axis=1) >> np.uint64(32)).astype(np.uint32)
+    return (name, product.product_type, product.gender), signature
+
+
+class NearDuplicateIndex:
+    """
+    LSH index over representative signatures, filled in stream order.
+    assign() returns the representative a product duplicates, or None when
+    the product starts a cluster of its own.
+    """
+
+    def __init__(self, threshold: float = NEAR_DUP_THRESHOLD, bands: int = LSH_BANDS):
+        self.threshold = threshold
+        self.bands = bands
+        self.buckets: List[Dict[Tuple, str]] = [{} for _ in range(bands)]
+        self.signatures: Dict[str, "np.ndarray"] = {}
+        self.clusters: Dict[str, List[str]] = {}
+
+    def assign(self, product_id: str, key: Tuple[Tuple[str, str, str], "np.ndarray"]) -> Optional[str]:
+        group, signature = key
+        band_keys = [(group, band.tobytes()) for band in signature.reshape(self.bands, -1)]
+        for bucket, band_key in zip(self.buckets, band_keys):
+            rep = bucket.get(band_key)
+            if rep is not None and (self.signatures[rep] == signature).mean() >= self.threshold:
+                self.clusters.setdefault(rep, []).append(product_id)
+                return rep
+        for bucket, band_key in zip(self.buckets, band_keys):
+            bucket.setdefault(band_key, product_id)
+        self.signatures[product_id] = signature
+        return None
+
+    def variant_count(self) -> int:
+        return sum(len(v) for v in self.clusters.values())
+
+    def report(self) -> Dict:
+        return {
+            "generated_at": datetime.now().isoformat(),
+            "threshold": self.threshold,
+            "minhash_perms": MINHASH_PERMS,
+            "lsh_bands": self.bands,
+            "clusters": self.clusters,
+        }
+
+
+# ═════════════════════════════════════════════════════════════════════════════
+#  LIBRARY API — stream products through phase0 in-process
+# ═════════════════════════════════════════════════════════════════════════════
+#  Importing this module has no side effects; main() is the CLI on top of
+#  these two calls. A scraper or phase1 can process records as they arrive:
+#
+#      import phase0_preprocessing_pipeline as phase0
+#      for row in phase0.iter_processed(records):
+#          use(row.product.to_dict())
+#
+#      phase0.write_outputs(phase0.iter_processed(records), phase0.OutputSinks(out_dir))
+#
+#  SKU merging needs a pre-pass over the whole input (scan_duplicates), so it
+#  is left to callers that can read their input twice; see main().
+
+
+class Processed(NamedTuple):
+    """One processed product and its flat projections, in OutputSinks.write() order."""
+    product: ProductRecord
+    bm25_entry: Dict
+    attr_entry: Dict
+    image_entry: Optional[Dict]
+    csv_row: Dict
+
+
+def iter_processed(raw_products: Iterable[Dict], workers: int = 1,
+                   chunk_size: int = DEFAULT_CHUNK_SIZE,
+                   reuse: Optional[IncrementalState] = None,
+                   near_dups: Optional[NearDuplicateIndex] = None,
+                   near_dup: Optional[Callable[[Dict], bool]] = None,
+                   stats: Optional[Dict] = None,
+                   profile: bool = False) -> Iterator[Processed]:
+    """
+    Yield a Processed row per raw record, in input order. raw_products is
+    consumed lazily, at most 2 * workers chunks ahead.
+    near_dups marks near-duplicate variants in stream order; near_dup(raw)
+    limits signatures to records that can have one (default: every record).
+    Chunk statistics (see new_stats) are folded into stats when given.
+    reuse and profile are passed to run_chunks().
+    """
+    if near_dups is not None and near_dup is None:
+        near_dup = lambda raw: True
+    for rows, chunk_stats in run_chunks(raw_products, workers, chunk_size, reuse,
+                                        near_dup if near_dups is not None else None, profile):
+        if stats is not None:
+            merge_stats(stats, chunk_stats)
+        for *row, near_dup_key in rows:
+            product = row[0]
+            product.near_duplicate_of = (near_dups.assign(product.product_id, near_dup_key)
+                                         if near_dup_key is not None else None)
+            yield Processed(*row)
+
+
+def write_outputs(processed: Iterable[Processed], sinks: OutputSinks) -> OutputSinks:
+    """
+    Write every row to sinks and commit them. If the rows or a writer raise,
+    the staged files are dropped and the previous outputs stay in place.
+    """
+    try:
+        for row in processed:
+            sinks.write(*row)
+    except BaseException:
+        sinks.abort()
+        raise
+    sinks.commit()
+    return sinks
+
+
+# ═════════════════════════════════════════════════════════════════════════════
+#  MAIN
+# ═════════════════════════════════════════════════════════════════════════════
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="J. master preprocessing pipeline (phase 0)")
+    parser.add_argument("--input", type=Path, default=INPUT_FILE,
+                        help="raw scraped products JSON (default: %(default)s)")
+    parser.add_argument("--output-dir", type=Path, default=OUTPUT_DIR,
+                        help="directory for enriched outputs (default: %(default)s)")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="worker processes; 1 = serial (default: %(default)s)")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE,
+                        help="products per worker task (default: %(default)s)")
+    parser.add_argument("--full", action="store_true",
+                        help=f"ignore {MANIFEST_NAME} and reprocess every product")
+    parser.add_argument("--columnar", action="store_true",
+                        help=f"also write {COLUMNAR_NAME} (needs numpy)")
+    parser.add_argument("--images", action="store_true",
+                        help=f"also preprocess every registered image into {IMAGE_STORE_NAME} "
+                             "(needs numpy and Pillow)")
+    parser.add_argument("--image-root", type=Path, default=None,
+                        help="directory image_local_path is relative to (default: the input's directory)")
+    parser.add_argument("--no-dedup", action="store_true",
+                        help="keep every scraped record and skip near-duplicate marking")
+    parser.add_argument("--near-dup-threshold", type=float, default=NEAR_DUP_THRESHOLD,
+                        help="MinHash similarity for near-duplicate variants; 0 disables "
+                             "(needs numpy, default: %(default)s)")
+    parser.add_argument("--profile", action="store_true",
+                        help=f"time each stage and writer, write {PROFILE_NAME}")
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None):
+    args = parse_args(argv)
+    input_file = args.input
+    output_dir = args.output_dir
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    print("=" * 70)
+    print("  J. E-COMMERCE MULTIMODAL RAG — MASTER PREPROCESSING PIPELINE")
+    print("=" * 70)
+
+    run_start = time.perf_counter()
+    stats = new_stats()
+    profile = None
+    timed = lambda stage, fn: fn
+    if args.profile:
+        stats["profile"] = profile = StageProfile()
+        timed = profile.timed
+
+    dedup = not args.no_dedup
+    sku_sources, sku_extra, shared_names = (timed("scan_duplicates", scan_duplicates)(iter_json_array(input_file))
+                                            if dedup else ({}, 0, set()))
+
+    def raw_products():
+        return merge_sku_duplicates(iter_json_array(input_file), sku_sources)
+
+    if args.full:
+        state, full_rebuild = IncrementalState({}), True
+    else:
+        state, full_rebuild = timed("load_incremental_state", load_incremental_state)(raw_products(), output_dir)
+
+    mode = f"{args.workers} workers" if args.workers > 1 else "serial"
+    mode += ", full rebuild" if full_rebuild else f", incremental: {len(state.reusable)} reusable"
+    print(f"\nStreaming: {input_file} ({mode})")
+    print(f"Writing outputs to {output_dir}/")
+
+    # The previous manifest vouches for the previous outputs; drop it before
+    # they are replaced, so a crash after the swap cannot pair the two.
+    (output_dir / MANIFEST_NAME).unlink(missing_ok=True)
+
+    columnar = args.columnar
+    if columnar and not NUMPY_AVAILABLE:
+        print(f"⚠️  numpy not installed — {COLUMNAR_NAME} skipped. Run: pip install numpy")
+        columnar = False
+
+    near_dups = None
+    if dedup and args.near_dup_threshold > 0:
+        if NUMPY_AVAILABLE:
+            near_dups = NearDuplicateIndex(args.near_dup_threshold)
+        else:
+            print(f"⚠️  numpy not installed — near-duplicate marking skipped. Run: pip install numpy")
+
+    if not NUMPY_AVAILABLE:
+        print(f"⚠️  numpy not installed — {BM25_STATS_NAME} skipped. Run: pip install numpy")
+        (output_dir / BM25_STATS_NAME).unlink(missing_ok=True)
+
+    sinks = OutputSinks(output_dir, columnar, bm25_stats=NUMPY_AVAILABLE)
+    raws = raw_products()
+    if profile:
+        for w in sinks.writers:
+            w.write = profile.timed(f"write:{w.path.name}", w.write)
+        if near_dups is not None:
+            near_dups.assign = profile.timed("near_duplicate_assign", near_dups.assign)
+        raws = profile.timed_iter("read_input", raws)
+    sinks.commit = timed("commit_outputs", sinks.commit)
+
+    def progress(rows: Iterator[Processed]) -> Iterator[Processed]:
+        for count, row in enumerate(rows, 1):
+            yield row
+            if count % 500 == 0:
+                print(f"   Processed {count}...")
+
+    write_outputs(progress(iter_processed(raws, args.workers, args.chunk_size, state, near_dups,
+                                          lambda raw: name_group(raw) in shared_names,
+                                          stats, profile is not None)), sinks)
+    state.close()
+    run_seconds = time.perf_counter() - run_start
+    if not columnar:
+        # a columnar file from an earlier run no longer matches the JSON outputs
+        (output_dir / COLUMNAR_NAME).unlink(missing_ok=True)
+
+    print(f"✓ Processing complete")
+    print(f"   ✓ {sinks.hierarchical.path.name}: {sinks.hierarchical.count} products")
+    print(f"   ✓ {sinks.bm25_corpus.path.name}: {sinks.bm25_corpus.count} documents")
+    print(f"   ✓ {sinks.attr_indexed.path.name}: {sinks.attr_indexed.count} entries")
+    print(f"   ✓ {sinks.image_registry.path.name}: {sinks.image_registry.count} images")
+    print(f"   ✓ {sinks.flat_csv.path.name}: {sinks.flat_csv.count} rows")
+    if sinks.columnar:
+        print(f"   ✓ {sinks.columnar.path.name}: {sinks.columnar.count} rows")
+    if sinks.bm25_stats:
+        print(f"   ✓ {sinks.bm25_stats.path.name}: {sinks.bm25_stats.count} documents, "
+              f"{len(sinks.bm25_stats.vocab)} terms")
+
+    if dedup:
+        print(f"   ✓ SKU duplicates merged: {sku_extra} records into {len(sku_sources)} products")
+    if near_dups is not None:
+        write_json_atomic(output_dir / NEAR_DUPS_NAME, near_dups.report())
+        print(f"   ✓ {NEAR_DUPS_NAME}: {near_dups.variant_count()} variants "
+              f"in {len(near_dups.clusters)} clusters")
+    else:
+        (output_dir / NEAR_DUPS_NAME).unlink(missing_ok=True)
+
+    if args.images:
+        if NUMPY_AVAILABLE and PIL_AVAILABLE:
+            image_root = args.image_root or input_file.parent
+            index = timed("build_image_store", build_image_store)(
+                iter_json_array(sinks.image_registry.path), image_root, output_dir, args.workers)
+            print(f"   ✓ {IMAGE_STORE_NAME}: {len(index['rows'])} images, {len(index['failed'])} failed, "
+                  f"{len(index['duplicate_groups'])} duplicate photo groups")
+        else:
+            print(f"⚠️  numpy/Pillow not installed — {IMAGE_STORE_NAME} skipped. Run: pip install numpy pillow")
+
+    write_incremental_outputs(state, output_dir, full_rebuild)
+    print(f"   ✓ {CHANGES_NAME}: {len(state.changed)} changed, "
+          f"{state.reused} unchanged, {len(state.removed())} removed")
+
+    if profile:
+        report = profile.report(stats["total"], run_seconds, args.workers)
+        write_json_atomic(output_dir / PROFILE_NAME, report)
+        print(f"   ✓ {PROFILE_NAME}: {report['products_per_sec']} products/s")
+        for stage, row in list(report["stages"].items())[:8]:
+            print(f"      {stage:40s} {row['seconds']:8.2f}s {row['calls']:8d} calls "
+                  f"{row['us_per_call']:9.1f} µs/call")
+
+    print_statistics(stats)
+
+    print(f"\nOutput Files:")
+    for w in sinks.writers:
+        size = w.path.stat().st_size / (1024 * 1024)
+        print(f"   {w.path.name:45s} {size:6.1f} MB")
+
+    print(f"\nMaster preprocessing complete!")
+    print(f"   Next: Update config.py to point to enriched_data/, then run Phase 1 (embed)")
+
+
+def print_statistics(stats: Dict) -> None:
+    total = stats["total"] or 1
+
+    print("\n" + "=" * 70)
+    print("  PIPELINE STATISTICS")
+    print("=" * 70)
+
+    print(f"\nGender Distribution:")
+    for g, c in stats["gender"].most_common():
+        bar = "█" * int(c / total * 40)
+        print(f"   {g:10s}: {c:4d} ({c/total*100:5.1f}%) {bar}")
+
+    print(f"\n Top Product Types:")
+    for pt, c in stats["product_type"].most_common(20):
+        print(f"   {pt:25s}: {c:4d}")
+
+    print(f"\nCategory L1 (top-level):")
+    for cat, c in stats["category_l1"].most_common():
+        print(f"   {cat:15s}: {c:4d}")
+
+    print(f"\nData Coverage:")
+    print(f"   With detailed chunk:    {stats['with_detailed_chunk']:4d}/{stats['total']} ({stats['with_detailed_chunk']/total*100:.1f}%)")
+    print(f"   With fragrance notes:   {stats['with_fragrance_notes']:4d}/{stats['total']} ({stats['with_fragrance_notes']/total*100:.1f}%)")
+    print(f"   With images:            {stats['with_image']:4d}/{stats['total']} ({stats['with_image']/total*100:.1f}%)")
+    print(f"   With color:             {stats['with_color']:4d}/{stats['total']} ({stats['with_color']/total*100:.1f}%)")
+    print(f"   With fabric:            {stats['with_fabric']:4d}/{stats['total']} ({stats['with_fabric']/total*100:.1f}%)")
+
+
+if __name__ == "__main__":
+    main()
@@ -7,26 +7,96 @@ Fixes:
   3. Enriches fragrance_category from products_attribute_indexed.json
   4. Averages ALL HyDE embeddings (not just first)
   5. Adds notes_combined field for unified note search
+  6. Near-duplicate variants (phase0 "near_duplicate_of") reuse their
+     representative's vectors instead of being embedded again
+  7. Concurrent embedding (embedding_engine.py): requests from many
+     products are packed together, up to MAX_IN_FLIGHT run at once under a
+     token-bucket governor that follows the rate-limit headers and 429s,
+     and products are written as soon as they are complete, in input order
+  8. Persistent cache (embedding_cache.py): texts embedded by an earlier run
+     with the same model and dims are read from EMBEDDINGS_DIR instead of
+     being sent again; --evict-cache drops entries the catalog no longer uses
+  9. Each distinct text is embedded once per run; products sharing a text
+     (templated HyDE queries/answers) all receive that one vector
+ 10. Requests are packed by token count (the provider's count_tokens:
+     tiktoken when installed, a local model's own tokenizer) up to
+     BATCH_SIZE inputs / BATCH_TOKENS tokens; texts over the model's context
+     are embedded in windows and averaged back into their one slot
+ 11. Output goes to EMBEDDINGS_DIR/vector_store/ (vector_store.py): float32
+     .npy per vector kind, an id → row index and products.jsonl without
+     vectors; --json also writes the old EMBEDDINGS_OUTPUT file
+ 12. Vectors are float32 NumPy arrays throughout; HyDE averages of all
+     products completed together are one segmented mean (segment_means)
+ 13. Products are checkpointed every CHECKPOINT_EVERY into append-only parts
+     with a manifest; --resume skips the products already checkpointed and
+     the parts are compacted into vector_store/ once the run completes
+ 14. A rejected request is bisected until the offending texts are isolated;
+     texts that still fail get no vector (never a zero vector) and are listed
+     in EMBEDDINGS_DIR/embedding_dead_letter.jsonl. Transient errors are
+     retried with exponential backoff and jitter
+ 15. Vectors come from an embedding provider (embedding_providers.py):
+     OpenAI by default, EMBED_PROVIDER=local for a CPU sentence-transformers
+     model or EMBED_PROVIDER=hashing for a deterministic offline one. The
+     provider's model and dims are recorded in the vector store and stats
+ 16. The store also gets int8 (per-dimension scale) and 1-bit sign copies of
+     every vector kind, with a cosine-error calibration in quantization.json
+     (--no-quantize skips them)
 """
 
-import json, os, time, re
-from typing import List, Dict, Any, Optional
+import json, os, time, re, queue, asyncio, hashlib, argparse, functools, threading
+from collections import Counter, deque
+from typing import List, Dict, Any, Optional, Iterable, AsyncIterator, Tuple
 from pathlib import Path
 from datetime import datetime
+import numpy as np
 from tqdm import tqdm
-from openai import OpenAI
-from dotenv import load_dotenv
-from config import HIERARCHICAL_JSON, ATTRIBUTE_INDEXED_JSON, EMBEDDINGS_DIR, EMBEDDINGS_OUTPUT
 
-load_dotenv()
-
-MODEL         = "text-embedding-3-large"
-DIMS          = 3072
-BATCH_SIZE    = 50
+from embedding_cache import EmbeddingCache, CACHE_NAME
+from embedding_engine import (EmbeddingEngine, MAX_IN_FLIGHT, REQUESTS_PER_MINUTE, TOKENS_PER_MINUTE,
+                              backoff, check_rows, is_transient)
+from embedding_providers import make_provider
+from phase0_preprocessing_pipeline import JsonArrayWriter
+from vector_store import (VectorStore, VectorStoreWriter, Checkpoints, product_vectors,
+                          quantize_store, remove_quantized, VECTOR_STORE_DIR, CHECKPOINT_DIR,
+                          QUANT_REPORT_NAME)
+
+try:
+    from dotenv import load_dotenv
+    load_dotenv()
+except ImportError:
+    pass
+
+BASE_DIR = Path(__file__).parent
+try:
+    from config import HIERARCHICAL_JSON, ATTRIBUTE_INDEXED_JSON, EMBEDDINGS_DIR, EMBEDDINGS_OUTPUT
+except ImportError:
+    HIERARCHICAL_JSON      = BASE_DIR / "enriched_data" / "products_hierarchical.json"
+    ATTRIBUTE_INDEXED_JSON = BASE_DIR / "enriched_data" / "products_attribute_indexed.json"
+    EMBEDDINGS_DIR         = BASE_DIR / "enriched_data"
+    EMBEDDINGS_OUTPUT      = BASE_DIR / "enriched_data" / "products_with_embeddings.json"
+
+BATCH_SIZE    = 256        # inputs per request (the API allows 2048)
+BATCH_TOKENS  = 50_000     # tokens per request (the API allows 300k)
+WRITE_QUEUE   = 64         # embedded products waiting for the writer thread
+CHECKPOINT_EVERY = 500     # products per checkpoint part
 MAX_RETRIES   = 3
-RETRY_DELAY   = 2
-
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+RETRY_DELAY   = 2          # seconds before the first retry, doubled for each one
+DEAD_LETTER_NAME = "embedding_dead_letter.jsonl"
+
+provider = make_provider()      # EMBED_PROVIDER / EMBED_MODEL / EMBED_DIMS, default OpenAI
+MODEL    = provider.model
+DIMS     = provider.dims
+
+
+def make_engine() -> EmbeddingEngine:
+    """Async engine for the embedding pipeline; limits can be lowered via EMBED_* env vars."""
+    return EmbeddingEngine(
+        provider,
+        max_in_flight=int(os.getenv("EMBED_MAX_IN_FLIGHT", MAX_IN_FLIGHT)),
+        requests_per_minute=float(os.getenv("EMBED_REQUESTS_PER_MINUTE", REQUESTS_PER_MINUTE)),
+        tokens_per_minute=float(os.getenv("EMBED_TOKENS_PER_MINUTE", TOKENS_PER_MINUTE)),
+        max_retries=MAX_RETRIES, retry_delay=RETRY_DELAY,
+    )
 
 def parse_fragrance_category(by_category_text: str) -> str:
     """
@@ -60,181 +130,594 @@ def build_attribute_lookup(attr_indexed_path: Path) -> Dict[str, Dict]:
     print(f"✓ Built attribute lookup for {len(lookup)} products")
     return lookup
 
-def embed_batch(texts: List[str], retry: int = 0) -> List[List[float]]:
-    """Embed a list of texts; returns list of 3072-dim vectors."""
-    if not texts:
-        return []
+class DeadLetter:
+    """EMBEDDINGS_DIR/embedding_dead_letter.jsonl: one JSON line per text left without a vector."""
 
-    valid, valid_idx = [], []
-    for i, t in enumerate(texts):
-        if t and isinstance(t, str) and t.strip():
-            valid.append(t.strip())
-            valid_idx.append(i)
+    def __init__(self, path: Path, append: bool = False):
+        self.path = path
+        self.count = 0
+        self._file = open(path, "a" if append else "w", encoding="utf-8")
 
-    if not valid:
-        return [[0.0] * DIMS for _ in texts]
+    def add(self, text: str, error: str, **where) -> None:
+        entry = {**where, "text": text, "error": error, "model": MODEL, "failed_at": datetime.now().isoformat()}
+        self._file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        self._file.flush()
+        self.count += 1
 
-    try:
-        resp = client.embeddings.create(
-            model=MODEL, input=valid, encoding_format="float"
-        )
-        valid_vecs = [item.embedding for item in resp.data]
-
-        if len(valid) == len(texts):
-            return valid_vecs
-
-        result = [[0.0] * DIMS for _ in texts]
-        for new_i, orig_i in enumerate(valid_idx):
-            result[orig_i] = valid_vecs[new_i]
-        return result
-
-    except Exception as e:
-        if retry < MAX_RETRIES:
-            time.sleep(RETRY_DELAY * (retry + 1))
-            return embed_batch(texts, retry + 1)
-        print(f"embed_batch failed: {e}")
-        return [[0.0] * DIMS for _ in texts]
-
-def average_vectors(vecs: List[List[float]]) -> List[float]:
-    """Average a list of same-dim vectors into one representative vector."""
-    if not vecs:
-        return [0.0] * DIMS
-    if len(vecs) == 1:
-        return vecs[0]
-    avg = [sum(col) / len(vecs) for col in zip(*vecs)]
-    norm = sum(x * x for x in avg) ** 0.5
-    if norm > 0:
-        avg = [x / norm for x in avg]
-    return avg
+    def close(self) -> None:
+        self._file.close()
 
-def process_product_batch(
-    products: List[Dict],
-    attr_lookup: Dict[str, Dict],
-) -> List[Dict]:
+
+def embed_batch(texts: List[str], dead_letter: Optional[DeadLetter] = None) -> List[Optional[np.ndarray]]:
     """
-    1. Enrich fragrance_category and notes_combined on each product.
-    2. Collect ALL non-empty text segments (chunks + all HyDE queries + answers).
-    3. Embed them in one pass.
-    4. Assign embeddings back with the SAME guard used during collection
-       (fixing the off-by-one bug).
-    5. Store averaged HyDE embedding.
+    Embed a list of texts; returns one float32 vector per text, None for empty
+    texts and for texts that failed. Transient errors are retried with
+    backoff; a batch the API rejects is split in half until the bad texts are
+    isolated, and those go to `dead_letter` instead of getting a zero vector.
     """
+    result: List[Optional[np.ndarray]] = [None] * len(texts)
+
+    def send(idx: List[int]) -> None:
+        batch = [texts[i].strip() for i in idx]
+        for retry in range(MAX_RETRIES + 1):
+            try:
+                vectors = check_rows(provider.embed(batch), batch)
+            except Exception as e:
+                if is_transient(e) and retry < MAX_RETRIES:
+                    time.sleep(backoff(retry, RETRY_DELAY))
+                    continue
+                if len(idx) > 1 and not is_transient(e):
+                    send(idx[:len(idx) // 2])
+                    send(idx[len(idx) // 2:])
+                    return
+                print(f"⚠️  embed_batch: {len(idx)} texts failed: {e}")
+                if dead_letter is not None:
+                    for text in batch:
+                        dead_letter.add(text, f"{type(e).__name__}: {e}")
+                return
+            for i, vec in zip(idx, vectors):
+                result[i] = vec
+            return
+
+    valid = [i for i, t in enumerate(texts) if t and isinstance(t, str) and t.strip()]
+    if valid:
+        send(valid)
+    return result
+
+def average_vectors(vecs: List[np.ndarray], weights: Optional[List[float]] = None) -> np.ndarray:
+    """Average same-dim vectors (optionally weighted) into one normalised float32 vector."""
+    if len(vecs) == 0:
+        return np.zeros(DIMS, dtype=np.float32)
+    if len(vecs) == 1:
+        return np.asarray(vecs[0], dtype=np.float32)
+    avg = np.average(np.asarray(vecs, dtype=np.float64), axis=0, weights=weights)
+    norm = np.linalg.norm(avg)
+    if norm > 0:
+        avg /= norm
+    return avg.astype(np.float32)
 
-    for product in products:
-        pid = product.get("product_id", "")
-
-        fm = product.setdefault("fragrance_metadata", {})
-        if not fm.get("fragrance_category") and pid in attr_lookup:
-            fm["fragrance_category"] = attr_lookup[pid]["fragrance_category"]
-
-        parts = [
-            fm.get("notes_top", ""),
-            fm.get("notes_heart", ""),
-            fm.get("notes_base", ""),
-            fm.get("main_accords", ""),
-        ]
-        product["notes_combined"] = " | ".join(p for p in parts if p.strip())
 
-        chunks = product.get("searchable_chunks", [])
-        if chunks and fm.get("fragrance_category"):
-            primary = chunks[0]
-            if fm["fragrance_category"] not in primary.get("content", ""):
-                primary["content"] = (
-                    primary.get("content", "").rstrip(".")
-                    + f". {fm['fragrance_category']} fragrance."
-                )
+def segment_means(matrix: np.ndarray, counts: np.ndarray) -> np.ndarray:
+    """
+    average_vectors() of every run of counts[i] consecutive rows of `matrix`,
+    as one float32 [len(counts), dims] matrix: runs of several rows are
+    averaged and normalised, a single row is kept as is, an empty run is zero.
+    Runs are zero-padded to [len(counts), longest run, dims] and summed along
+    the middle axis (np.add.reduceat over rows is several times slower).
+    """
+    counts = np.asarray(counts, dtype=np.int64)
+    dims = matrix.shape[1]
+    if len(matrix) == 0:
+        return np.zeros((len(counts), dims), dtype=np.float32)
+    run = np.repeat(np.arange(len(counts)), counts)
+    offset = np.arange(len(matrix)) - np.repeat(np.cumsum(counts) - counts, counts)
+    padded = np.zeros((len(counts), counts.max(), dims), dtype=np.float32)
+    padded[run, offset] = matrix
+    means = padded.sum(axis=1, dtype=np.float64) / np.maximum(counts, 1)[:, None]
+    multi = counts > 1
+    norms = np.linalg.norm(means[multi], axis=1, keepdims=True)
+    means[multi] /= np.where(norms > 0, norms, 1.0)
+    return means.astype(np.float32)
+
+
+def copy_embeddings(src: Dict, dst: Dict) -> None:
+    """Give a near-duplicate variant its representative's vectors (shared, not copied)."""
+    for chunk, rep_chunk in zip(dst.get("searchable_chunks", []), src.get("searchable_chunks", [])):
+        if "embedding" in rep_chunk:
+            chunk["embedding"] = rep_chunk["embedding"]
+            chunk.pop("embedding_placeholder", None)
+
+    hyde = dst.setdefault("hyde_components", {})
+    rep_hyde = src.get("hyde_components", {})
+    for key in ("query_embeddings", "answer_embeddings", "hyde_query_avg", "hyde_answer_avg"):
+        if key in rep_hyde:
+            hyde[key] = rep_hyde[key]
+    hyde.pop("hyde_embedding_placeholder", None)
+
+
+def enrich_product(product: Dict, attr_lookup: Dict[str, Dict]) -> None:
+    """Fill fragrance_category from the attribute lookup and rebuild notes_combined."""
+    pid = product.get("product_id", "")
+
+    fm = product.setdefault("fragrance_metadata", {})
+    if not fm.get("fragrance_category") and pid in attr_lookup:
+        fm["fragrance_category"] = attr_lookup[pid]["fragrance_category"]
+
+    parts = [
+        fm.get("notes_top", ""),
+        fm.get("notes_heart", ""),
+        fm.get("notes_base", ""),
+        fm.get("main_accords", ""),
+    ]
+    product["notes_combined"] = " | ".join(p for p in parts if p.strip())
+
+    chunks = product.get("searchable_chunks", [])
+    if chunks and fm.get("fragrance_category"):
+        primary = chunks[0]
+        if fm["fragrance_category"] not in primary.get("content", ""):
+            primary["content"] = (
+                primary.get("content", "").rstrip(".")
+                + f". {fm['fragrance_category']} fragrance."
+            )
+
+
+SECTIONS = ("chunk", "hyde_query", "hyde_answer")
+
+
+def collect_texts(product: Dict) -> List[Tuple[str, int, str]]:
+    """(section, index, text) of every non-empty text to embed: chunks, HyDE queries, HyDE answers."""
+    items = []
+    for ci, chunk in enumerate(product.get("searchable_chunks", [])):
+        content = chunk.get("content", "")
+        if content and isinstance(content, str) and content.strip():
+            items.append(("chunk", ci, content.strip()))
+
+    hyde = product.get("hyde_components", {})
+
+    for qi, q in enumerate(hyde.get("hypothetical_queries", [])):
+        if q and isinstance(q, str) and q.strip():
+            items.append(("hyde_query", qi, q.strip()))
+
+    for ai, a in enumerate(hyde.get("hypothetical_answers", [])):
+        if a and isinstance(a, str) and a.strip():
+            items.append(("hyde_answer", ai, a.strip()))
+    return items
+
+
+def assign_vectors(products: List[Dict], vectors: List[Dict[str, Dict[int, np.ndarray]]]) -> None:
+    """
+    Store each product's vectors[section][index] with the SAME guard used by
+    collect_texts() (the off-by-one fix), then its averaged HyDE vectors.
+    The averages of all the products are one segment_means() call; a product
+    without any HyDE query (or answer) vector gets None, not a zero vector.
+    """
+    hyde_rows, counts = [], []
+    for vecs in vectors:
+        for section in ("hyde_query", "hyde_answer"):
+            got = [vecs[section][i] for i in sorted(vecs[section])]
+            hyde_rows.extend(got)
+            counts.append(len(got))
+    matrix = np.stack(hyde_rows) if hyde_rows else np.zeros((0, DIMS), dtype=np.float32)
+    averages = segment_means(matrix, counts)
+
+    for k, (product, vecs) in enumerate(zip(products, vectors)):
+        for ci, chunk in enumerate(product.get("searchable_chunks", [])):
+            content = chunk.get("content", "")
+            if content and isinstance(content, str) and content.strip():
+                if ci in vecs["chunk"]:
+                    chunk["embedding"] = vecs["chunk"][ci]
+                    chunk.pop("embedding_placeholder", None)
 
+        hyde = product.setdefault("hyde_components", {})
+        hyde["query_embeddings"]  = [vecs["hyde_query"][qi] for qi in sorted(vecs["hyde_query"])]
+        hyde["answer_embeddings"] = [vecs["hyde_answer"][ai] for ai in sorted(vecs["hyde_answer"])]
+        hyde["hyde_query_avg"]  = averages[2 * k] if counts[2 * k] else None
+        hyde["hyde_answer_avg"] = averages[2 * k + 1] if counts[2 * k + 1] else None
+        hyde.pop("hyde_embedding_placeholder", None)
 
-    items = []  
 
-    SECTIONS = ("chunk", "hyde_query", "hyde_answer")
+class ProductJob:
+    """One product in the pipeline: its outstanding texts and the vectors received so far."""
 
-    for pi, product in enumerate(products):
-        if not isinstance(product, dict):
-            continue
+    def __init__(self, product: Any, loop: asyncio.AbstractEventLoop):
+        self.product = product
+        self.variant_of: Optional[str] = None
+        self.vectors: Dict[str, Dict[int, np.ndarray]] = {section: {} for section in SECTIONS}
+        self.remaining = 0
+        self.done = loop.create_future()
 
-        for ci, chunk in enumerate(product.get("searchable_chunks", [])):
-            content = chunk.get("content", "")
-            if content and isinstance(content, str) and content.strip(): 
-                items.append((pi, "chunk", ci, content.strip()))
+    def put(self, section: str, index: int, vector: np.ndarray) -> None:
+        self.vectors[section][index] = vector
+        self.remaining -= 1
+        if self.remaining == 0 and not self.done.cancelled():   # cancelled: run interrupted
+            self.done.set_result(None)
 
-        hyde = product.get("hyde_components", {})
+    def receive(self, section: str, index: int, future: asyncio.Future) -> None:
+        """Done-callback of a shared text's future."""
+        self.put(section, index, future.result())
 
-        for qi, q in enumerate(hyde.get("hypothetical_queries", [])):
-            if q and isinstance(q, str) and q.strip():               
-                items.append((pi, "hyde_query", qi, q.strip()))
 
-        for ai, a in enumerate(hyde.get("hypothetical_answers", [])):
-            if a and isinstance(a, str) and a.strip():               
-                items.append((pi, "hyde_answer", ai, a.strip()))
+def is_variant(product: Dict, seen: set, embedded: Dict[str, Dict]) -> bool:
+    """A near-duplicate whose representative has already been embedded (or queued)."""
+    rep = product.get("near_duplicate_of")
+    return bool(rep) and (rep in seen or rep in embedded)
 
-    if not items:
-        return products
 
-    texts = [x[3] for x in items]
-    all_vecs = []
-    for i in range(0, len(texts), BATCH_SIZE):
-        batch_vecs = embed_batch(texts[i : i + BATCH_SIZE])
-        all_vecs.extend(batch_vecs)
-        if i + BATCH_SIZE < len(texts):
-            time.sleep(0.3)
+def count_texts(products: Iterable[Any], attr_lookup: Dict[str, Dict],
+                embedded: Optional[Dict[str, Dict]] = None) -> Counter:
+    """
+    How many times embed_products() will need each text over `products`
+    (variants excluded). Enriches the products, as embedding them would.
+    """
+    embedded = embedded or {}
+    counts: Counter = Counter()
+    seen = set()
+    for product in products:
+        if not isinstance(product, dict):
+            continue
+        enrich_product(product, attr_lookup)
+        if is_variant(product, seen, embedded):
+            continue
+        if not product.get("near_duplicate_of"):
+            seen.add(product.get("product_id"))
+        counts.update(text for *_, text in collect_texts(product))
+    return counts
 
 
-    from collections import defaultdict
-    pdata: Dict[int, Dict[str, Dict[int, List[float]]]] = defaultdict(
-        lambda: {"chunk": {}, "hyde_query": {}, "hyde_answer": {}}
-    )
+async def embed_products(
+    products: Iterable[Any],
+    attr_lookup: Dict[str, Dict],
+    engine: EmbeddingEngine,
+    embedded: Optional[Dict[str, Dict]] = None,
+    representatives: Optional[set] = None,
+    batch_size: int = BATCH_SIZE,
+    batch_tokens: int = BATCH_TOKENS,
+    cache: Optional[EmbeddingCache] = None,
+    text_counts: Optional[Counter] = None,
+    stats: Optional[Counter] = None,
+    dead_letter: Optional[DeadLetter] = None,
+) -> AsyncIterator[Any]:
+    """
+    Yield every product, embedded, in input order.
+
+    A producer task enriches products and packs their texts into requests,
+    across product boundaries, up to batch_size texts or batch_tokens tokens
+    (engine.provider.count_tokens), and hands each full request to the
+    engine. The consumer waits for the oldest product to be complete,
+    assigns its vectors and yields it. The producer stays at most
+    engine.max_in_flight * batch_size products ahead.
+
+    Variants whose representative came earlier (or is in `embedded`,
+    product_id -> embedded product) reuse its vectors. Finished products are
+    registered in `embedded`; only ids in `representatives` are kept when it
+    is given.
+
+    Texts longer than the provider's max_input_tokens are split into token
+    windows that are embedded separately; their token-weighted mean,
+    normalised, becomes the text's single vector, so every (section, index)
+    slot still gets one.
+
+    Each distinct text is sent once: a table maps it to the future of its
+    vector, and every product needing it is served from that future. An
+    entry lives until the last of its text_counts (see count_texts) owners
+    has claimed it; without text_counts it is dropped once resolved, so only
+    texts already queued or in flight are shared.
+
+    With a cache, texts it already holds are not sent; newly embedded texts
+    are added to it.
+
+    Requests go through engine.embed_isolated(), so a rejected batch only
+    fails its offending texts. A failed text leaves its slot empty (no
+    embedding; HyDE averages are taken over the vectors that arrived) and
+    each product slot it leaves empty is added to `dead_letter`.
+
+    `stats` (a Counter) receives "texts" (texts the products needed),
+    "cache_hits", "shared" (API inputs saved by the table), "split_texts"
+    (texts over max_input_tokens) and "failed_slots" (slots left empty).
+    """
+    if embedded is None:
+        embedded = {}
+    if stats is None:
+        stats = Counter()
+    owners_left = Counter(text_counts) if text_counts is not None else None
+    loop = asyncio.get_running_loop()
+    ready: asyncio.Queue = asyncio.Queue(maxsize=engine.max_in_flight * batch_size)
+    table: Dict[str, asyncio.Future] = {}
+    failed: Dict[str, str] = {}                                   # text -> error
+    pending: List[Tuple[str, asyncio.Future, int, bool]] = []     # text, future, tokens, cacheable
+    pending_tokens = 0
+    requests = set()
+    joins = set()
+
+    async def request(batch):
+        texts = [text for text, *_ in batch]
+        vecs, errors = await engine.embed_isolated(texts, [tokens for _, _, tokens, _ in batch])
+        if errors:
+            print(f"⚠️  {len(errors)} of {len(texts)} texts failed: {next(iter(errors.values()))}")
+            for i, error in errors.items():
+                failed[texts[i]] = error
+        if cache is not None:
+            cache.put_many((text, vec) for (text, _, _, cacheable), vec in zip(batch, vecs)
+                           if cacheable and vec is not None)
+        for (_, future, _, _), vec in zip(batch, vecs):
+            # a row must not pin the whole response
+            future.set_result(vec.copy() if vec is not None else None)
+
+    async def join(text, future, pieces):
+        vecs = [await piece for piece, _, _ in pieces]
+        if any(vec is None for vec in vecs):
+            failed[text] = next(failed[piece] for (_, piece, _), vec in zip(pieces, vecs) if vec is None)
+            future.set_result(None)
+            return
+        vec = average_vectors(vecs, [tokens for _, _, tokens in pieces])
+        if cache is not None:
+            cache.put_many([(text, vec)])
+        future.set_result(vec)
+
+    def enqueue(text, future, tokens, cacheable=True):
+        nonlocal pending_tokens
+        if pending and pending_tokens + tokens > batch_tokens:
+            flush()
+        pending.append((text, future, tokens, cacheable))
+        pending_tokens += tokens
+        if len(pending) >= batch_size or pending_tokens >= batch_tokens:
+            flush()
+
+    def submit(text, future):
+        tokens = engine.provider.count_tokens(text)
+        if tokens <= engine.provider.max_input_tokens:
+            enqueue(text, future, tokens)
+            return
+        stats["split_texts"] += 1
+        pieces = []
+        for piece in engine.provider.split_text(text):
+            piece_tokens = engine.provider.count_tokens(piece)
+            pieces.append((loop.create_future(), piece, piece_tokens))
+            enqueue(piece, pieces[-1][0], piece_tokens, cacheable=False)
+        task = loop.create_task(join(text, future, pieces))
+        joins.add(task)
+        task.add_done_callback(joins.discard)
+
+    def release(text, future):
+        if table.get(text) is future:
+            del table[text]
+
+    def claim(job, section, index, text):
+        future = table.get(text)
+        if future is None:
+            future = table[text] = loop.create_future()
+            submit(text, future)
+        else:
+            stats["shared"] += 1
+        job.remaining += 1
+        future.add_done_callback(functools.partial(job.receive, section, index))
+        if owners_left is not None:
+            owners_left[text] -= 1
+        if owners_left is None or owners_left[text] <= 0:
+            future.add_done_callback(functools.partial(release, text))
+
+    def flush():
+        nonlocal pending_tokens
+        if pending:
+            task = loop.create_task(request(pending[:]))
+            requests.add(task)
+            task.add_done_callback(requests.discard)
+            pending.clear()
+            pending_tokens = 0
+
+    async def produce():
+        seen = set()
+        try:
+            for product in products:
+                job = ProductJob(product, loop)
+                if isinstance(product, dict):
+                    enrich_product(product, attr_lookup)
+                    if is_variant(product, seen, embedded):
+                        job.variant_of = product["near_duplicate_of"]
+                    else:
+                        if not product.get("near_duplicate_of"):
+                            seen.add(product.get("product_id"))
+                        items = collect_texts(product)
+                        stats["texts"] += len(items)
+                        cached = {}
+                        if cache is not None:
+                            cached = cache.get_many(text for *_, text in items if text not in table)
+                        for section, index, text in items:
+                            if text in cached:
+                                job.vectors[section][index] = cached[text]
+                                stats["cache_hits"] += 1
+                                if owners_left is not None:
+                                    owners_left[text] -= 1
+                            else:
+                                claim(job, section, index, text)
+                if job.remaining == 0:
+                    job.done.set_result(None)
+                put = loop.create_task(ready.put(job))
+                while not put.done():
+                    if not requests:
+                        flush()          # the oldest product may be waiting on `pending`
+                    await asyncio.wait({put, *requests}, return_when=asyncio.FIRST_COMPLETED)
+            flush()
+        finally:
+            await ready.put(None)
+
+    def drop_failed(job: ProductJob) -> None:
+        """Empty the slots whose text failed and dead-letter them."""
+        missing = [(section, index) for section in SECTIONS
+                   for index, vec in job.vectors[section].items() if vec is None]
+        if not missing:
+            return
+        texts = {(section, index): text for section, index, text in collect_texts(job.product)}
+        for section, index in missing:
+            del job.vectors[section][index]
+            stats["failed_slots"] += 1
+            if dead_letter is not None:
+                text = texts[(section, index)]
+                dead_letter.add(text, failed.get(text, "unknown"),
+                                product_id=job.product.get("product_id", ""), section=section, index=index)
+
+    def completed() -> List[ProductJob]:
+        """The finished jobs at the head of `ready`, in order (the first is awaited)."""
+        jobs = []
+        while head and head[0] is not None and head[0].done.done():
+            jobs.append(head.popleft())
+            if not head and not ready.empty():
+                head.append(ready.get_nowait())
+        return jobs
+
+    producer = loop.create_task(produce())
+    head: deque = deque()
+    try:
+        while True:
+            if not head:
+                head.append(await ready.get())
+            if head[0] is None:
+                break
+            await head[0].done
+            jobs = completed()
+            for job in jobs:
+                if job.variant_of is None and isinstance(job.product, dict):
+                    drop_failed(job)
+            own = [job for job in jobs if job.variant_of is None and isinstance(job.product, dict)]
+            assign_vectors([job.product for job in own], [job.vectors for job in own])
+            for job in jobs:
+                product = job.product
+                if job.variant_of is not None:
+                    copy_embeddings(embedded[job.variant_of], product)
+                elif isinstance(product, dict):
+                    pid = product.get("product_id", "")
+                    if representatives is None or pid in representatives:
+                        embedded[pid] = product
+                yield product
+        await producer
+    finally:
+        producer.cancel()
+        for task in [*requests, *joins]:
+            task.cancel()
 
-    for (pi, section, sub_idx, _text), vec in zip(items, all_vecs):
-        pdata[pi][section][sub_idx] = vec
 
-    for pi, product in enumerate(products):
-        if not isinstance(product, dict):
-            continue
+def process_product_batch(
+    products: List[Dict],
+    attr_lookup: Dict[str, Dict],
+    embedded: Optional[Dict[str, Dict]] = None,
+    cache: Optional[EmbeddingCache] = None,
+) -> List[Dict]:
+    """
+    Embed one list of products and return it (blocking; see embed_products):
+    1. Enrich fragrance_category and notes_combined on each product.
+    2. Collect ALL non-empty text segments (chunks + all HyDE queries + answers).
+    3. Embed them, several requests at a time.
+    4. Assign embeddings back with the SAME guard used during collection
+       (fixing the off-by-one bug).
+    5. Store averaged HyDE embedding.
+    6. Variants whose representative is in this batch or in `embedded`
+       (product_id -> already embedded product) reuse its vectors.
+    7. Only texts missing from `cache` are sent to the API, each distinct
+       text once.
+    """
+    text_counts = count_texts(products, attr_lookup, embedded)
+
+    async def run():
+        return [p async for p in embed_products(products, attr_lookup, make_engine(), embedded,
+                                                cache=cache, text_counts=text_counts)]
+    return asyncio.run(run())
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Phase 1: embedding generation")
+    parser.add_argument("--no-cache", action="store_true",
+                        help=f"embed every text, ignoring and not updating {CACHE_NAME}")
+    parser.add_argument("--batch-inputs", type=int, default=BATCH_SIZE,
+                        help="most texts per embedding request")
+    parser.add_argument("--batch-tokens", type=int, default=BATCH_TOKENS,
+                        help="most tokens per embedding request")
+    parser.add_argument("--json", action="store_true",
+                        help="also write every product with its vectors to EMBEDDINGS_OUTPUT (JSON)")
+    parser.add_argument("--resume", action="store_true",
+                        help="continue an interrupted run from its checkpoints")
+    parser.add_argument("--checkpoint-every", type=int, default=CHECKPOINT_EVERY,
+                        help="products per checkpoint part")
+    parser.add_argument("--no-quantize", action="store_true",
+                        help="skip the int8 and binary copies of the vector store")
+    parser.add_argument("--evict-cache", action="store_true",
+                        help="drop cache entries for texts the current catalog no longer has, then exit")
+    return parser.parse_args(argv)
+
+
+def evict_cache(cache: EmbeddingCache, products: List[Dict], attr_lookup: Dict[str, Dict]) -> int:
+    """Remove cache entries for texts no product in the catalog would embed."""
+    keep = set()
+    for product in products:
+        if isinstance(product, dict):
+            enrich_product(product, attr_lookup)
+            keep.update(cache.key(text) for *_, text in collect_texts(product))
+    return cache.evict(keep)
 
-        for ci, chunk in enumerate(product.get("searchable_chunks", [])):
-            content = chunk.get("content", "")
-            if content and isinstance(content, str) and content.strip():  
-                if ci in pdata[pi]["chunk"]:
-                    chunk["embedding"] = pdata[pi]["chunk"][ci]
-                    chunk.pop("embedding_placeholder", None)
 
-        hyde = product.setdefault("hyde_components", {})
+def file_sha256(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
 
-        query_vecs = [
-            pdata[pi]["hyde_query"][qi]
-            for qi in sorted(pdata[pi]["hyde_query"])
-        ]
-        answer_vecs = [
-            pdata[pi]["hyde_answer"][ai]
-            for ai in sorted(pdata[pi]["hyde_answer"])
-        ]
-
-        hyde["query_embeddings"]  = query_vecs
-        hyde["answer_embeddings"] = answer_vecs
-        hyde["hyde_query_avg"]  = average_vectors(query_vecs)
-        hyde["hyde_answer_avg"] = average_vectors(answer_vecs)
-        hyde.pop("hyde_embedding_placeholder", None)
 
-    return products
+def same_vectors(a: Dict, b: Dict) -> bool:
+    """Whether two embedded products hold equal vectors in every slot."""
+    va, vb = product_vectors(a), product_vectors(b)
+    for kind in va:
+        if len(va[kind]) != len(vb[kind]):
+            return False
+        for x, y in zip(va[kind], vb[kind]):
+            if (x is None) != (y is None) or (x is not None and not np.array_equal(x, y)):
+                return False
+    return True
 
 
-def main():
+def compact_checkpoints(checkpoints: Checkpoints, store_dir: Path, representatives: set) -> Dict:
+    """
+    Merge the checkpoint parts, in run order, into the final vector store.
+    A variant holding exactly its representative's vectors is re-linked to
+    them, so rows are shared the same way wherever the parts were cut (and
+    a resumed run ends with the same store as an uninterrupted one).
+    Returns the store summary plus chunk and variant counts.
+    """
+    writer = VectorStoreWriter(store_dir, MODEL, DIMS, shared_ids=representatives)
+    kept: Dict[str, Dict] = {}
+    embedded_chunks = variants = 0
+    try:
+        for product in checkpoints.iter_products():
+            pid = product.get("product_id", "")
+            rep = product.get("near_duplicate_of")
+            if rep in kept and same_vectors(kept[rep], product):
+                copy_embeddings(kept[rep], product)
+            if pid in representatives:
+                kept[pid] = product
+            writer.write(product)
+            embedded_chunks += sum(1 for c in product.get("searchable_chunks", [])
+                                   if c.get("embedding") is not None and c["content"].strip())
+            variants += bool(rep)
+    except BaseException:
+        writer.abort()
+        raise
+    return {**writer.close(), "embedded_chunks": embedded_chunks, "near_duplicate_variants": variants}
+
+
+def main(argv: Optional[List[str]] = None):
+    args = parse_args(argv)
     print("=" * 70)
     print("PHASE 1 FIXED: EMBEDDING GENERATION")
-    print(f"  Model: {MODEL}  |  Dims: {DIMS}")
+    print(f"  Provider: {provider.name}  |  Model: {MODEL}  |  Dims: {DIMS}")
     print("=" * 70)
 
-    from config import (
-        HIERARCHICAL_JSON      as hierarchical_path,
-        ATTRIBUTE_INDEXED_JSON as attr_indexed_path,
-        EMBEDDINGS_DIR         as output_dir,
-        EMBEDDINGS_OUTPUT      as output_path,
-    )
+    hierarchical_path = Path(HIERARCHICAL_JSON)
+    attr_indexed_path = Path(ATTRIBUTE_INDEXED_JSON)
+    output_dir        = Path(EMBEDDINGS_DIR)
+    output_path       = Path(EMBEDDINGS_OUTPUT)
     stats_path = output_dir / "embedding_statistics.json"
     output_dir.mkdir(parents=True, exist_ok=True)
 
-    if not os.getenv("OPENAI_API_KEY"):
+    if provider.name == "openai" and not os.getenv("OPENAI_API_KEY") and not args.evict_cache:
         print("OPENAI_API_KEY not set"); return
 
     print(f"\nLoading hierarchical products: {hierarchical_path}")
@@ -244,37 +727,165 @@ def main():
 
     attr_lookup = build_attribute_lookup(attr_indexed_path)
 
-    start = time.time()
-    processed = []
-    PROD_BATCH = 30
-
-    with tqdm(total=len(products), desc="Embedding products") as pbar:
-        for i in range(0, len(products), PROD_BATCH):
-            batch = products[i : i + PROD_BATCH]
-            result = process_product_batch(batch, attr_lookup)
-            processed.extend(result)
-            pbar.update(len(batch))
+    cache = None if args.no_cache else EmbeddingCache(output_dir / CACHE_NAME, MODEL, DIMS)
+    if args.evict_cache:
+        if cache is None:
+            print("--evict-cache needs the cache; drop --no-cache"); return
+        before = len(cache)
+        removed = evict_cache(cache, products, attr_lookup)
+        print(f"✓ Evicted {removed} of {before} cache entries ({len(cache)} remain)")
+        cache.close()
+        return
 
+    start = time.time()
+    engine = make_engine()
+    store_dir = output_dir / VECTOR_STORE_DIR
+    representatives = {p.get("near_duplicate_of") for p in products if isinstance(p, dict)} - {None}
+    header = {"model": MODEL, "dims": DIMS, "input": str(hierarchical_path),
+              "input_sha256": file_sha256(hierarchical_path), "products": len(products),
+              "started_at": datetime.now().isoformat()}
+    try:
+        checkpoints = Checkpoints(output_dir / CHECKPOINT_DIR, header, MODEL, DIMS,
+                                  args.checkpoint_every, representatives, resume=args.resume)
+    except ValueError as e:
+        print(f"⚠️  Cannot resume: {e}. Run without --resume to start over."); return
+
+    embedded: Dict[str, Dict] = {}
+    resumed = 0
+    if checkpoints.parts:
+        done = checkpoints.done_ids
+        for product in checkpoints.iter_products():
+            if product.get("product_id") in representatives:
+                embedded[product["product_id"]] = product
+        products = [p for p in products if not (isinstance(p, dict) and p.get("product_id") in done)]
+        resumed = len(done)
+        print(f"✓ Resuming: {resumed} products already checkpointed in {len(checkpoints.parts)} parts")
+
+    dead_letter = DeadLetter(output_dir / DEAD_LETTER_NAME, append=bool(checkpoints.parts))
+    errors: List[BaseException] = []
+    total = len(products)
+    text_counts = count_texts(products, attr_lookup, embedded)
+    dedup: Counter = Counter()
+
+    # Writing runs in a thread, so it overlaps the requests still in flight.
+    write_queue: queue.Queue = queue.Queue(maxsize=WRITE_QUEUE)
+
+    def write_products():
+        while (product := write_queue.get()) is not None:
+            if errors:
+                continue                 # keep draining so the pipeline never blocks
+            try:
+                checkpoints.write(product)
+            except BaseException as e:
+                errors.append(e)
+
+    def drain():
+        # Hand products over one at a time so each is freed once written
+        products.reverse()
+        while products:
+            yield products.pop()
+
+    async def run():
+        loop = asyncio.get_running_loop()
+        with tqdm(total=total + resumed, initial=resumed, desc="Embedding products") as pbar:
+            async for product in embed_products(drain(), attr_lookup, engine, embedded,
+                                                representatives=representatives, cache=cache,
+                                                text_counts=text_counts, stats=dedup,
+                                                dead_letter=dead_letter,
+                                                batch_size=args.batch_inputs,
+                                                batch_tokens=args.batch_tokens):
+                if errors:
+                    raise errors[0]
+                await loop.run_in_executor(None, write_queue.put, product)
+                pbar.update(1)
+
+    write_thread = threading.Thread(target=write_products, daemon=True)
+    write_thread.start()
+    try:
+        asyncio.run(run())
+    except BaseException:
+        write_queue.put(None)
+        write_thread.join()
+        dead_letter.close()
+        if errors:
+            checkpoints.abort()
+        else:
+            checkpoints.close()      # everything written so far is complete: keep it
+        print(f"\n⚠️  Interrupted with {checkpoints.count} products checkpointed; "
+              f"rerun with --resume to continue")
+        raise
+    write_queue.put(None)
+    write_thread.join()
+    dead_letter.close()
+    if errors:
+        checkpoints.abort()
+        raise errors[0]
+    checkpoints.close()
+
+    summary = compact_checkpoints(checkpoints, store_dir, representatives)
+    checkpoints.remove()
+    print(f"\n✓ Saved {store_dir} ({summary['rows']['chunk']} chunk rows, "
+          f"{summary['shared_rows']} rows shared by variants)")
+    quantization = None
+    if args.no_quantize:
+        remove_quantized(store_dir)
+    else:
+        report = quantize_store(store_dir)
+        chunk = report["kinds"]["chunk"].get("calibration", {})
+        quantization = {"report": str(store_dir / QUANT_REPORT_NAME), "bytes": report["bytes"],
+                        "compression": report["compression"]}
+        print(f"✓ Quantized copies: int8 {report['compression']['int8']}x, "
+              f"binary {report['compression']['binary']}x smaller")
+        if chunk:
+            binary = chunk["binary_pair_cosine_error"]
+            print(f"  chunk cosine error (mean / p99): int8 "
+                  f"{chunk['int8_pair_cosine_error']['mean']:.4f} / {chunk['int8_pair_cosine_error']['p99']:.4f}, "
+                  + (f"binary {binary['mean']:.4f} / {binary['p99']:.4f}" if binary else
+                     f"binary not estimated ({chunk['zero_fraction']:.0%} zeros: sparse vectors)"))
+    if args.json:
+        writer = JsonArrayWriter(output_path, encode=lambda product: json.dumps(
+            product, indent=2, ensure_ascii=False, default=np.ndarray.tolist).replace("\n", "\n  "))
+        for product in VectorStore(store_dir).iter_products(arrays=True):
+            writer.write(product)
+        writer.close()
+        print(f"✓ Saved {output_path}")
     elapsed = time.time() - start
 
-    print(f"\nSaving to {output_path}")
-    with open(output_path, "w", encoding="utf-8") as f:
-        json.dump(processed, f, indent=2, ensure_ascii=False)
-
-    total_chunks = sum(
-        1 for p in processed
-        for c in p.get("searchable_chunks", [])
-        if c.get("embedding") and c["content"].strip()
-    )
+    total_chunks = summary.pop("embedded_chunks")
+    variants = summary.pop("near_duplicate_variants")
     stats = {
-        "model": MODEL, "dims": DIMS, "products": len(processed),
-        "embedded_chunks": total_chunks, "processing_seconds": round(elapsed, 2),
+        **provider.spec(), "products": summary["products"],
+        "resumed_products": resumed,
+        "embedded_chunks": total_chunks, "near_duplicate_variants": variants,
+        "processing_seconds": round(elapsed, 2),
+        "engine": engine.report(),
+        "cache": cache.report() if cache is not None else None,
+        "vector_store": {"path": str(store_dir), **summary},
+        "quantization": quantization,
+        "texts": {
+            "needed": dedup["texts"],
+            "distinct": len(text_counts),
+            "from_cache": dedup["cache_hits"],
+            "api_inputs": engine.stats["inputs"],
+            "api_inputs_saved_by_dedup": dedup["shared"],
+            "split_over_context": dedup["split_texts"],
+        },
+        "dead_letter": {"path": str(dead_letter.path), "slots_without_vector": dedup["failed_slots"]},
         "generated_at": datetime.now().isoformat(),
     }
     with open(stats_path, "w") as f:
         json.dump(stats, f, indent=2)
-
-    print(f"Done in {elapsed:.1f}s | {len(processed)} products | {total_chunks} chunks embedded")
+    print(f"Texts: {dedup['texts']} needed, {len(text_counts)} distinct, "
+          f"{dedup['shared']} API inputs saved by dedup")
+    if cache is not None:
+        print(f"Cache: {cache.hits} hits, {cache.misses} misses")
+        cache.close()
+    if dead_letter.count:
+        print(f"⚠️  {dead_letter.count} product texts failed and have no vector; "
+              f"see {dead_letter.path} (a run without --resume retries them)")
+
+    print(f"Done in {elapsed:.1f}s | {summary['products']} products | {total_chunks} chunks embedded "
+          f"| {variants} variants reused a representative")
     print("Next: run phase2_ingest_fixed.py")
 
 
@@ -2,7 +2,8 @@
 """
 Phase 2 v2: Weaviate Ingestion — ENRICHED DATA
 ================================================
-Reads from enriched_data/products_hierarchical.json (with embeddings from Phase 1)
+Reads Phase 1's output: the vector store in EMBEDDINGS_DIR/vector_store/
+(or products_with_embeddings.json from phase1 --json)
 
 Changes from original:
   1. NEW: product_type, color, fabric, season as filterable properties
@@ -11,17 +12,28 @@ Changes from original:
   4. NEW: product_attributes stored (sizes, wear_type, fit_type)
   5. FIX: BM25 corpus exported with complete metadata
   6. FIX: notes_text vector uses actual notes_combined embedding (not detailed chunk)
+  7. NEW: streams products from Phase 1's vector store (float32 .npy rows +
+     products.jsonl) instead of json.load-ing products_with_embeddings.json;
+     the JSON file is still read when no store exists
+  8. NEW: records the embedding model and dims it ingested in
+     EMBEDDINGS_DIR/ingested_embedding.json; phase3 checks its own against it
+  9. NEW: EMBED_SEARCH_DIMS=256/512/1024 ingests Matryoshka-truncated
+     vectors (first N components, renormalised) from full-size phase1 output;
+     phase3 queries at that size and rescores at full size from the store
 """
 
 import json, os, re, time
+from itertools import islice
 from pathlib import Path
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Iterable
 from tqdm import tqdm
 import weaviate
 from weaviate.classes.config import Configure, Property, DataType
 from weaviate.util import generate_uuid5
 from dotenv import load_dotenv
 from openai import OpenAI
+from vector_store import VectorStore, VECTOR_STORE_DIR
+from embedding_providers import INGESTED_SPEC_NAME, read_spec, write_spec, truncate
 
 load_dotenv()
 openai_client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
@@ -31,10 +43,15 @@ MODEL           = "text-embedding-3-large"
 
 BASE_DIR = Path(__file__).parent
 try:
-    from config import EMBEDDINGS_OUTPUT as EMBEDDINGS_PATH, BM25_CORPUS_PATH as BM25_OUT
+    from config import (EMBEDDINGS_OUTPUT as EMBEDDINGS_PATH, BM25_CORPUS_PATH as BM25_OUT,
+                        EMBEDDINGS_DIR)
 except ImportError:
     EMBEDDINGS_PATH = BASE_DIR / "enriched_data" / "products_with_embeddings.json"
     BM25_OUT        = BASE_DIR / "enriched_data" / "bm25_corpus_enriched.json"
+    EMBEDDINGS_DIR  = BASE_DIR / "enriched_data"
+
+VECTOR_KINDS = ("chunk", "hyde_query_avg", "hyde_answer_avg")     # what prepare_object() reads
+SEARCH_DIMS  = int(os.getenv("EMBED_SEARCH_DIMS", 0)) or None       # None: ingest phase1's full size
 
 # ── Utility ──────────────────────────────────────────────────────────────────
 def parse_size_ml(size_str: str) -> float:
@@ -217,19 +234,23 @@ def prepare_object(product: Dict) -> Optional[Dict]:
         return None
 
 # ── Ingestion ─────────────────────────────────────────────────────────────────
-def ingest_all(wv_client: weaviate.WeaviateClient, products: List[Dict]) -> Dict:
+def ingest_all(wv_client: weaviate.WeaviateClient, products: Iterable[Dict], total: int,
+               search_dims: Optional[int] = None) -> Dict:
+    """Batch-insert every product; with search_dims its vectors are truncate()d to that size first."""
     stats = {"ingested": 0, "failed": 0, "vectors_per_type": {}}
     collection = wv_client.collections.get(COLLECTION_NAME)
+    products = iter(products)
 
-    with tqdm(total=len(products), desc="Ingesting products") as pbar:
-        for i in range(0, len(products), 100):
-            batch = products[i : i + 100]
+    with tqdm(total=total, desc="Ingesting products") as pbar:
+        while batch := list(islice(products, 100)):
             with collection.batch.dynamic() as wb:
                 for product in batch:
                     obj = prepare_object(product)
                     if obj is None:
                         stats["failed"] += 1
                         continue
+                    if search_dims:
+                        obj["vectors"] = {k: truncate(v, search_dims).tolist() for k, v in obj["vectors"].items()}
                     try:
                         uuid = generate_uuid5(obj["properties"]["product_id"])
                         wb.add_object(
@@ -247,7 +268,7 @@ def ingest_all(wv_client: weaviate.WeaviateClient, products: List[Dict]) -> Dict
     return stats
 
 # ── BM25 corpus export ────────────────────────────────────────────────────────
-def export_bm25_corpus(products: List[Dict], output_path: Path):
+def export_bm25_corpus(products: Iterable[Dict], output_path: Path):
     """Re-export BM25 corpus from embedded data (with all metadata intact)."""
     corpus = []
     for product in products:
@@ -320,17 +341,31 @@ def main():
     print("=" * 70)
 
     embeddings_path = EMBEDDINGS_PATH
+    store_dir = EMBEDDINGS_DIR / VECTOR_STORE_DIR
     bm25_out = BM25_OUT
 
-    print(f"Loading data from: {embeddings_path}")
-
-    if not embeddings_path.exists():
-        print(f"Embeddings file not found: {embeddings_path}")
-        print("   Run phase1_embed_fixed.py first"); return
-
-    with open(embeddings_path, "r", encoding="utf-8") as f:
-        products = json.load(f)
-    print(f"✓ {len(products)} products loaded")
+    if VectorStore.exists(store_dir):
+        print(f"Streaming data from: {store_dir}")
+        store = VectorStore(store_dir)
+        total = len(store)
+        products = store.iter_products(kinds=VECTOR_KINDS)
+        bm25_products = lambda: store.iter_products(kinds=())
+        spec = {"model": store.model, "dims": store.dims}
+        print(f"✓ {total} products, {store.model} ({store.dims} dims)")
+    else:
+        print(f"Loading data from: {embeddings_path}")
+
+        if not embeddings_path.exists():
+            print(f"Embeddings file not found: {embeddings_path}")
+            print("   Run phase1_embed_fixed.py first"); return
+
+        with open(embeddings_path, "r", encoding="utf-8") as f:
+            products = json.load(f)
+        total = len(products)
+        bm25_products = lambda: products
+        phase1_stats = read_spec(EMBEDDINGS_DIR / "embedding_statistics.json") or {}
+        spec = {k: phase1_stats[k] for k in ("model", "dims") if k in phase1_stats}
+        print(f"✓ {total} products loaded")
 
     # Connect
     wv = weaviate.connect_to_local(
@@ -343,18 +378,32 @@ def main():
 
     create_schema(wv)
 
+    if SEARCH_DIMS and "dims" in spec:
+        if SEARCH_DIMS >= spec["dims"]:
+            print(f"⚠️  EMBED_SEARCH_DIMS={SEARCH_DIMS} is not below {spec['dims']}; ingesting full vectors")
+        else:
+            spec = {"model": spec["model"], "dims": SEARCH_DIMS, "full_dims": spec["dims"]}
+            print(f"✓ Truncating vectors to {SEARCH_DIMS} of {spec['full_dims']} dims")
+    search_dims = spec["dims"] if spec.get("full_dims") else None
+
     start  = time.time()
-    stats  = ingest_all(wv, products)
+    stats  = ingest_all(wv, products, total, search_dims)
     elapsed= time.time() - start
 
     print(f"\nIngestion complete in {elapsed:.1f}s")
     print(f"   Ingested: {stats['ingested']} | Failed: {stats['failed']}")
     print(f"   Vector types: {stats['vectors_per_type']}")
+    if "model" in spec and "dims" in spec:
+        write_spec(EMBEDDINGS_DIR / INGESTED_SPEC_NAME, spec,
+                   collection=COLLECTION_NAME, products=stats["ingested"])
+        print(f"✓ Recorded {spec['model']} ({spec['dims']} dims) in {EMBEDDINGS_DIR / INGESTED_SPEC_NAME}")
+    else:
+        print("⚠️  Embedding model unknown (no phase1 statistics); phase3 cannot check its query vectors")
 
     verify(wv)
     wv.close()
 
-    export_bm25_corpus(products, bm25_out)
+    export_bm25_corpus(bm25_products(), bm25_out)
 
     print("\n" + "=" * 70)
     print("PHASE 2 COMPLETE — Next: run phase3_rag_api_v2.py")
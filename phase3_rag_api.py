@@ -11,9 +11,15 @@ New in v3.1:
           Co-ord Set, Kurti, Kameez Shalwar are boosted for clothing queries
   4. FIX: Kids gender filter is now a hard filter (no fallback leakage)
   5. NEW: Session memory — per-user conversation history (last 15 turns)
+  6. NEW: Query vectors come from embedding_providers.py (EMBED_PROVIDER);
+     startup fails if they would not match what phase2 ingested
+  7. NEW: Reduced-dimension search — when phase2 ingested truncated vectors
+     (EMBED_SEARCH_DIMS), queries are truncated to match and the candidates
+     are rescored at full size from phase1's vector store (two-stage search;
+     EMBED_TWO_STAGE=0 turns the rescoring off)
 """
 
-import os, sys, json, re, time
+import os, sys, json, re, time, hashlib
 from pathlib import Path
 from typing import List, Dict, Any, Optional, Tuple
 from collections import defaultdict, deque
@@ -33,7 +39,7 @@ try:
     BM25_AVAILABLE = True
 except ImportError:
     BM25_AVAILABLE = False
-    print("⚠️  rank_bm25 not installed — BM25 disabled. Run: pip install rank-bm25")
+    print("⚠️  rank_bm25 not installed — BM25 needs phase0's bm25_stats.npz. Run: pip install rank-bm25")
 
 load_dotenv()
 
@@ -42,12 +48,29 @@ openai_client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
 co_client     = cohere.Client(os.getenv("COHERE_API_KEY"))
 weaviate_client: Optional[weaviate.WeaviateClient] = None
 
+# ── Columnar filter columns (phase0 --columnar) ──────────────────────────────
+from columnar import load_columns, COLUMNAR_NAME, NUMPY_AVAILABLE
+if NUMPY_AVAILABLE:
+    import numpy as np
+
+# ── Precomputed BM25 statistics (phase0 bm25_stats.npz) ──────────────────────
+from bm25_stats import BM25Stats, BM25_STATS_NAME, bm25_tokens
+
 # ── BM25 state ───────────────────────────────────────────────────────────────
-bm25_index:    Optional["BM25Okapi"] = None
+bm25_index:    Optional[Any]          = None   # BM25Stats or BM25Okapi
 bm25_corpus:   List[Dict]             = []
-
-MODEL = "text-embedding-3-large"
-DIMS  = 3072
+bm25_columns:  Dict[str, Any]         = {}
+
+# ── Query embeddings (must match what phase2 ingested) ───────────────────────
+from embedding_providers import make_provider, read_spec, query_dims, truncate, INGESTED_SPEC_NAME
+from vector_store import VectorStore, VECTOR_STORE_DIR
+embedder = make_provider()
+MODEL = embedder.model
+DIMS  = embedder.dims
+SEARCH_DIMS    = DIMS                        # set at startup from what phase2 ingested
+TWO_STAGE      = os.getenv("EMBED_TWO_STAGE", "1") != "0"
+RESCORE_FACTOR = 3                           # low-dim candidates fetched per result kept
+rescore_store: Optional[VectorStore] = None  # full-size vectors for the second stage
 
 # ── Paths ─────────────────────────────────────────────────────────────────────
 BASE_DIR = Path(__file__).parent
@@ -56,6 +79,14 @@ try:
 except ImportError:
     BM25_CORPUS_PATH   = BASE_DIR / "enriched_data" / "bm25_corpus.json"
     BM25_FALLBACK_PATH = BASE_DIR / "enriched_data" / "bm25_corpus.json"
+try:
+    from config import COLUMNAR_PATH
+except ImportError:
+    COLUMNAR_PATH = BASE_DIR / "enriched_data" / COLUMNAR_NAME
+try:
+    from config import EMBEDDINGS_DIR
+except ImportError:
+    EMBEDDINGS_DIR = BASE_DIR / "enriched_data"
 
 # ── Human handoff config ─────────────────────────────────────────────────────
 SALES_PHONE    = os.getenv("SALES_PHONE", "+92-XXX-XXXXXXX")
@@ -154,7 +185,7 @@ class ChatResponse(BaseModel):
 # ── Startup / Shutdown ────────────────────────────────────────────────────────
 @app.on_event("startup")
 async def startup():
-    global weaviate_client, bm25_index, bm25_corpus
+    global weaviate_client, bm25_index, bm25_corpus, bm25_columns, SEARCH_DIMS, rescore_store
 
     weaviate_client = weaviate.connect_to_local(
         host="localhost", port=8081,
@@ -164,21 +195,42 @@ async def startup():
         raise RuntimeError("Weaviate not ready")
     print("✓ Weaviate connected")
 
+    ingested = read_spec(EMBEDDINGS_DIR / INGESTED_SPEC_NAME)
+    if ingested is None:
+        print(f"⚠️  {INGESTED_SPEC_NAME} not found — cannot check query vectors against the ingested ones")
+    elif query_dims(ingested, embedder.spec()) is None:
+        raise RuntimeError(
+            f"Weaviate holds {ingested['model']} ({ingested['dims']} dims) vectors but queries would be "
+            f"embedded with {MODEL} ({DIMS} dims); set EMBED_PROVIDER / EMBED_MODEL / EMBED_DIMS to match")
+    else:
+        SEARCH_DIMS = query_dims(ingested, embedder.spec())
+        print(f"✓ Query embeddings: {embedder.name} {MODEL} ({DIMS} dims, searching at {SEARCH_DIMS})")
+    if SEARCH_DIMS < DIMS and TWO_STAGE:
+        store_dir = EMBEDDINGS_DIR / VECTOR_STORE_DIR
+        store = VectorStore(store_dir) if VectorStore.exists(store_dir) else None
+        if store is not None and store.model == MODEL and store.dims == DIMS:
+            rescore_store = store
+            print(f"✓ Two-stage search: {SEARCH_DIMS}-dim candidates rescored at {DIMS} dims")
+        else:
+            print(f"⚠️  No {DIMS}-dim vector store at {store_dir} — searching at {SEARCH_DIMS} dims only")
+
     bm25_path = BM25_CORPUS_PATH
     if not bm25_path.exists():
         bm25_path = BM25_FALLBACK_PATH
 
-    if bm25_path.exists() and BM25_AVAILABLE:
-        with open(bm25_path, "r", encoding="utf-8") as f:
-            bm25_corpus = json.load(f)
-        tokenized = []
-        for doc in bm25_corpus:
-            tokens = doc["text"].lower().split()
-            tokens += [k.lower() for k in doc.get("keywords", [])]
-            tokenized.append(tokens)
-        bm25_index = BM25Okapi(tokenized)
-        print(f"✓ BM25 index built: {len(bm25_corpus)} documents")
+    if bm25_path.exists():
+        raw = bm25_path.read_bytes()
+        bm25_corpus = json.loads(raw)
+        bm25_index = load_bm25_stats(bm25_path, hashlib.sha256(raw).hexdigest())
+        if bm25_index is not None:
+            print(f"✓ BM25 statistics loaded: {len(bm25_corpus)} documents")
+        elif BM25_AVAILABLE:
+            bm25_index = BM25Okapi([bm25_tokens(doc) for doc in bm25_corpus])
+            print(f"✓ BM25 index built: {len(bm25_corpus)} documents")
+    if bm25_index is not None:
+        bm25_columns = load_bm25_filter_columns(bm25_corpus)
     else:
+        bm25_corpus = []
         print("⚠️  BM25 disabled")
 
 @app.on_event("shutdown")
@@ -187,11 +239,27 @@ async def shutdown():
         weaviate_client.close()
 
 # ── Embedding ─────────────────────────────────────────────────────────────────
-def get_query_embedding(text: str) -> List[float]:
-    resp = openai_client.embeddings.create(
-        model=MODEL, input=text, encoding_format="float"
-    )
-    return resp.data[0].embedding
+def get_query_embedding(text: str) -> "np.ndarray":
+    """Full-size float32 query vector; search_vector() cuts it to what Weaviate holds."""
+    return embedder.embed([text])[0]
+
+def search_vector(query_full: "np.ndarray") -> List[float]:
+    if SEARCH_DIMS < DIMS:
+        return truncate(query_full, SEARCH_DIMS).tolist()
+    return query_full.tolist()
+
+def search_vectors(query_full: "np.ndarray", query_str: str, wv_filter: Optional[Any],
+                   alpha: float, limit: int = 30) -> List[Dict]:
+    """
+    vector_search() at SEARCH_DIMS; two-stage when enabled: RESCORE_FACTOR x
+    candidates, their vector term rescored at full size and blended with the
+    hybrid score at the same alpha, so keyword/SKU matches keep their weight.
+    """
+    if rescore_store is None:
+        return vector_search(search_vector(query_full), query_str, wv_filter, alpha, limit=limit)
+    candidates = vector_search(search_vector(query_full), query_str, wv_filter, alpha,
+                               limit=limit * RESCORE_FACTOR)
+    return rescore_store.rescore(candidates, query_full, limit, alpha=alpha)
 
 # ── Query contextualization (Handles multi-turn, TYPOS, and Language Detection) 
 def contextualize_query(messages: List[Dict], session_history: List[Dict]) -> Dict[str, str]:
@@ -468,6 +536,58 @@ def enrich_query(query: str, filters: Dict) -> str:
     return query + " | " + " | ".join(additions)
 
 # ── BM25 retrieval ────────────────────────────────────────────────────────────
+BM25_FILTER_COLUMNS = ["product_id", "gender", "product_type", "category_l1",
+                       "color", "fabric", "price", "in_stock"]
+
+
+def load_bm25_stats(corpus_path: Path, corpus_sha256: str) -> Optional[BM25Stats]:
+    """phase0's precomputed statistics for exactly this corpus, or None (index is rebuilt)."""
+    stats_path = corpus_path.with_name(BM25_STATS_NAME)
+    if not (NUMPY_AVAILABLE and stats_path.exists()):
+        return None
+    stats = BM25Stats.load(stats_path, corpus_sha256)
+    if stats is None:
+        print(f"⚠️  {stats_path.name} was built from a different {corpus_path.name} — rebuilding")
+    return stats
+
+
+def load_bm25_filter_columns(corpus: List[Dict]) -> Dict[str, Any]:
+    """Filter columns from products_columnar.npz, if present and row-aligned with the corpus."""
+    if not (NUMPY_AVAILABLE and COLUMNAR_PATH.exists()):
+        return {}
+    columns = load_columns(COLUMNAR_PATH, BM25_FILTER_COLUMNS, decode=False)
+    if columns["product_id"].tolist() != [doc["doc_id"] for doc in corpus]:
+        print(f"⚠️  {COLUMNAR_PATH.name} does not match the BM25 corpus — filtering per document")
+        return {}
+    print(f"✓ BM25 filter columns loaded: {COLUMNAR_PATH.name}")
+    return columns
+
+
+def bm25_filter_mask(filters: Dict) -> "np.ndarray":
+    """bm25_search() filters evaluated over whole columns at once."""
+    cols = bm25_columns
+    mask = np.ones(len(cols["price"]), dtype=bool)
+
+    for key, column in (("gender", "gender"), ("product_type", "product_type"),
+                        ("category_l1", "category_l1")):
+        if filters.get(key):
+            categories = cols[f"{column}__categories"].tolist()
+            code = categories.index(filters[key]) if filters[key] in categories else -1
+            mask &= cols[column] == code
+    if filters.get("max_price") is not None:
+        mask &= cols["price"] <= filters["max_price"]
+    if filters.get("min_price") is not None:
+        mask &= cols["price"] >= filters["min_price"]
+    if filters.get("in_stock_only"):
+        mask &= cols["in_stock"]
+    for key in ("color", "fabric"):
+        if filters.get(key):
+            wanted = filters[key].lower()
+            codes = [i for i, v in enumerate(cols[f"{key}__categories"].tolist()) if wanted in v.lower()]
+            mask &= np.isin(cols[key], codes)
+    return mask
+
+
 def bm25_search(query: str, filters: Dict, top_k: int = 40) -> List[Tuple[str, float]]:
     if bm25_index is None or not bm25_corpus:
         return []
@@ -475,6 +595,12 @@ def bm25_search(query: str, filters: Dict, top_k: int = 40) -> List[Tuple[str, f
     tokens = query.lower().split()
     scores = bm25_index.get_scores(tokens)
 
+    if bm25_columns:
+        keep = np.flatnonzero((scores > 0) & bm25_filter_mask(filters))
+        results = [(bm25_corpus[i]["doc_id"], float(scores[i])) for i in keep]
+        results.sort(key=lambda x: x[1], reverse=True)
+        return results[:top_k]
+
     results = []
     for i, score in enumerate(scores):
         if score <= 0:
@@ -638,15 +764,15 @@ def retrieve_and_rerank(
     bm25_ids = bm25_search(query, filters, top_k=40)
     print(f"   BM25 hits: {len(bm25_ids)}")
 
-    query_vec = get_query_embedding(rich_query)
-    vec_props = vector_search(query_vec, rich_query, wv_filter, alpha, limit=30)
+    query_full = get_query_embedding(rich_query)
+    vec_props  = search_vectors(query_full, rich_query, wv_filter, alpha, limit=30)
 
     # ── FIX 2: Kids gender never falls back ──────────────────────────────
     strategy = "hybrid_filtered"
     if len(vec_props) < 3 and wv_filter is not None:
         if should_allow_gender_fallback(filters):
             print("   ⚠️  Too few results — retrying without filter")
-            vec_props = vector_search(query_vec, rich_query, None, alpha, limit=30)
+            vec_props = search_vectors(query_full, rich_query, None, alpha, limit=30)
             strategy  = "hybrid_unfiltered_fallback"
         else:
             print("   ℹ️  Kids gender hard filter — no fallback")
@@ -975,8 +1101,11 @@ async def health():
         "weaviate":        wv_ok,
         "bm25":            bm25_ok,
         "bm25_docs":       len(bm25_corpus),
+        "embed_provider":  embedder.name,
         "embed_model":     MODEL,
         "embed_dims":      DIMS,
+        "search_dims":     SEARCH_DIMS,
+        "two_stage":       rescore_store is not None,
         "active_sessions": len(session_store),
         "sales_phone":     SALES_PHONE,
     }
@@ -1009,7 +1138,7 @@ async def get_filters():
 if __name__ == "__main__":
     import uvicorn
     print("🚀 Starting J. RAG WhatsApp API v3.1")
-    print(f"   Embedding model  : {MODEL} ({DIMS} dims)")
+    print(f"   Embedding model  : {embedder.name} {MODEL} ({DIMS} dims)")
     print(f"   BM25 available   : {BM25_AVAILABLE}")
     print(f"   Sales phone      : {SALES_PHONE}")
     print(f"   Max session turns: {MAX_HISTORY}")
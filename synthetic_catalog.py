@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+"""
+Synthetic J. catalog generator
+==============================
+Produces raw product records shaped like scraper/scrape.py output
+(j_products_detailed.json) so the preprocessing pipeline can be tested and
+benchmarked at any catalog size. Generation is seeded and deterministic, and
+write_catalog() streams records to disk, so a 1M-product file never sits in
+memory.
+
+A real scrape also lists colourways of one design as separate SKUs and
+repeats a SKU under every featured collection it appears in; the colourways
+and relists rates reproduce both (the CLI defaults to COLOURWAY_RATE and
+RELIST_RATE; iter_catalog()/make_catalog() default to neither).
+
+Usage:
+    python synthetic_catalog.py --products 10000 --out synthetic_products.json
+    python synthetic_catalog.py --products 1000000 --indent 0 --out big.json
+"""
+
+import json, random, argparse
+from collections import deque
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional
+
+SITE = "https://www.junaidjamshed.com/"
+
+# (category path, candidate Product Category attributes, name stems)
+CATEGORIES = [
+    ("mens/kameez-shalwar.html", ["Casual Kameez Shalwar", "Formal Kameez Shalwar"], ["KAMEEZ SHALWAR"]),
+    ("mens/kurta.html", ["Casual Kurta", "Semi-Formal Kurta", "Kurta Trousers"], ["KURTA"]),
+    ("mens/waistcoat.html", ["Waistcoat"], ["WAISTCOAT"]),
+    ("mens/unstitched.html", ["Unstitched Kameez Shalwar Fabric"], ["UNSTITCHED FABRIC"]),
+    ("womens/unstitched.html", ["Unstitched 3 Piece", "Unstitched 1 Piece"], ["UNSTITCHED 3 PIECE"]),
+    ("womens/stitched.html", ["3 Piece Stitched", "Shirt and Trouser"], ["STITCHED SUIT"]),
+    ("womens/kurti.html", ["Trendy Shirt", "Tops"], ["KURTI", "TOP"]),
+    ("boys-girls/boys.html", ["Boys Kameez Shalwar"], ["BOYS KAMEEZ SHALWAR"]),
+    ("boys-girls/girls.html", ["Girls 3 Piece", "Girls Kurti"], ["GIRLS KURTI"]),
+    ("infant/infant-girls.html", ["Infant Girl"], ["FROCK"]),
+    ("mens/foot-wear.html", ["Men Peshawari Chappal", "Men Footwear"], ["PESHAWARI CHAPPAL", "SANDAL"]),
+    ("womens/foot-wear.html", ["Women Footwear"], ["SANDAL", "SLIDES"]),
+    ("fragrances/for-men/perfume.html", [""], ["EAU DE PARFUM", "POUR HOMME"]),
+    ("fragrances/for-women/perfume.html", [""], ["EAU DE PARFUM", "POUR FEMME"]),
+    ("fragrances/for-men/body-spray.html", [""], ["BODY SPRAY"]),
+    ("fragrances/for-women/body-mist.html", [""], ["BODY MIST"]),
+    ("fragrances/bakhoor.html", [""], ["BAKHOOR"]),
+    ("makeup/lip.html", ["Lips"], ["LIPSTICK"]),
+    ("makeup/eyes.html", ["Eyes"], ["EYESHADOW"]),
+    ("skin-care/face.html", [""], ["FACE SERUM", "HAND CREAM"]),
+    ("womens/accessories.html", ["Bangles", "Earrings", "Ladies Bags"], ["BANGLES", "EARRINGS", "TOTE BAG"]),
+    ("featured-collection/eid.html", ["Ladies Dupatta", "Casual Kameez Shalwar"], ["DUPATTA", "KAMEEZ SHALWAR"]),
+]
+
+COLORS  = ["Black", "White", "Navy Blue", "Maroon", "Off White", "Beige", "Olive Green", "Sky Blue", "Mustard"]
+FABRICS = ["Cotton", "Wash & Wear", "Lawn", "Khaddar", "Chiffon", "Linen", "Karandi", "Silk"]
+SEASONS = ["Summer", "Winter", "Eid", "(missing)"]
+NOTES   = ["Bergamot", "Lemon", "Rose", "Jasmine", "Oud", "Amber", "Musk", "Vanilla",
+           "Sandalwood", "Patchouli", "Lavender", "Cardamom", "Saffron", "Vetiver"]
+ACCORDS = ["Woody", "Floral", "Fresh", "Oriental", "Fruity", "Musky", "Citrus", "Spicy"]
+SIZES   = ["S", "M", "L", "XL", "XXL"]
+RELIST_PATHS = ["featured-collection/eid.html", "featured-collection/new-arrivals.html",
+                "featured-collection/sale.html"]
+
+COLOURWAY_RATE = 0.25    # share of apparel designs that come in 2-4 colours
+RELIST_RATE    = 0.05    # share of records listed again under a featured collection
+
+DISCLAIMER = ("(!) Fragrances and perfumes are non-returnable and non-exchangeable "
+              "as per company policy.")
+
+
+def _fragrance_description(rng: random.Random) -> str:
+    top, heart, base = (", ".join(rng.sample(NOTES, rng.randint(1, 3))) for _ in range(3))
+    accords = ", ".join(rng.sample(ACCORDS, 2))
+    size = rng.choice([30, 50, 100, 150])
+    parts = [
+        f"Category: {rng.choice(ACCORDS)}",
+        f"Main Accords {accords}",
+        f"Top Notes: {top}",
+        f"Heart Notes: {heart}",
+        rng.choice([f"Base Notes: {base}", f"Dry Down: {base}"]),
+        f"Size: {size}ml Bottle",
+    ]
+    if rng.random() < 0.5:
+        parts.append(DISCLAIMER)
+    return " ".join(parts)
+
+
+def _apparel_description(rng: random.Random, fabric: str, color: str) -> str:
+    if rng.random() < 0.1:
+        return "N/A"
+    return (f"{color} {fabric.lower()} outfit with embroidered neckline and "
+            f"straight hem. Comfortable fit for everyday wear.")
+
+
+def make_product(i: int, rng: random.Random) -> Dict:
+    path, categories, stems = rng.choice(CATEGORIES)
+    pc = rng.choice(categories)
+    color, fabric = rng.choice(COLORS), rng.choice(FABRICS)
+    is_fragrance = path.startswith("fragrances/")
+
+    attributes = {}
+    if pc:
+        attributes["Product Category"] = pc
+    if not is_fragrance:
+        attributes["Color"] = color
+        attributes["Fabric"] = fabric
+        attributes["Season"] = rng.choice(SEASONS)
+        if rng.random() < 0.5:
+            attributes["Wear Type"] = rng.choice(["Casual", "Semi-Formal", "Formal"])
+    price = rng.choice([890, 1490, 2990, 4590, 6990, 8990, 11990, 15990])
+    sku = f"J{i:07d}"
+    name = f"{rng.choice(stems)} {rng.choice(['CLASSIC', 'SIGNATURE', 'ESSENTIAL', 'LUXE'])} {i}"
+    has_image = rng.random() < 0.9
+
+    return {
+        "name": name,
+        "price": f"PKR {price:,.2f}",
+        "product_link": f"{SITE}{sku.lower()}.html",
+        "image_url_online": f"{SITE}media/{sku}.jpg",
+        "image_local_path": f"images/{name.replace(' ', '_')}.jpg" if has_image else None,
+        "category_source": SITE + path,
+        "sku": sku,
+        "article_code": f"JJ-{i:06d}",
+        "stock_status": rng.choice(["IN STOCK", "IN STOCK", "OUT OF STOCK"]),
+        "description_text": (_fragrance_description(rng) if is_fragrance
+                             else _apparel_description(rng, fabric, color)),
+        "sizes": [] if is_fragrance else rng.sample(SIZES, rng.randint(1, 4)),
+        "attributes": attributes,
+        "scraped_at": "2025-01-01T00:00:00",
+    }
+
+
+def _colourway(product: Dict, k: int, rng: random.Random) -> Dict:
+    """Variant k of an apparel product in another colour: same design text, own SKU."""
+    old = product["attributes"]["Color"]
+    color = rng.choice([c for c in COLORS if c != old])
+    sku = f"{product['sku']}-{k}"
+    return dict(
+        product,
+        sku=sku,
+        product_link=f"{SITE}{sku.lower()}.html",
+        image_url_online=f"{SITE}media/{sku}.jpg",
+        image_local_path=product["image_local_path"] and product["image_local_path"].replace(".jpg", f"_{k}.jpg"),
+        stock_status=rng.choice(["IN STOCK", "IN STOCK", "OUT OF STOCK"]),
+        description_text=product["description_text"].replace(old, color),
+        attributes=dict(product["attributes"], Color=color),
+    )
+
+
+def _relisted(product: Dict, rng: random.Random) -> Dict:
+    """The same SKU scraped again from a featured-collection page."""
+    return dict(product, category_source=SITE + rng.choice(RELIST_PATHS))
+
+
+# Header spellings, separators and near-misses for fragrance parser edge cases
+FRAGRANCE_FRAGMENTS = [
+    "Top Note", "Top Notes:", "top notes :", "TOP NOTE:", "Heart Notes:", "heart note:",
+    "Base Notes:", "Base Note", "base notes", "Dry Down", "dry down:", "Dry Down Base Notes:",
+    "Main Accords", "main accord", "Main AccorDry Down", "Category:", "category :",
+    "Size:", "Size: 50ml", "size:100 ML", "Size: 12.5 ml Bottle", "Bottle", "bottle",
+    "Rose", "Oud, Amber", "Musk.", ",", ".", " ", "  ", "\n", "\t", "\n\n", "ml", "50",
+    "s:", ":", "Notes", "Accords", "Woody", "Dry", "Down", "ſize: 5ml", "Maın Accords",
+    "Top Notes: Çitron", "İris", "\u212aewra", DISCLAIMER,
+]
+
+
+def iter_fragrance_edge_cases(n: int, seed: int = 7) -> Iterator[str]:
+    """Random fragrance descriptions stitched from FRAGRANCE_FRAGMENTS."""
+    rng = random.Random(seed)
+    for _ in range(n):
+        parts = [rng.choice(FRAGRANCE_FRAGMENTS) for _ in range(rng.randint(0, 14))]
+        yield rng.choice([" ", "", "\n"]).join(parts) + rng.choice(["", "", "\n", " ", "\n\n"])
+
+
+def iter_catalog(n: int, seed: int = 7, colourways: float = 0.0, relists: float = 0.0) -> Iterator[Dict]:
+    """
+    n raw records. colourways: share of apparel designs followed by 1-3
+    colour variants; relists: chance that a record is followed by a repeat
+    of a recently scraped SKU under a featured-collection URL. Both draw from
+    their own generator, so at 0 the catalog is the same as without them.
+    """
+    rng = random.Random(seed)
+    extra = random.Random(seed + 1)
+    recent = deque(maxlen=1000)
+    count = i = 0
+    while count < n:
+        product = make_product(i, rng)
+        i += 1
+        batch = [product]
+        if colourways and "Color" in product["attributes"] and extra.random() < colourways:
+            batch += [_colourway(product, k, extra) for k in range(1, extra.randint(1, 3) + 1)]
+        for record in batch:
+            if count == n:
+                return
+            yield record
+            count += 1
+            recent.append(record)
+            if relists and count < n and extra.random() < relists:
+                yield _relisted(extra.choice(recent), extra)
+                count += 1
+
+
+def make_catalog(n: int, seed: int = 7, colourways: float = 0.0, relists: float = 0.0) -> List[Dict]:
+    return list(iter_catalog(n, seed, colourways, relists))
+
+
+def write_catalog(path: Path, records: Iterable[Dict], indent: Optional[int] = 4) -> int:
+    """
+    Stream records to a JSON array file, byte-identical to
+    json.dump(list(records), f, indent=indent, ensure_ascii=False).
+    Returns the number of records written.
+    """
+    count = 0
+    with open(path, "w", encoding="utf-8") as f:
+        if indent is None:
+            sep, first, end = ", ", "[", "]"
+        else:
+            pad = " " * indent
+            sep, first, end = ",\n" + pad, "[\n" + pad, "\n]"
+        for record in records:
+            text = json.dumps(record, indent=indent, ensure_ascii=False)
+            f.write(sep if count else first)
+            f.write(text if indent is None else text.replace("\n", "\n" + pad))
+            count += 1
+        f.write(end if count else "[]")
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic raw J. catalog")
+    parser.add_argument("--products", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--colourways", type=float, default=COLOURWAY_RATE,
+                        help="share of apparel designs with colour variants (default: %(default)s)")
+    parser.add_argument("--relists", type=float, default=RELIST_RATE,
+                        help="share of records repeated under a featured collection (default: %(default)s)")
+    parser.add_argument("--indent", type=int, default=4,
+                        help="JSON indent; 0 writes one compact line (default: %(default)s)")
+    parser.add_argument("--out", type=Path, default=Path("synthetic_products.json"))
+    args = parser.parse_args()
+
+    records = iter_catalog(args.products, args.seed, args.colourways, args.relists)
+    count = write_catalog(args.out, records, args.indent or None)
+    print(f"✓ Wrote {count} synthetic products → {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,455 @@
+"""
+Tests for the phase 0 preprocessing pipeline.
+"""
+
+import sys, json, subprocess
+from pathlib import Path
+
+import pytest
+
+import phase0_preprocessing_pipeline as phase0
+from synthetic_catalog import make_catalog, iter_fragrance_edge_cases
+from bench_phase0 import legacy_parse_fragrance_notes
+
+BASE_DIR = Path(__file__).parent
+OUTPUT_FILES = ["products_hierarchical.json", "bm25_corpus.json",
+                "products_attribute_indexed.json", "image_registry.json",
+                "products_flat.csv"]
+
+
+@pytest.fixture
+def raw_catalog(tmp_path):
+    path = tmp_path / "raw.json"
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(make_catalog(1200), f, ensure_ascii=False)
+    return path
+
+
+def run_pipeline(raw_path, out_dir, *extra):
+    phase0.main(["--input", str(raw_path), "--output-dir", str(out_dir), *extra])
+    return {name: (out_dir / name).read_bytes() for name in OUTPUT_FILES}
+
+
+def test_workers_output_is_byte_identical_to_serial(raw_catalog, tmp_path):
+    serial = run_pipeline(raw_catalog, tmp_path / "serial")
+    parallel = run_pipeline(raw_catalog, tmp_path / "parallel",
+                            "--workers", "3", "--chunk-size", "37")
+    for name in OUTPUT_FILES:
+        assert serial[name] == parallel[name], name
+
+
+def test_chunk_stats_merge_to_serial_totals(raw_catalog):
+    with open(raw_catalog, encoding="utf-8") as f:
+        raws = json.load(f)
+    _, whole = phase0.process_chunk(raws)
+    merged = phase0.new_stats()
+    for _, chunk_stats in phase0.run_chunks(raws, workers=1, chunk_size=100):
+        phase0.merge_stats(merged, chunk_stats)
+    assert merged == whole
+    assert merged["total"] == len(raws)
+
+
+@pytest.mark.parametrize("buffer_chars", [1, 7, 64, 1 << 16])
+def test_iter_json_array_matches_json_load(tmp_path, buffer_chars):
+    items = make_catalog(40) + [{}, [], "a,]\"b", 12345, -1.5e3, None, True, {"k": "ünï"}]
+    path = tmp_path / "items.json"
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(items, f, indent=4, ensure_ascii=False)
+    assert list(phase0.iter_json_array(path, buffer_chars)) == items
+
+
+@pytest.mark.parametrize("text", ["[]", " [ ] ", "[\n]"])
+def test_iter_json_array_empty(tmp_path, text):
+    path = tmp_path / "empty.json"
+    path.write_text(text, encoding="utf-8")
+    assert list(phase0.iter_json_array(path, 2)) == []
+
+
+@pytest.mark.parametrize("text", ["{}", "[1, 2", "[1 2]", "[{\"a\": 1}"])
+def test_iter_json_array_rejects_malformed(tmp_path, text):
+    path = tmp_path / "bad.json"
+    path.write_text(text, encoding="utf-8")
+    with pytest.raises(ValueError):
+        list(phase0.iter_json_array(path, 3))
+
+
+@pytest.mark.parametrize("items", [[], [{"a": [1, {"b": "x\ny"}]}, 2, "三"]])
+def test_json_array_writer_matches_json_dump(tmp_path, items):
+    path = tmp_path / "out.json"
+    writer = phase0.JsonArrayWriter(path)
+    for item in items:
+        writer.write(item)
+    writer.close()
+    assert path.read_text(encoding="utf-8") == json.dumps(items, indent=2, ensure_ascii=False)
+
+
+def test_incremental_run_only_reprocesses_changed_records(tmp_path, monkeypatch):
+    raws = make_catalog(300)
+    raw_path = tmp_path / "raw.json"
+    out_dir = tmp_path / "out"
+    raw_path.write_text(json.dumps(raws), encoding="utf-8")
+    run_pipeline(raw_path, out_dir)
+
+    raws[3]["price"] = "PKR 1,234.00"
+    raws[10]["stock_status"] = "OUT OF STOCK"
+    removed = raws.pop(20)
+    added = dict(raws[0], sku="J_NEW_1", name="NEW KURTA")
+    raws.append(added)
+    raw_path.write_text(json.dumps(raws), encoding="utf-8")
+
+    calls = []
+    original = phase0.process_product
+    monkeypatch.setattr(phase0, "process_product", lambda raw: calls.append(raw["sku"]) or original(raw))
+    incremental = run_pipeline(raw_path, out_dir)
+    monkeypatch.undo()
+
+    assert sorted(calls) == sorted([raws[3]["sku"], raws[10]["sku"], "J_NEW_1"])
+    changes = json.loads((out_dir / phase0.CHANGES_NAME).read_text(encoding="utf-8"))
+    assert changes["full_rebuild"] is False
+    assert sorted(changes["changed"]) == sorted(
+        phase0.make_product_id(s) for s in (raws[3]["sku"], raws[10]["sku"], "J_NEW_1"))
+    assert changes["removed"] == [phase0.make_product_id(removed["sku"])]
+    assert changes["unchanged_count"] == len(raws) - 3
+
+    full = run_pipeline(raw_path, tmp_path / "full", "--full")
+    for name in OUTPUT_FILES:
+        assert incremental[name] == full[name], name
+
+
+def test_incremental_state_streams_prior_products(tmp_path):
+    raws = make_catalog(200)
+    raw_path = tmp_path / "raw.json"
+    out_dir = tmp_path / "out"
+    raw_path.write_text(json.dumps(raws), encoding="utf-8")
+    run_pipeline(raw_path, out_dir)
+    sku_sources = phase0.scan_duplicates(phase0.iter_json_array(raw_path))[0]
+
+    def lookups(records):
+        state, full_rebuild = phase0.load_incremental_state(records, out_dir)
+        assert full_rebuild is False
+        reusable = len(state.reusable)
+        reused = [state.lookup(raw) for raw in records]
+        assert all(p is not None for p in reused) and state.reused == reusable
+        assert [p.sku for p in reused] == [raw["sku"] for raw in records]
+        assert state._ahead == {} and not state.reusable
+        return state
+
+    merged = list(phase0.merge_sku_duplicates(iter(raws), sku_sources))
+    # same order as the previous run: each prior product is handed over as it is read
+    assert lookups(merged).max_ahead == 0
+    # reversed: everything is read ahead once, then released as it is claimed
+    assert lookups(merged[::-1]).max_ahead == len(merged) - 1
+
+
+def test_incremental_reuse_with_duplicate_skus(tmp_path):
+    raws = make_catalog(50)
+    dup = dict(raws[5], category_source="https://www.junaidjamshed.com/featured-collection/eid.html")
+    raws.insert(30, dup)
+    raw_path = tmp_path / "raw.json"
+    raw_path.write_text(json.dumps(raws), encoding="utf-8")
+    out_dir = tmp_path / "out"
+    first = run_pipeline(raw_path, out_dir, "--no-dedup")
+    second = run_pipeline(raw_path, out_dir, "--no-dedup")
+    assert first == second
+    changes = json.loads((out_dir / phase0.CHANGES_NAME).read_text(encoding="utf-8"))
+    # the first of the two records sharing a SKU is not the one the manifest remembers
+    assert changes["changed"] == [phase0.make_product_id(raws[5]["sku"])]
+
+
+def test_duplicate_skus_merge_into_one_product(tmp_path):
+    raws = make_catalog(50)
+    eid = "https://www.junaidjamshed.com/featured-collection/eid.html"
+    raws.insert(30, dict(raws[5], category_source=eid))
+    raws.insert(40, dict(raws[5], stock_status="OUT OF STOCK"))
+    raw_path = tmp_path / "raw.json"
+    raw_path.write_text(json.dumps(raws), encoding="utf-8")
+    out_dir = tmp_path / "out"
+    first = run_pipeline(raw_path, out_dir)
+
+    products = json.loads(first["products_hierarchical.json"])
+    assert len(products) == 50
+    merged = [p for p in products if p["product_core"]["sku"] == raws[5]["sku"]]
+    assert len(merged) == 1
+    assert merged[0]["category_sources"] == [raws[5]["category_source"], eid]
+    assert merged[0]["product_core"]["stock_status"] == raws[5]["stock_status"]
+
+    assert run_pipeline(raw_path, out_dir) == first
+    changes = json.loads((out_dir / phase0.CHANGES_NAME).read_text(encoding="utf-8"))
+    assert changes["changed"] == [] and changes["unchanged_count"] == 50
+
+
+def test_colourways_point_to_their_representative(tmp_path):
+    pytest.importorskip("numpy")
+    raws = make_catalog(400)
+    base = next(r for r in raws if r["attributes"].get("Color") == "Black"
+                and r["description_text"] != "N/A")
+
+    def colourway(sku, color):
+        return dict(base, sku=sku, product_link=f"{sku}.html", stock_status="OUT OF STOCK",
+                    attributes=dict(base["attributes"], Color=color),
+                    description_text=base["description_text"].replace("Black", color))
+
+    raws += [colourway("J_VAR_1", "Navy Blue"), colourway("J_VAR_2", "Off White"),
+             dict(base, sku="J_OTHER", name=base["name"] + " PRINTED"),
+             dict(base, sku="J_SAME_NAME", description_text="Digital print on a relaxed "
+                  "silhouette with lace trims, tassels and a flared hem.")]
+    raw_path = tmp_path / "raw.json"
+    raw_path.write_text(json.dumps(raws), encoding="utf-8")
+    out_dir = tmp_path / "out"
+    run_pipeline(raw_path, out_dir)
+
+    products = {p["product_id"]: p for p in
+                json.loads((out_dir / "products_hierarchical.json").read_text(encoding="utf-8"))}
+    rep = phase0.make_product_id(base["sku"])
+    marked = {pid: p["near_duplicate_of"] for pid, p in products.items() if p["near_duplicate_of"]}
+    assert marked == {"prod_J_VAR_1": rep, "prod_J_VAR_2": rep}
+    assert products["prod_J_VAR_2"]["product_attributes"]["color"] == "Off White"
+
+    report = json.loads((out_dir / phase0.NEAR_DUPS_NAME).read_text(encoding="utf-8"))
+    assert report["clusters"] == {rep: ["prod_J_VAR_1", "prod_J_VAR_2"]}
+
+    run_pipeline(raw_path, out_dir, "--near-dup-threshold", "0")
+    assert not (out_dir / phase0.NEAR_DUPS_NAME).exists()
+
+
+def test_product_record_matches_the_hierarchical_schema():
+    raws = make_catalog(300)
+    raws.append(dict(raws[0], sku="J_ODD", name='Kurta “Ñoor” \u2028 "quoted"\ttab',
+                     sizes=[], image_local_path=None, description_text=""))
+    records = [phase0.process_product(raw) for raw in raws]
+    for record in records:
+        text = record.to_json()
+        assert text == json.dumps(record.to_dict(), indent=2, ensure_ascii=False)
+        assert record.to_json("  ") == text.replace("\n", "\n  ")
+        assert phase0.ProductRecord.from_dict(json.loads(text)) == record
+
+    shared = {}
+    for r in records:
+        assert shared.setdefault(r.category_sources, r.category_sources) is r.category_sources
+        assert shared.setdefault(r.color, r.color) is r.color
+    assert len(shared) < len(records)
+
+
+def test_projections_build_only_their_own_output(monkeypatch):
+    raws = make_catalog(40)
+    raws.append(dict(raws[0], sku="J_NO_IMAGE", image_local_path=None))
+    builders = [phase0.build_bm25_entry, phase0.build_attr_indexed_entry,
+                phase0.build_image_registry_entry, phase0.product_to_csv_row]
+    for raw in raws:
+        record = phase0.process_product(raw)
+        projections = phase0.project_product(record)
+        hierarchical = json.loads(record.to_json())
+        for build, expected in zip(builders, projections):
+            assert build(record) == expected
+            assert build(hierarchical) == expected          # products_hierarchical.json dicts still work
+    assert projections[2] is None
+
+    monkeypatch.setattr(phase0, "project_product", None)
+    assert phase0.build_bm25_entry(record)["doc_id"] == record.product_id
+
+
+def test_classification_matches_golden_labels():
+    golden = json.loads((BASE_DIR / "testdata" / "phase0_golden_labels.json").read_text(encoding="utf-8"))
+    mismatches = []
+    for u, p, n, d, gender, ptype in golden["cases"]:
+        raw = {"category_source": golden["urls"][u], "name": golden["names"][n],
+               "description_text": golden["descriptions"][d],
+               "attributes": {"Product Category": golden["product_categories"][p]}}
+        expected = (golden["genders"][gender], golden["product_types"][ptype])
+        got = (phase0.extract_gender(raw), phase0.classify_product_type(raw))
+        if got != expected:
+            mismatches.append((raw, expected, got))
+    assert not mismatches, mismatches[:5]
+
+
+def test_keyword_rules_precedence_and_anchors():
+    rules = phase0.KeywordRules([
+        ("exact",  [[("a", "=kurta")]]),
+        ("prefix", [[("a", "^kurta")]]),
+        ("both",   [[("a", "kurta")], [("b", "girls"), ("a", "girls")]]),
+        ("any",    [[("a", "kurta")]]),
+    ], fields=("a", "b"))
+    assert rules.match("kurta", "") == "exact"
+    assert rules.match("kurta set", "") == "prefix"
+    assert rules.match("mens kurta", "girls 3 piece") == "both"
+    assert rules.match("mens kurta", "") == "any"
+    assert rules.match("mens kurta", "") == "any"  # memoised
+    assert rules.match("shirt", "girls") is None
+
+
+def test_fragrance_parser_matches_original_regexes():
+    texts = [p["description_text"] for p in make_catalog(2000)]
+    texts += list(iter_fragrance_edge_cases(20000))
+    texts += ["", "Size: 50ml", "Top Notes: Rose\nHeart Notes: Oud", "Top Notes:\n",
+              "MAIN ACCORDS Woody Top Notes: x", "Dry Down Base Notes: Amber Bottle 100ml"]
+    for text in texts:
+        assert phase0.parse_fragrance_notes(text) == legacy_parse_fragrance_notes(text), repr(text)
+
+
+@pytest.mark.parametrize("text, size_ml", [("Size: 50ml Bottle", 50.0), ("size:12.5 ML", 12.5), ("Top Notes: Rose", None)])
+def test_fragrance_parser_returns_numeric_size(text, size_ml):
+    assert phase0._parse_fragrance(text)[1] == size_ml
+
+
+def test_failed_run_keeps_previous_outputs(raw_catalog, tmp_path, monkeypatch):
+    out_dir = tmp_path / "out"
+    before = run_pipeline(raw_catalog, out_dir)
+
+    original = phase0.process_product
+    calls = []
+
+    def crash_midway(raw):
+        calls.append(raw)
+        if len(calls) == 700:
+            raise RuntimeError("boom")
+        return original(raw)
+
+    monkeypatch.setattr(phase0, "process_product", crash_midway)
+    with pytest.raises(RuntimeError):
+        run_pipeline(raw_catalog, out_dir, "--full")
+
+    assert {name: (out_dir / name).read_bytes() for name in OUTPUT_FILES} == before
+    assert not list(out_dir.glob("*.tmp"))
+
+
+def test_columnar_export_matches_json_outputs(raw_catalog, tmp_path):
+    columnar = pytest.importorskip("columnar")
+    pytest.importorskip("numpy")
+    out_dir = tmp_path / "out"
+    run_pipeline(raw_catalog, out_dir, "--columnar")
+    products = json.loads((out_dir / "products_hierarchical.json").read_text(encoding="utf-8"))
+    path = out_dir / columnar.COLUMNAR_NAME
+
+    cols = columnar.load_columns(path)
+    assert cols["product_id"].tolist() == [p["product_id"] for p in products]
+    assert cols["gender"].tolist() == [p["filter_metadata"]["category_l2"] for p in products]
+    assert cols["product_type"].tolist() == [p["filter_metadata"]["product_type"] for p in products]
+    assert cols["price"].tolist() == [p["product_core"]["price_numeric"] for p in products]
+    assert cols["size_ml"].tolist() == [p["filter_metadata"]["size_ml_numeric"] for p in products]
+    assert cols["in_stock"].tolist() == [p["filter_metadata"]["in_stock"] for p in products]
+
+    subset = columnar.load_columns(path, ["price", "category_l1"], decode=False)
+    assert sorted(subset) == ["category_l1", "category_l1__categories", "price"]
+    assert subset["category_l1"].dtype.kind == "i"
+    decoded = subset["category_l1__categories"][subset["category_l1"]].tolist()
+    assert decoded == [p["filter_metadata"]["category_l1"] for p in products]
+
+    run_pipeline(raw_catalog, out_dir)
+    assert not path.exists()
+
+
+def test_profile_report_counts_every_stage(raw_catalog, tmp_path):
+    plain = run_pipeline(raw_catalog, tmp_path / "plain")
+    out_dir = tmp_path / "profiled"
+    assert run_pipeline(raw_catalog, out_dir, "--profile", "--workers", "2", "--chunk-size", "150") == plain
+
+    report = json.loads((out_dir / phase0.PROFILE_NAME).read_text(encoding="utf-8"))
+    stages = report["stages"]
+    for stage in ["process_product", "extract_gender", "classify_product_type", "build_primary_chunk",
+                  "build_detailed_chunk", "generate_hyde", "build_keywords", "project_product"]:
+        assert stages[stage]["calls"] == 1200, stage
+    for name in OUTPUT_FILES:
+        assert f"write:{name}" in stages
+    assert report["products"] == 1200 and report["products_per_sec"] > 0
+
+    slowest = report["slowest_records"]
+    assert len(slowest) == phase0.SLOWEST_RECORDS
+    assert [r["ms"] for r in slowest] == sorted((r["ms"] for r in slowest), reverse=True)
+
+
+def test_bm25_stats_score_like_bm25okapi(raw_catalog, tmp_path):
+    pytest.importorskip("numpy")
+    rank_bm25 = pytest.importorskip("rank_bm25")
+    import hashlib
+    from bm25_stats import BM25Stats, BM25_STATS_NAME, bm25_tokens
+
+    out_dir = tmp_path / "out"
+    run_pipeline(raw_catalog, out_dir)
+    raw = (out_dir / "bm25_corpus.json").read_bytes()
+    corpus = json.loads(raw)
+    stats = BM25Stats.load(out_dir / BM25_STATS_NAME, hashlib.sha256(raw).hexdigest())
+    okapi = rank_bm25.BM25Okapi([bm25_tokens(doc) for doc in corpus])
+
+    assert stats.avgdl == okapi.avgdl and stats.average_idf == okapi.average_idf
+    assert stats.idf == [okapi.idf[term] for term in stats.vocab]
+    keywords = [k.lower() for doc in corpus[:50] for k in doc["keywords"]]
+    queries = [q.split() for q in ["black kurta for men", "oud perfume oud", "nonexistent", "",
+                                   "in stock lawn 3 piece"]]
+    queries += [[k] for k in keywords[:40]] + [keywords[:12]]
+    for tokens in queries:
+        assert (stats.get_scores(tokens) == okapi.get_scores(tokens)).all(), tokens
+
+    assert BM25Stats.load(out_dir / BM25_STATS_NAME, hashlib.sha256(raw + b" ").hexdigest()) is None
+
+
+def test_image_store_rows_hashes_and_duplicates(tmp_path):
+    np = pytest.importorskip("numpy")
+    Image = pytest.importorskip("PIL.Image")
+    from image_store import IMAGE_INDEX_NAME, load_image_store, preprocess_image
+
+    raws = make_catalog(12)
+    for i, raw in enumerate(raws):
+        raw["image_local_path"] = f"images/{i}.png" if i < 6 else None
+    raw_path = tmp_path / "raw.json"
+    raw_path.write_text(json.dumps(raws), encoding="utf-8")
+
+    image_dir = tmp_path / "images"
+    image_dir.mkdir()
+    rng = np.random.default_rng(7)
+    for i, (w, h) in [(0, (320, 240)), (4, (200, 300)), (5, (224, 224))]:
+        pixels = rng.integers(0, 256, (h // 20, w // 20, 3), dtype=np.uint8)
+        Image.fromarray(pixels).resize((w, h), Image.BICUBIC).save(image_dir / f"{i}.png")
+    Image.open(image_dir / "0.png").resize((480, 360)).save(image_dir / "1.png")    # same photo, resaved larger
+    (image_dir / "3.png").write_bytes(b"not an image")                              # 2.png is missing
+
+    out_dir = tmp_path / "out"
+    run_pipeline(raw_path, out_dir, "--images", "--workers", "2")
+    images, index = load_image_store(out_dir)
+    pid = [phase0.make_product_id(raw["sku"]) for raw in raws]
+
+    assert images.shape == (6, 224, 224, 3) and images.dtype == np.uint8
+    assert set(index["rows"]) == {pid[0], pid[1], pid[4], pid[5]}
+    assert set(index["failed"]) == {pid[2], pid[3]}
+    assert not images[2].any() and not images[3].any()
+    for i in (0, 4, 5):
+        expected, dhash = preprocess_image(image_dir / f"{i}.png")
+        assert (images[index["rows"][pid[i]]] == expected).all()
+        assert index["dhash"][pid[i]] == f"{dhash:016x}"
+    assert index["duplicate_groups"] == [sorted([pid[0], pid[1]])]
+    assert not (out_dir / (IMAGE_INDEX_NAME + ".tmp")).exists()
+
+
+def test_library_api_streams_without_import_side_effects(raw_catalog, tmp_path):
+    probe = ("import pathlib; pathlib.Path.mkdir = None; "
+             "import phase0_preprocessing_pipeline as p; print(p.OUTPUT_DIR.name)")
+    subprocess.run([sys.executable, "-c", probe], cwd=BASE_DIR, check=True)
+
+    cli = run_pipeline(raw_catalog, tmp_path / "cli", "--no-dedup")
+    raws = iter(json.loads(raw_catalog.read_text(encoding="utf-8")))     # one pass only
+    stats = phase0.new_stats()
+    rows = phase0.iter_processed(raws, workers=2, chunk_size=100, stats=stats)
+    sinks = phase0.write_outputs(rows, phase0.OutputSinks(tmp_path / "api" / "nested"))
+    assert sinks.hierarchical.count == stats["total"] == 1200
+    for name in OUTPUT_FILES:
+        assert (tmp_path / "api" / "nested" / name).read_bytes() == cli[name], name
+
+    first = next(phase0.iter_processed(json.loads(raw_catalog.read_text(encoding="utf-8"))))
+    assert first.product.to_dict() == json.loads(cli["products_hierarchical.json"])[0]
+
+
+def test_synthetic_colourways_and_relists_exercise_dedup(tmp_path):
+    from synthetic_catalog import write_catalog
+    raws = make_catalog(600, colourways=0.3, relists=0.1)
+    assert make_catalog(600) == make_catalog(600, colourways=0, relists=0)
+    raw_path = tmp_path / "raw.json"
+    assert write_catalog(raw_path, iter(raws), indent=None) == 600
+    assert raw_path.read_text(encoding="utf-8") == json.dumps(raws, ensure_ascii=False)
+
+    out_dir = tmp_path / "out"
+    run_pipeline(raw_path, out_dir)
+    products = json.loads((out_dir / "products_hierarchical.json").read_text(encoding="utf-8"))
+    assert len(products) == len({raw["sku"] for raw in raws}) < 600
+    assert any(len(p["category_sources"]) > 1 for p in products)
+    if phase0.NUMPY_AVAILABLE:
+        variants = [p for p in products if p["near_duplicate_of"]]
+        assert variants and all("-" in p["product_core"]["sku"] for p in variants)
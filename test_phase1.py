@@ -0,0 +1,712 @@
+"""
+Tests for the phase 1 embedding pipeline and its helper modules.
+"""
+
+import os, json, asyncio
+from collections import Counter
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+import phase0_preprocessing_pipeline as phase0
+import phase1_embedding as phase1
+import embedding_engine
+from embedding_engine import EmbeddingEngine, RateGovernor
+from embedding_cache import EmbeddingCache, CACHE_NAME
+from embedding_providers import EmbeddingProvider, HashingProvider, OpenAIProvider, EncoderTokenizer, truncate, query_dims
+from synthetic_catalog import make_catalog
+from vector_store import (VectorStore, VectorStoreWriter, Checkpoints, strip_vectors, quantize_store,
+                          remove_quantized, VECTOR_STORE_DIR, CHECKPOINT_DIR, KINDS, PRODUCTS_NAME,
+                          INDEX_NAME, QUANT_REPORT_NAME)
+
+
+@pytest.fixture(scope="module")
+def catalog(tmp_path_factory):
+    """phase0 output for 80 synthetic products, about half of them colourway variants."""
+    tmp = tmp_path_factory.mktemp("catalog")
+    raw_path = tmp / "raw.json"
+    raw_path.write_text(json.dumps(make_catalog(80, colourways=0.5)), encoding="utf-8")
+    phase0.main(["--input", str(raw_path), "--output-dir", str(tmp / "out")])
+    return tmp / "out"
+
+
+class FakeClock:
+    """time.monotonic stand-in; asyncio.sleep is patched to advance it instead of waiting."""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class RateLimited(Exception):
+    """Stands in for openai.RateLimitError: a 429 with the response's headers."""
+    status_code = 429
+
+    def __init__(self, headers):
+        super().__init__("429 Too Many Requests")
+        self.response = SimpleNamespace(headers=headers)
+
+
+class ScriptedProvider(HashingProvider):
+    """HashingProvider whose first requests raise the given errors; records every batch it is sent."""
+
+    def __init__(self, *errors, latency=0.0):
+        super().__init__()
+        self.errors = list(errors)
+        self.latency = latency
+        self.batches = []
+
+    async def aembed(self, texts):
+        self.batches.append(list(texts))
+        await asyncio.sleep(self.latency)
+        if self.errors:
+            raise self.errors.pop(0)
+        return self.embed(texts), {}
+
+
+def load_products(catalog_dir):
+    return json.loads((catalog_dir / "products_hierarchical.json").read_text(encoding="utf-8"))
+
+
+def run_phase1(monkeypatch, catalog_dir, out_dir, *extra, provider=None):
+    """phase1.main() on phase0 output with an offline provider; returns its statistics."""
+    provider = provider or HashingProvider()
+    monkeypatch.setattr(phase1, "provider", provider)
+    monkeypatch.setattr(phase1, "MODEL", provider.model)
+    monkeypatch.setattr(phase1, "DIMS", provider.dims)
+    monkeypatch.setattr(phase1, "HIERARCHICAL_JSON", catalog_dir / "products_hierarchical.json")
+    monkeypatch.setattr(phase1, "ATTRIBUTE_INDEXED_JSON", catalog_dir / "products_attribute_indexed.json")
+    monkeypatch.setattr(phase1, "EMBEDDINGS_DIR", out_dir)
+    monkeypatch.setattr(phase1, "EMBEDDINGS_OUTPUT", out_dir / "products_with_embeddings.json")
+    phase1.main(list(extra))
+    return json.loads((out_dir / "embedding_statistics.json").read_text(encoding="utf-8"))
+
+
+def test_main_embeds_the_catalog_with_the_hashing_provider(catalog, tmp_path, monkeypatch):
+    products = load_products(catalog)
+    out_dir = tmp_path / "emb"
+    stats = run_phase1(monkeypatch, catalog, out_dir, "--json")
+
+    variants = {p["product_id"]: p["near_duplicate_of"] for p in products if p.get("near_duplicate_of")}
+    assert variants
+    assert (stats["provider"], stats["model"], stats["dims"]) == ("hashing", "hashing-v1", 256)
+    assert stats["products"] == len(products)
+    assert stats["near_duplicate_variants"] == len(variants)
+    assert stats["dead_letter"]["slots_without_vector"] == 0
+
+    store = VectorStore(out_dir / VECTOR_STORE_DIR)
+    assert (store.model, store.dims, len(store)) == ("hashing-v1", 256, len(products))
+    for pid, rep in variants.items():
+        assert store.index[pid]["chunk"] == store.index[rep]["chunk"], pid
+    assert np.allclose(np.linalg.norm(store.matrix("chunk"), axis=1), 1.0, atol=1e-5)
+
+    # every vector lands in the slot of the (enriched) text it was embedded from
+    exported = json.loads((out_dir / "products_with_embeddings.json").read_text(encoding="utf-8"))
+    assert [p["product_id"] for p in exported] == [p["product_id"] for p in products]
+    embedder = HashingProvider()
+    for product in exported:
+        if product["product_id"] in variants:
+            continue
+        chunks = product["searchable_chunks"]
+        expected = embedder.embed([c["content"].strip() for c in chunks])
+        assert np.array_equal(np.asarray([c["embedding"] for c in chunks], dtype=np.float32), expected)
+        hyde = product["hyde_components"]
+        expected = embedder.embed(hyde["hypothetical_queries"])
+        assert np.array_equal(np.asarray(hyde["query_embeddings"], dtype=np.float32), expected)
+
+
+def test_rate_governor_accounts_tokens_and_follows_headers(monkeypatch):
+    clock = FakeClock()
+    real_sleep = asyncio.sleep
+
+    async def sleep(seconds):
+        clock.now += seconds
+        await real_sleep(0)
+
+    monkeypatch.setattr(asyncio, "sleep", sleep)
+    governor = RateGovernor(requests_per_minute=60, tokens_per_minute=1200, clock=clock)
+
+    async def run():
+        assert await governor.acquire(1000) == 0
+        # the server says only 100 tokens are left: 600 more at 20 tokens/s
+        governor.observe({"x-ratelimit-limit-tokens": "1200", "x-ratelimit-remaining-tokens": "100",
+                          "x-ratelimit-remaining-requests": "59"})
+        assert await governor.acquire(700) == pytest.approx(30)
+        assert governor.tokens.level == pytest.approx(0)
+
+        assert governor.throttled({"retry-after-ms": "2500"}) == 2.5
+        assert governor.tokens.scale == governor.requests.scale == 0.5
+        # the pause covers the halved refill: 1 request at 0.5/s, 10 tokens at 10/s
+        assert await governor.acquire(10) == pytest.approx(2.5)
+        governor.observe({})
+        assert governor.tokens.scale == pytest.approx(0.5 + embedding_engine.RECOVERY_STEP)
+        assert governor.throttled({"x-ratelimit-reset-tokens": "6m0s"}) == 360
+        assert governor.throttled({}) == embedding_engine.RATE_LIMIT_PAUSE
+
+    asyncio.run(run())
+
+
+def test_engine_waits_out_a_429_and_retries(monkeypatch):
+    monkeypatch.setattr(embedding_engine, "RateLimitError", RateLimited)
+    provider = ScriptedProvider(RateLimited({"retry-after-ms": "50"}))
+    engine = EmbeddingEngine(provider, retry_delay=0)
+    texts = ["red lawn suit", "black sandals"]
+
+    vectors = asyncio.run(engine.embed(texts))
+    assert np.array_equal(vectors, provider.embed(texts))
+    assert provider.batches == [texts, texts]
+    assert (engine.stats["requests"], engine.stats["rate_limited"], engine.stats["retries"]) == (2, 1, 0)
+    assert engine.stats["governor_wait_ms"] >= 50
+    assert engine.governor.requests.scale == pytest.approx(0.5 + embedding_engine.RECOVERY_STEP)
+
+    provider.errors = [RateLimited({"retry-after": "0.01"})] * (engine.max_retries + 1)
+    with pytest.raises(RateLimited):
+        asyncio.run(engine.embed(texts))
+    assert engine.stats["failed_requests"] == 1
+
+
+def test_openai_clients_leave_retries_to_the_engine(monkeypatch):
+    pytest.importorskip("openai")
+    monkeypatch.setenv("OPENAI_API_KEY", "sk-test")
+    provider = OpenAIProvider()
+    assert provider.client.max_retries == 0
+    assert provider.async_client.max_retries == 0
+
+
+def test_cache_hits_misses_and_evict(tmp_path):
+    cache = EmbeddingCache(tmp_path / CACHE_NAME, "hashing-v1", 256)
+    vectors = HashingProvider().embed(["kurta", "chappal", "attar"])
+    cache.put_many(zip(["kurta", "chappal", "attar"], vectors))
+
+    found = cache.get_many(["kurta", "attar", "abaya"])
+    assert sorted(found) == ["attar", "kurta"]
+    assert np.array_equal(found["attar"], vectors[2]) and found["attar"].dtype == np.float32
+    assert (cache.hits, cache.misses) == (2, 1)
+    # another model or size never sees these vectors
+    assert EmbeddingCache(tmp_path / CACHE_NAME, "hashing-v1", 128).get_many(["kurta"]) == {}
+
+    assert cache.evict([cache.key("kurta"), cache.key("abaya")]) == 2
+    assert len(cache) == 1 and list(cache.get_many(["kurta", "chappal"])) == ["kurta"]
+    cache.close()
+
+
+def test_rerun_is_served_from_the_cache(catalog, tmp_path, monkeypatch):
+    out_dir = tmp_path / "emb"
+    first = run_phase1(monkeypatch, catalog, out_dir, "--no-quantize")
+    store = out_dir / VECTOR_STORE_DIR
+    before = {name: (store / f"{name}.npy").read_bytes() for name in KINDS}
+    second = run_phase1(monkeypatch, catalog, out_dir, "--no-quantize")
+
+    assert first["texts"]["api_inputs"] == first["texts"]["distinct"] > 0
+    assert first["cache"]["hits"] == 0
+    assert second["texts"]["api_inputs"] == 0
+    assert second["cache"]["misses"] == 0 and second["cache"]["hits"] >= second["texts"]["distinct"]
+    assert second["cache"]["entries"] == first["cache"]["entries"] == first["texts"]["distinct"]
+    assert {name: (store / f"{name}.npy").read_bytes() for name in KINDS} == before
+
+    # once products leave the catalog, --evict-cache keeps only the texts still in it
+    products = load_products(catalog)[:10]
+    attr_path = catalog / "products_attribute_indexed.json"
+    attr_lookup = phase1.build_attribute_lookup(attr_path)
+    texts = set()
+    for product in json.loads(json.dumps(products)):
+        phase1.enrich_product(product, attr_lookup)
+        texts.update(text for *_, text in phase1.collect_texts(product))
+    cache = EmbeddingCache(out_dir / CACHE_NAME, "hashing-v1", 256)
+    kept = cache.get_many(texts)
+    cache.close()
+
+    smaller = tmp_path / "smaller"
+    smaller.mkdir()
+    (smaller / "products_hierarchical.json").write_text(json.dumps(products), encoding="utf-8")
+    (smaller / attr_path.name).write_bytes(attr_path.read_bytes())
+    run_phase1(monkeypatch, smaller, out_dir, "--evict-cache")
+    cache = EmbeddingCache(out_dir / CACHE_NAME, "hashing-v1", 256)
+    assert 0 < len(cache) == len(kept) < first["cache"]["entries"]
+    assert sorted(cache.get_many(texts)) == sorted(kept)
+    cache.close()
+
+
+def make_product(i, rep=None, chunks=None, queries=None):
+    return {"product_id": f"p{i}", "near_duplicate_of": rep,
+            "searchable_chunks": [{"content": text} for text in chunks or [f"kurta {i} in lawn", ""]],
+            "hyde_components": {"hypothetical_queries": queries or [f"kurta {i}", "eid kurta for men"],
+                                "hypothetical_answers": [f"kurta {i} is a lawn kurta"]},
+            "fragrance_metadata": {}}
+
+
+def embed_all(products, engine, **kwargs):
+    async def run():
+        return [p async for p in phase1.embed_products(iter(products), {}, engine, **kwargs)]
+    return asyncio.run(run())
+
+
+def test_each_distinct_text_is_sent_once_per_run():
+    products = [make_product(i) for i in range(40)]
+    products += [make_product(100 + i, chunks=["eid kurta for men"]) for i in range(5)]
+    provider = ScriptedProvider()
+    engine = EmbeddingEngine(provider, max_in_flight=2)
+    stats = Counter()
+    counts = phase1.count_texts(products, {})
+    out = embed_all(products, engine, batch_size=4, text_counts=counts, stats=stats)
+
+    sent = [text for batch in provider.batches for text in batch]
+    assert sorted(sent) == sorted(counts)
+    assert stats["texts"] == sum(counts.values())
+    assert stats["shared"] == sum(counts.values()) - len(counts)
+
+    # every product needing the shared text holds the one vector it was given
+    shared = out[0]["hyde_components"]["query_embeddings"][1]
+    assert all(p["hyde_components"]["query_embeddings"][1] is shared for p in out[:40])
+    assert all(p["searchable_chunks"][0]["embedding"] is shared for p in out[40:])
+    assert np.array_equal(shared, provider.embed(["eid kurta for men"])[0])
+    assert [p["product_id"] for p in out] == [p["product_id"] for p in products]
+
+
+class WordTokenizer:
+    """The slice of a Hugging Face tokenizer EncoderTokenizer uses: one id per word, [CLS] and [SEP]."""
+    name_or_path = "words"
+
+    def __init__(self):
+        self.vocab = {}
+
+    def num_special_tokens_to_add(self):
+        return 2
+
+    def encode(self, text, add_special_tokens=True, verbose=True):
+        ids = [self.vocab.setdefault(word, len(self.vocab)) for word in text.split()]
+        return [-1, *ids, -2] if add_special_tokens else ids
+
+    def decode(self, ids):
+        words = {i: word for word, i in self.vocab.items()}
+        return " ".join(words[i] for i in ids)
+
+
+def test_texts_are_counted_and_split_in_the_providers_units():
+    tokenizer = EncoderTokenizer(WordTokenizer())
+    text = " ".join(f"w{i}" for i in range(20))
+    assert tokenizer.count(text) == 22
+    assert tokenizer.split(text, 8) == [" ".join(f"w{i}" for i in range(k, min(k + 6, 20))) for k in (0, 6, 12, 18)]
+
+    provider = ScriptedProvider()
+    provider.tokenizer, provider.max_input_tokens = tokenizer, 8
+    assert provider.count_tokens(text) == 22
+    engine = EmbeddingEngine(provider)
+    stats = Counter()
+    out = embed_all([make_product(0, chunks=[text, "w1 w2"])], engine, stats=stats)
+
+    assert stats["split_texts"] == 1
+    assert sorted(len(t.split()) for batch in provider.batches for t in batch if t.startswith("w")) == [2, 2, 6, 6, 6]
+    assert engine.stats["tokens"] == sum(provider.count_tokens(t) for batch in provider.batches for t in batch)
+    assert np.linalg.norm(out[0]["searchable_chunks"][0]["embedding"]) == pytest.approx(1.0)
+
+
+def test_a_provider_without_embed_fails_at_construction():
+    class Incomplete(EmbeddingProvider):
+        name = "incomplete"
+
+    with pytest.raises(TypeError, match="embed"):
+        Incomplete("some-model", 8)
+
+
+def test_requests_are_packed_by_token_count():
+    products = [make_product(i, chunks=[" ".join(["lawn"] * (i % 7 * 15 + 1)) + f" {i}"]) for i in range(60)]
+    provider = ScriptedProvider(latency=0.02)      # requests stay in flight while the next fill up
+    engine = EmbeddingEngine(provider, max_in_flight=2)
+    out = embed_all(products, engine, batch_size=16, batch_tokens=300)
+
+    sizes = [sum(provider.count_tokens(t) for t in batch) for batch in provider.batches]
+    assert all(len(batch) <= 16 for batch in provider.batches)
+    assert all(size <= 300 for size in sizes)
+    # a request is only cut short when the next text would not fit
+    assert len(provider.batches) <= 2 * sum(sizes) / 300 + 1
+    for product in out:
+        text = product["searchable_chunks"][0]["content"]
+        assert np.array_equal(product["searchable_chunks"][0]["embedding"], provider.embed([text])[0])
+
+
+def test_split_text_becomes_one_unit_vector():
+    words = "embroidered lawn kurta with a straight hem and printed dupatta for eid".split()
+    text = " ".join(words[i % len(words)] for i in range(400))
+    provider = ScriptedProvider()
+    provider.max_input_tokens = 200
+    engine = EmbeddingEngine(provider)
+    stats = Counter()
+    out = embed_all([make_product(0, chunks=[text])], engine, stats=stats)
+
+    pieces = provider.split_text(text)
+    assert len(pieces) > 2 and stats["split_texts"] == 1
+    assert all(provider.count_tokens(piece) <= 200 for piece in pieces)
+    sent = [t for batch in provider.batches for t in batch]
+    assert all(piece in sent for piece in pieces) and text not in sent
+
+    vector = out[0]["searchable_chunks"][0]["embedding"]
+    weights = [provider.count_tokens(piece) for piece in pieces]
+    expected = np.average(provider.embed(pieces).astype(np.float64), axis=0, weights=weights)
+    assert np.linalg.norm(vector) == pytest.approx(1.0, abs=1e-6)
+    assert np.allclose(vector, expected / np.linalg.norm(expected), atol=1e-6)
+
+
+def embedded_product(i, provider, rep=None):
+    """make_product() with the vectors phase1 would give it."""
+    product = make_product(i, rep=rep)
+    chunks, hyde = product["searchable_chunks"], product["hyde_components"]
+    chunks[0]["embedding"] = provider.embed([chunks[0]["content"]])[0]
+    hyde["query_embeddings"] = list(provider.embed(hyde["hypothetical_queries"]))
+    hyde["answer_embeddings"] = [provider.embed(hyde["hypothetical_answers"])[0].tolist()]
+    hyde["hyde_query_avg"] = phase1.average_vectors(hyde["query_embeddings"])
+    hyde["hyde_answer_avg"] = None
+    return product
+
+
+def test_vector_store_round_trip_and_index(tmp_path):
+    provider = HashingProvider(dims=32)
+    products = [embedded_product(i, provider) for i in range(5)]
+    variant = make_product(5, rep="p1")
+    phase1.copy_embeddings(products[1], variant)
+    products.insert(3, variant)
+
+    writer = VectorStoreWriter(tmp_path / "store", "hashing-v1", 32, shared_ids={"p1"})
+    for product in products:
+        writer.write(product)
+    summary = writer.close()
+    assert sorted(p.name for p in (tmp_path / "store").iterdir()) == sorted(
+        [f"{kind}.npy" for kind in KINDS] + [PRODUCTS_NAME, INDEX_NAME])
+    assert summary["rows"] == {"chunk": 5, "hyde_query": 10, "hyde_answer": 5,
+                               "hyde_query_avg": 5, "hyde_answer_avg": 0}
+    assert summary["shared_rows"] == 5          # the variant's chunk, 2 queries, answer and average
+
+    store = VectorStore(tmp_path / "store")
+    assert (store.model, store.dims, len(store)) == ("hashing-v1", 32, 6)
+    assert store.index["p5"] == store.index["p1"]
+    assert store.index["p2"]["chunk"] == [2, -1] and store.index["p2"]["hyde_answer_avg"] == -1
+    assert store.matrix("chunk").dtype == np.float32 and store.matrix("chunk").shape == (5, 32)
+
+    chunk, empty = store.vectors("p4", "chunk")
+    assert np.array_equal(chunk, products[5]["searchable_chunks"][0]["embedding"]) and empty is None
+    assert store.vectors("p4", "hyde_answer_avg") is None
+    assert np.array_equal(store.vectors("p4", "hyde_query_avg"), products[5]["hyde_components"]["hyde_query_avg"])
+
+    for original, loaded in zip(products, store.iter_products(arrays=True)):
+        assert loaded["product_id"] == original["product_id"]
+        assert phase1.same_vectors(loaded, original)
+        assert "embedding" not in loaded["searchable_chunks"][1]
+        assert strip_vectors(loaded) == strip_vectors(original)
+    as_lists = next(store.iter_products(kinds=("hyde_answer",)))
+    assert as_lists["hyde_components"]["answer_embeddings"] == products[0]["hyde_components"]["answer_embeddings"]
+    assert "embedding" not in as_lists["searchable_chunks"][0]
+
+
+def test_vector_store_writer_abort_leaves_no_files(tmp_path):
+    writer = VectorStoreWriter(tmp_path / "store", "hashing-v1", 32)
+    writer.write(embedded_product(0, HashingProvider(dims=32)))
+    with pytest.raises(ValueError):
+        writer.write(embedded_product(1, HashingProvider(dims=16)))
+    writer.abort()
+    assert list((tmp_path / "store").iterdir()) == []
+    assert not VectorStore.exists(tmp_path / "store")
+
+
+def store_files(store_dir):
+    """Every file of a vector store; index.json without its timestamp."""
+    files = {path.name: path.read_bytes() for path in store_dir.iterdir()}
+    index = json.loads(files.pop(INDEX_NAME))
+    index.pop("generated_at")
+    return files, index
+
+
+def test_resumed_run_matches_an_uninterrupted_one(catalog, tmp_path, monkeypatch):
+    args = ["--no-cache", "--no-quantize", "--batch-inputs", "8", "--checkpoint-every", "7"]
+    whole = tmp_path / "whole"
+    run_phase1(monkeypatch, catalog, whole, *args)
+
+    class Crash(Checkpoints):
+        """Checkpoints whose disk fills up after 30 products (4 finished parts of 7)."""
+        def write(self, product):
+            if self.count + (self._writer.count if self._writer else 0) == 30:
+                raise OSError("No space left on device")
+            super().write(product)
+
+    resumed = tmp_path / "resumed"
+    monkeypatch.setattr(phase1, "Checkpoints", Crash)
+    with pytest.raises(OSError):
+        run_phase1(monkeypatch, catalog, resumed, *args)
+    checkpoint_dir = resumed / CHECKPOINT_DIR
+    manifest = checkpoint_dir / Checkpoints.MANIFEST
+    assert len(manifest.read_text(encoding="utf-8").splitlines()) == 1 + 4
+    # the part in progress is dropped; resuming deletes whatever is left of it
+    assert sorted(p.name for p in checkpoint_dir.iterdir() if p.is_dir()) == [f"part-0000{i}" for i in range(1, 6)]
+    assert not VectorStore.exists(checkpoint_dir / "part-00005")
+    assert not (resumed / VECTOR_STORE_DIR).exists()
+
+    # a crash while resuming must not cost the manifest: its rewrite is staged and renamed
+    with open(manifest, "a", encoding="utf-8") as f:
+        f.write('{"name": "part-00005", "prod')                       # torn last line
+    before = manifest.read_bytes()
+    real_replace = os.replace
+    monkeypatch.setattr(os, "replace", lambda src, dst: (_ for _ in ()).throw(OSError("crash")))
+    monkeypatch.setattr(phase1, "Checkpoints", Checkpoints)
+    with pytest.raises(OSError):
+        run_phase1(monkeypatch, catalog, resumed, *args, "--resume")
+    assert manifest.read_bytes() == before
+    monkeypatch.setattr(os, "replace", real_replace)
+
+    stats = run_phase1(monkeypatch, catalog, resumed, *args, "--resume")
+    assert stats["resumed_products"] == 28
+    assert not checkpoint_dir.exists()
+    assert store_files(resumed / VECTOR_STORE_DIR) == store_files(whole / VECTOR_STORE_DIR)
+
+
+class Unavailable(Exception):
+    """An API error with an HTTP status, like openai.APIStatusError."""
+
+    def __init__(self, status_code):
+        super().__init__(f"Error code: {status_code}")
+        self.status_code = status_code
+
+
+class RejectingProvider(HashingProvider):
+    """Raises ValueError, the way a local model would, for any batch holding a text with BAD in it."""
+
+    def __init__(self):
+        super().__init__()
+        self.calls = 0
+
+    def embed(self, texts):
+        self.calls += 1
+        if any("BAD" in text for text in texts):
+            raise ValueError("cannot embed BAD input")
+        return super().embed(texts)
+
+
+@pytest.mark.parametrize("error, transient", [
+    (ConnectionResetError(), True), (TimeoutError(), True), (asyncio.TimeoutError(), True),
+    (OSError(110, "Connection timed out"), True), (Unavailable(503), True), (Unavailable(429), True),
+    (Unavailable(408), True), (Unavailable(400), False), (Unavailable(413), False),
+    (ValueError("bad input"), False), (RuntimeError("CUDA error"), False), (OSError(2, "missing"), False),
+])
+def test_is_transient(error, transient):
+    assert embedding_engine.is_transient(error) is transient
+
+
+def test_rejected_inputs_are_bisected_and_dead_lettered(tmp_path):
+    provider = RejectingProvider()
+    engine = EmbeddingEngine(provider, retry_delay=0)
+    texts = [f"kurta {i}" for i in range(8)]
+    texts[5] = "BAD kurta"
+    vectors, errors = asyncio.run(engine.embed_isolated(texts, [1] * 8))
+
+    assert errors == {5: "ValueError: cannot embed BAD input"}
+    assert vectors[5] is None
+    assert np.array_equal(np.stack([v for i, v in enumerate(vectors) if i != 5]),
+                          provider.embed([t for i, t in enumerate(texts) if i != 5]))
+    assert engine.stats["retries"] == 0 and engine.stats["bisections"] == 3
+    assert engine.stats["failed_inputs"] == 1
+
+    products = [make_product(i) for i in range(6)]
+    products[2]["searchable_chunks"][0]["content"] = "BAD lawn"
+    products[4]["hyde_components"]["hypothetical_queries"] = ["BAD query", "eid kurta for men"]
+    dead_letter = phase1.DeadLetter(tmp_path / phase1.DEAD_LETTER_NAME)
+    stats = Counter()
+    out = embed_all(products, EmbeddingEngine(RejectingProvider()), batch_size=32,
+                    dead_letter=dead_letter, stats=stats)
+    dead_letter.close()
+
+    assert stats["failed_slots"] == 2
+    assert "embedding" not in out[2]["searchable_chunks"][0]
+    hyde = out[4]["hyde_components"]
+    assert len(hyde["query_embeddings"]) == 1
+    assert np.array_equal(hyde["hyde_query_avg"], hyde["query_embeddings"][0])
+    entries = [json.loads(line) for line in (tmp_path / phase1.DEAD_LETTER_NAME).read_text().splitlines()]
+    assert [(e["product_id"], e["section"], e["index"], e["text"], e["error"]) for e in entries] == [
+        ("p2", "chunk", 0, "BAD lawn", "ValueError: cannot embed BAD input"),
+        ("p4", "hyde_query", 0, "BAD query", "ValueError: cannot embed BAD input")]
+    assert all(e["model"] == phase1.MODEL and e["failed_at"] for e in entries)
+
+
+def test_transient_errors_are_retried_not_bisected():
+    provider = ScriptedProvider(*[Unavailable(503)] * (embedding_engine.MAX_RETRIES + 1))
+    engine = EmbeddingEngine(provider, retry_delay=0)
+    texts = ["kurta 1", "kurta 2", "kurta 3"]
+    vectors, errors = asyncio.run(engine.embed_isolated(texts, [1, 1, 1]))
+    assert vectors == [None] * 3 and set(errors) == {0, 1, 2}
+    assert len(provider.batches) == embedding_engine.MAX_RETRIES + 1
+    assert engine.stats["retries"] == embedding_engine.MAX_RETRIES and engine.stats["bisections"] == 0
+
+    provider.errors = [ConnectionResetError()]
+    vectors, errors = asyncio.run(engine.embed_isolated(texts, [1, 1, 1]))
+    assert errors == {} and np.array_equal(np.stack(vectors), provider.embed(texts))
+
+
+def test_embed_batch_bisects_rejected_inputs(tmp_path, monkeypatch):
+    monkeypatch.setattr(phase1, "provider", RejectingProvider())
+    dead_letter = phase1.DeadLetter(tmp_path / phase1.DEAD_LETTER_NAME)
+    vectors = phase1.embed_batch(["kurta 1", "", "BAD kurta", "kurta 3"], dead_letter)
+    dead_letter.close()
+    assert [v is None for v in vectors] == [False, True, True, False]
+    assert dead_letter.count == 1
+    assert json.loads((tmp_path / phase1.DEAD_LETTER_NAME).read_text())["text"] == "BAD kurta"
+
+
+class ShortProvider(HashingProvider):
+    """Returns one row too few for any batch holding a text with LOST in it."""
+
+    def embed(self, texts):
+        vectors = super().embed(texts)
+        return vectors[:-1] if any("LOST" in text for text in texts) else vectors
+
+
+def test_short_responses_fail_instead_of_dropping_rows(tmp_path, monkeypatch):
+    texts = ["kurta 1", "kurta 2", "LOST kurta", "kurta 3"]
+    engine = EmbeddingEngine(ShortProvider(), retry_delay=0)
+    with pytest.raises(ValueError, match="3 vectors for 4 texts"):
+        asyncio.run(engine.embed(texts))
+    vectors, errors = asyncio.run(engine.embed_isolated(texts, [1] * 4))
+    assert errors == {2: "ValueError: provider returned 0 vectors for 1 texts"}
+    assert [v is None for v in vectors] == [False, False, True, False]
+    assert engine.stats["retries"] == 0
+
+    monkeypatch.setattr(phase1, "provider", ShortProvider())
+    dead_letter = phase1.DeadLetter(tmp_path / phase1.DEAD_LETTER_NAME)
+    vectors = phase1.embed_batch(texts, dead_letter)
+    dead_letter.close()
+    assert [v is None for v in vectors] == [False, False, True, False]
+    assert np.array_equal(vectors[3], HashingProvider().embed(["kurta 3"])[0])
+    assert json.loads((tmp_path / phase1.DEAD_LETTER_NAME).read_text())["text"] == "LOST kurta"
+
+
+def test_truncate_keeps_leading_components_renormalised():
+    vectors = HashingProvider(dims=64).embed(["red lawn kurta", "black chappal", ""])
+    cut = truncate(vectors, 16)
+    assert cut.shape == (3, 16) and cut.dtype == np.float32
+    assert np.allclose(np.linalg.norm(cut[:2], axis=1), 1.0, atol=1e-6)
+    assert np.allclose(cut[:2] * np.linalg.norm(vectors[:2, :16], axis=1, keepdims=True), vectors[:2, :16])
+    assert not cut[2].any()                                  # an empty vector stays zero
+    assert np.array_equal(truncate(vectors[0], 16), cut[0])
+
+
+@pytest.mark.parametrize("ingested, expected", [
+    ({"model": "text-embedding-3-large", "dims": 3072}, 3072),
+    ({"model": "text-embedding-3-large", "dims": 256, "full_dims": 3072}, 256),
+    ({"model": "text-embedding-3-large", "dims": 256, "full_dims": 1024}, None),
+    ({"model": "text-embedding-3-large", "dims": 1024}, None),
+    ({"model": "text-embedding-3-small", "dims": 3072}, None),
+])
+def test_query_dims(ingested, expected):
+    spec = {"provider": "openai", "model": "text-embedding-3-large", "dims": 3072}
+    assert query_dims(ingested, spec) == expected
+
+
+def test_rescore_orders_candidates_by_full_size_similarity(tmp_path):
+    provider = HashingProvider(dims=64)
+    products = [embedded_product(i, provider) for i in range(12)]
+    products[7]["searchable_chunks"][0]["embedding"] = None          # scored on its HyDE average only
+    writer = VectorStoreWriter(tmp_path / "store", provider.model, provider.dims)
+    for product in products:
+        writer.write(product)
+    writer.close()
+    store = VectorStore(tmp_path / "store")
+
+    query = provider.embed(["kurta 7 in lawn"])[0]
+    candidates = [{"product_id": f"p{i}"} for i in (3, 11, 7, 0, 5, 9, 1)] + [{"product_id": "unknown"}]
+    top = store.rescore(candidates, query * 3, limit=5)
+
+    def expected_score(product):
+        vectors = [product["hyde_components"]["hyde_query_avg"], product["searchable_chunks"][0].get("embedding")]
+        return max(float(np.dot(v, query)) for v in vectors if v is not None)
+
+    by_id = {p["product_id"]: p for p in products}
+    scores = {c["product_id"]: expected_score(by_id[c["product_id"]]) for c in candidates[:-1]}
+    assert [c["product_id"] for c in top] == sorted(scores, key=lambda pid: -scores[pid])[:5]
+    for c in candidates[:-1]:
+        assert c["_full_score"] == pytest.approx(scores[c["product_id"]], abs=1e-5)
+    assert candidates[-1]["_full_score"] == float("-inf")
+    assert store.rescore(candidates, query, limit=20)[-1]["product_id"] == "unknown"
+
+
+def write_store(directory, matrices):
+    """A store of one product per row of matrices["chunk"] / ["hyde_query_avg"]."""
+    dims = matrices["chunk"].shape[1]
+    writer = VectorStoreWriter(directory, "test-model", dims)
+    for i, (chunk, avg) in enumerate(zip(matrices["chunk"], matrices["hyde_query_avg"])):
+        writer.write({"product_id": f"p{i}", "searchable_chunks": [{"content": "x", "embedding": chunk}],
+                      "hyde_components": {"query_embeddings": [avg], "hyde_query_avg": avg}})
+    writer.close()
+    return VectorStore(directory)
+
+
+def test_quantized_copies_round_trip(tmp_path):
+    rng = np.random.default_rng(3)
+    dense = rng.standard_normal((300, 96)).astype(np.float32)
+    dense /= np.linalg.norm(dense, axis=1, keepdims=True)
+    store = write_store(tmp_path / "dense", {"chunk": dense, "hyde_query_avg": dense[::-1].copy()})
+    report = quantize_store(tmp_path / "dense", sample=200)
+
+    for kind in ("chunk", "hyde_query_avg"):
+        matrix = np.asarray(store.matrix(kind))
+        codes, scale = store.quantized(kind, "int8")
+        assert codes.dtype == np.int8 and codes.shape == matrix.shape
+        assert np.allclose(scale, np.abs(matrix).max(axis=0) / 127)
+        assert np.all(np.abs(codes * scale - matrix) <= scale / 2 + 1e-7)
+        bits, none = store.quantized(kind, "binary")
+        assert none is None and bits.shape == (300, 12)
+        assert np.array_equal(np.unpackbits(bits, axis=1).astype(bool), matrix > 0)
+
+    calibration = report["kinds"]["chunk"]["calibration"]
+    assert calibration["sample_rows"] == 200 and calibration["zero_fraction"] == 0
+    assert calibration["int8_pair_cosine_error"]["mean"] < 0.01
+    assert 0 < calibration["binary_pair_cosine_error"]["mean"] < 0.2
+    assert report["kinds"]["hyde_answer"] == {"rows": 0, "bytes": {"float32": 0, "int8": 0, "binary": 0}}
+    assert report["bytes"]["float32"] == 3 * 300 * 96 * 4              # chunk, hyde_query, hyde_query_avg
+    assert report["compression"]["binary"] == 32.0
+    assert "dense" in report["binary_estimate"]
+    assert json.loads((tmp_path / "dense" / QUANT_REPORT_NAME).read_text(encoding="utf-8")) == report
+
+    before = sorted(p.name for p in (tmp_path / "dense").iterdir())
+    remove_quantized(tmp_path / "dense")
+    after = sorted(p.name for p in (tmp_path / "dense").iterdir())
+    assert after == sorted([f"{kind}.npy" for kind in KINDS] + [PRODUCTS_NAME, INDEX_NAME])
+    assert len(before) == len(after) + 3 * len(KINDS) + 1
+    assert VectorStore(tmp_path / "dense").vectors("p0", "chunk")[0].tolist() == dense[0].tolist()
+
+
+def test_binary_calibration_is_skipped_for_sparse_vectors(tmp_path):
+    sparse = HashingProvider(dims=256).embed([f"red lawn kurta {i}" for i in range(50)])
+    write_store(tmp_path / "sparse", {"chunk": sparse, "hyde_query_avg": sparse})
+    calibration = quantize_store(tmp_path / "sparse")["kinds"]["chunk"]["calibration"]
+    assert calibration["zero_fraction"] > 0.5
+    assert calibration["binary_pair_cosine_error"] is None
+    assert calibration["binary_estimate"] == "not meaningful for sparse vectors"
+    assert calibration["int8_pair_cosine_error"]["mean"] < 0.01
+
+
+def test_rescore_keeps_the_keyword_side_of_hybrid_scores(tmp_path):
+    provider = HashingProvider(dims=64)
+    products = [embedded_product(i, provider) for i in range(6)]
+    writer = VectorStoreWriter(tmp_path / "store", provider.model, provider.dims)
+    for product in products:
+        writer.write(product)
+    writer.close()
+    store = VectorStore(tmp_path / "store")
+
+    query = provider.embed(["kurta 4 in lawn"])[0]
+    # p2 is the exact SKU match: top hybrid score at a keyword-heavy alpha, weak cosine
+    hybrid = {"p2": 0.95, "p4": 0.60, "p0": 0.55, "p1": 0.50, "p3": 0.40, "p5": 0.30}
+
+    def candidates():
+        return [{"product_id": pid, "_wv_score": score} for pid, score in hybrid.items()]
+
+    by_cosine = [c["product_id"] for c in store.rescore(candidates(), query, limit=6)]
+    assert by_cosine[0] == "p4" and by_cosine.index("p2") > 0
+
+    ranked = store.rescore(candidates(), query, limit=6, alpha=0.15)
+    assert ranked[0]["product_id"] == "p2"
+    full = np.array([c["_full_score"] for c in ranked])
+    wv = np.array([c["_wv_score"] for c in ranked])
+    expected = (0.15 * (full - full.min()) / (full.max() - full.min())
+                + 0.85 * (wv - wv.min()) / (wv.max() - wv.min()))
+    assert np.allclose([c["_rescore_score"] for c in ranked], expected)
+    assert list(expected) == sorted(expected, reverse=True)
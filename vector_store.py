@@ -0,0 +1,568 @@
+"""
+Embedding vector store
+======================
+EMBEDDINGS_DIR/vector_store/ — written by phase1, read by phase2.
+
+    chunk.npy            float32 [rows, dims]  searchable_chunks[i]["embedding"]
+    hyde_query.npy       float32 [rows, dims]  hyde_components["query_embeddings"]
+    hyde_answer.npy      float32 [rows, dims]  hyde_components["answer_embeddings"]
+    hyde_query_avg.npy   float32 [rows, dims]  hyde_components["hyde_query_avg"]
+    hyde_answer_avg.npy  float32 [rows, dims]  hyde_components["hyde_answer_avg"]
+    products.jsonl       one product per line, in phase1 order, without vectors
+    index.json           model, dims, rows per kind, product_id → rows
+
+index.json["index"][pid] maps each kind to its rows: a list for the per-slot
+kinds (chunk: one entry per chunk, -1 where the chunk has no embedding;
+hyde_query / hyde_answer: one per vector), a single row for the averages.
+Near-duplicate variants point at their representative's rows instead of
+storing the same vectors again.
+
+Rows are appended as raw float32 behind a fixed-size .npy header that is
+rewritten with the final shape on close(), so writing needs neither numpy
+nor the row count up front. Every file is staged as <name>.tmp and renamed
+into place; index.json goes last.
+
+    from vector_store import VectorStore
+    store = VectorStore(embeddings_dir / VECTOR_STORE_DIR)
+    for product in store.iter_products(kinds=("chunk", "hyde_query_avg")):
+        ...                                # vectors re-attached as lists
+    matrix = store.matrix("chunk")         # read-only memmap
+    top = store.rescore(candidates, query, limit=10, alpha=0.6)   # phase3's second stage
+
+Quantized copies (quantize_store, run by phase1 after every store it
+writes) sit next to each float32 matrix, row for row, so the same index
+applies to them:
+
+    <kind>.int8.npy        int8  [rows, dims]     round(x / scale), per-dimension
+    <kind>.int8_scale.npy  float32 [dims]         scale = max |x| of the dimension / 127
+    <kind>.binary.npy      uint8 [rows, dims / 8] sign bits, np.packbits(x > 0)
+    quantization.json      sizes and a cosine-error calibration per kind
+
+    codes, scale = store.quantized("chunk", "int8")     # x ≈ codes * scale
+    bits, _ = store.quantized("chunk", "binary")        # cos ≈ cos(pi * hamming / dims)
+
+The binary estimate assumes dense, roughly isotropic vectors such as the
+API's; a sparse store (the hashing provider's, mostly exact zeros that
+pack as negative signs) gets its zero fraction in the calibration instead
+of a binary error, which would be meaningless.
+
+Checkpoints keeps a run's progress in EMBEDDINGS_DIR/vector_store.checkpoints/
+as a series of small stores in this same format (see the class); phase1
+compacts them into vector_store/ when the run completes.
+"""
+
+import os, sys, json, struct
+from array import array
+from pathlib import Path
+from datetime import datetime
+from typing import Dict, Iterable, Iterator, List, Optional
+
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+
+VECTOR_STORE_DIR = "vector_store"
+PRODUCTS_NAME    = "products.jsonl"
+INDEX_NAME       = "index.json"
+CHECKPOINT_DIR   = "vector_store.checkpoints"
+SLOT_KINDS       = ("chunk", "hyde_query", "hyde_answer")
+AVERAGE_KINDS    = ("hyde_query_avg", "hyde_answer_avg")
+KINDS            = SLOT_KINDS + AVERAGE_KINDS
+HEADER_BYTES     = 128        # .npy v1.0 header, padded; room for any (rows, dims)
+QUANT_FORMS      = ("int8", "binary")
+QUANT_REPORT_NAME = "quantization.json"
+QUANT_CHUNK      = 65536      # rows quantized at a time
+CALIBRATION_SAMPLE = 2000     # rows (and row pairs) per kind in the calibration report
+SPARSE_ZERO_FRACTION = 0.05   # exact zeros above which the binary cosine estimate is not reported
+BINARY_ESTIMATE  = ("cos(pi * hamming / dims): holds for dense, roughly isotropic embeddings only; "
+                    "zero components pack as negative signs")
+
+
+def npy_header(rows: int, dims: int) -> bytes:
+    """A HEADER_BYTES-long .npy v1.0 header for a C-order little-endian float32 [rows, dims]."""
+    header = "{'descr': '<f4', 'fortran_order': False, 'shape': (%d, %d), }" % (rows, dims)
+    header = header.ljust(HEADER_BYTES - 10 - 1) + "\n"
+    return b"\x93NUMPY\x01\x00" + struct.pack("<H", len(header)) + header.encode("latin1")
+
+
+def staging_path(path: Path) -> Path:
+    return path.with_name(path.name + ".tmp")
+
+
+def strip_vectors(product: Dict) -> Dict:
+    """A copy of the product without its vectors (the product itself is left intact)."""
+    slim = dict(product)
+    if "searchable_chunks" in product:
+        slim["searchable_chunks"] = [
+            {k: v for k, v in chunk.items() if k != "embedding"} if isinstance(chunk, dict) else chunk
+            for chunk in product["searchable_chunks"]
+        ]
+    if isinstance(product.get("hyde_components"), dict):
+        slim["hyde_components"] = {
+            k: v for k, v in product["hyde_components"].items()
+            if k not in ("query_embeddings", "answer_embeddings", "hyde_query_avg", "hyde_answer_avg")
+        }
+    return slim
+
+
+def product_vectors(product: Dict) -> Dict[str, List]:
+    """kind → vectors of one embedded product (None for chunks without an embedding)."""
+    hyde = product.get("hyde_components") or {}
+    return {
+        "chunk":           [c.get("embedding") if isinstance(c, dict) else None
+                            for c in product.get("searchable_chunks", [])],
+        "hyde_query":      list(hyde.get("query_embeddings") or []),
+        "hyde_answer":     list(hyde.get("answer_embeddings") or []),
+        "hyde_query_avg":  [hyde.get("hyde_query_avg")],
+        "hyde_answer_avg": [hyde.get("hyde_answer_avg")],
+    }
+
+
+class VectorStoreWriter:
+    """
+    Streams embedded products into a vector store directory.
+    Products whose id is in `shared_ids` (near-duplicate representatives)
+    remember their rows so variants holding the very same vector objects
+    (phase1's copy_embeddings) reuse them.
+    """
+
+    def __init__(self, directory: Path, model: str, dims: int, shared_ids: Iterable[str] = ()):
+        directory.mkdir(parents=True, exist_ok=True)
+        self.directory = directory
+        self.model = model
+        self.dims = dims
+        self.count = 0
+        self.rows = {kind: 0 for kind in KINDS}
+        self.shared_rows = 0
+        self.index: Dict[str, Dict] = {}
+        self._shared_ids = set(shared_ids)
+        self._shared: Dict[str, Dict[str, List]] = {}
+        self._files = {}
+        for kind in KINDS:
+            f = open(staging_path(directory / f"{kind}.npy"), "wb")
+            f.write(npy_header(0, dims))
+            self._files[kind] = f
+        self._products = open(staging_path(directory / PRODUCTS_NAME), "w", encoding="utf-8")
+
+    def _append(self, kind: str, vector) -> int:
+        if len(vector) != self.dims:
+            raise ValueError(f"{kind} vector has {len(vector)} dims, expected {self.dims}")
+        if hasattr(vector, "astype"):                        # NumPy array
+            self._files[kind].write(vector.astype("<f4", copy=False).tobytes())
+        else:
+            packed = array("f", vector)
+            if sys.byteorder != "little":
+                packed.byteswap()
+            self._files[kind].write(packed.tobytes())
+        self.rows[kind] += 1
+        return self.rows[kind] - 1
+
+    def write(self, product: Dict) -> None:
+        pid = product.get("product_id", "")
+        vectors = product_vectors(product)
+        rep = self._shared.get(product.get("near_duplicate_of"), {})
+        entry = {}
+        for kind in KINDS:
+            shared = dict((id(vec), row) for vec, row in rep.get(kind, ()))
+            rows = []
+            for vec in vectors[kind]:
+                if vec is None or len(vec) == 0:
+                    rows.append(-1)
+                elif id(vec) in shared:
+                    rows.append(shared[id(vec)])
+                    self.shared_rows += 1
+                else:
+                    rows.append(self._append(kind, vec))
+            entry[kind] = rows[0] if kind in AVERAGE_KINDS else rows
+            if pid in self._shared_ids:
+                self._shared.setdefault(pid, {})[kind] = [
+                    (vec, row) for vec, row in zip(vectors[kind], rows) if row >= 0]
+        self.index[pid] = entry
+        self._products.write(json.dumps(strip_vectors(product), ensure_ascii=False) + "\n")
+        self.count += 1
+
+    def close(self) -> Dict:
+        """Finalise every file and return the index's summary (without the per-product rows)."""
+        for kind, f in self._files.items():
+            f.seek(0)
+            f.write(npy_header(self.rows[kind], self.dims))
+            f.close()
+        self._products.close()
+        summary = {
+            "generated_at": datetime.now().isoformat(),
+            "model": self.model,
+            "dims": self.dims,
+            "dtype": "float32",
+            "products": self.count,
+            "rows": dict(self.rows),
+            "shared_rows": self.shared_rows,
+        }
+        with open(staging_path(self.directory / INDEX_NAME), "w", encoding="utf-8") as f:
+            json.dump({**summary, "index": self.index}, f, separators=(",", ":"), ensure_ascii=False)
+        for kind in KINDS:
+            os.replace(staging_path(self.directory / f"{kind}.npy"), self.directory / f"{kind}.npy")
+        os.replace(staging_path(self.directory / PRODUCTS_NAME), self.directory / PRODUCTS_NAME)
+        os.replace(staging_path(self.directory / INDEX_NAME), self.directory / INDEX_NAME)
+        return summary
+
+    def abort(self) -> None:
+        for f in self._files.values():
+            f.close()
+        self._products.close()
+        for name in [f"{kind}.npy" for kind in KINDS] + [PRODUCTS_NAME, INDEX_NAME]:
+            staging_path(self.directory / name).unlink(missing_ok=True)
+
+
+class VectorStore:
+    """Read side: memory-mapped matrices, the id → rows index and the slim products."""
+
+    def __init__(self, directory: Path):
+        if not NUMPY_AVAILABLE:
+            raise RuntimeError("numpy is required to read the vector store: pip install numpy")
+        self.directory = directory
+        with open(directory / INDEX_NAME, encoding="utf-8") as f:
+            meta = json.load(f)
+        self.index: Dict[str, Dict] = meta.pop("index")
+        self.meta = meta
+        self.model = meta["model"]
+        self.dims = meta["dims"]
+        self._matrices: Dict[str, "np.ndarray"] = {}
+
+    @staticmethod
+    def exists(directory: Path) -> bool:
+        return (directory / INDEX_NAME).exists()
+
+    def __len__(self) -> int:
+        return self.meta["products"]
+
+    def matrix(self, kind: str) -> "np.ndarray":
+        if kind not in self._matrices:
+            self._matrices[kind] = np.load(self.directory / f"{kind}.npy", mmap_mode="r")
+        return self._matrices[kind]
+
+    def quantized(self, kind: str, form: str):
+        """(codes, scale) of a quantize_store() copy: int8 codes and their float32 per-dimension
+        scale, or packed sign bits and None. Read-only memmaps."""
+        codes = np.load(self.directory / f"{kind}.{form}.npy", mmap_mode="r")
+        scale = np.load(self.directory / f"{kind}.int8_scale.npy") if form == "int8" else None
+        return codes, scale
+
+    def vectors(self, product_id: str, kind: str):
+        """The product's rows of one kind: an array, or a list of arrays (None for empty slots)."""
+        rows = self.index[product_id][kind]
+        m = self.matrix(kind)
+        if kind in AVERAGE_KINDS:
+            return m[rows] if rows >= 0 else None
+        return [m[row] if row >= 0 else None for row in rows]
+
+    def rescore(self, candidates: List[Dict], query: "np.ndarray", limit: int,
+                alpha: float = 1.0, score_key: str = "_wv_score") -> List[Dict]:
+        """
+        Phase3's second stage: the `limit` best candidates (dicts with a
+        product_id) by cosine similarity to the full-size `query`, the best of
+        their primary_text (chunk 0) and hyde_query_avg vectors in this store
+        ("_full_score"; unknown products get -inf).
+
+        Candidates from a hybrid search keep their keyword side: below
+        alpha=1 the ranking is alpha * full-size cosine + (1 - alpha) *
+        candidate[score_key], each min-max scaled over the candidates as in
+        relative score fusion, and stored as "_rescore_score". Two-stage
+        search then changes the vector term only, not the query's alpha.
+        """
+        query = np.asarray(query, dtype=np.float32)
+        query = query / (np.linalg.norm(query) or 1.0)
+        rows = {"chunk": [], "hyde_query_avg": []}
+        for i, p in enumerate(candidates):
+            entry = self.index.get(p.get("product_id", ""), {})
+            chunk_rows = entry.get("chunk") or [-1]
+            if chunk_rows[0] >= 0:
+                rows["chunk"].append((i, chunk_rows[0]))
+            if entry.get("hyde_query_avg", -1) >= 0:
+                rows["hyde_query_avg"].append((i, entry["hyde_query_avg"]))
+        best = np.full(len(candidates), -np.inf)
+        for kind, pairs in rows.items():
+            if pairs:
+                idx, row_ids = map(np.asarray, zip(*pairs))
+                order = np.argsort(row_ids)                     # memmap reads in file order
+                scores = self.matrix(kind)[row_ids[order]] @ query
+                np.maximum.at(best, idx[order], scores)
+        for p, score in zip(candidates, best):
+            p["_full_score"] = float(score)
+        if alpha < 1:
+            hybrid = np.array([float(p.get(score_key) or 0.0) for p in candidates])
+            best = alpha * _relative(best) + (1 - alpha) * _relative(hybrid)
+            for p, score in zip(candidates, best):
+                p["_rescore_score"] = float(score)
+        ranked = sorted(range(len(candidates)), key=lambda i: -best[i])
+        return [candidates[i] for i in ranked[:limit]]
+
+    def iter_products(self, kinds: Iterable[str] = KINDS, arrays: bool = False) -> Iterator[Dict]:
+        """
+        Stream products.jsonl, re-attaching the requested kinds where phase1's
+        JSON used to have them: as lists of floats, or as float32 arrays
+        (copies, not memmap views) with arrays=True.
+        """
+        kinds = tuple(kinds)
+        row_of = (lambda m, row: np.array(m[row])) if arrays else (lambda m, row: m[row].tolist())
+        with open(self.directory / PRODUCTS_NAME, encoding="utf-8") as f:
+            for line in f:
+                product = json.loads(line)
+                entry = self.index.get(product.get("product_id", ""), {})
+                hyde = product.get("hyde_components")
+                for kind in kinds:
+                    if kind == "chunk":
+                        for chunk, row in zip(product.get("searchable_chunks", []), entry.get(kind, [])):
+                            if row >= 0:
+                                chunk["embedding"] = row_of(self.matrix(kind), row)
+                    elif isinstance(hyde, dict):
+                        m = self.matrix(kind)
+                        if kind in AVERAGE_KINDS:
+                            if entry.get(kind, -1) >= 0:
+                                hyde[kind] = row_of(m, entry[kind])
+                        else:
+                            key = "query_embeddings" if kind == "hyde_query" else "answer_embeddings"
+                            hyde[key] = [row_of(m, row) for row in entry.get(kind, []) if row >= 0]
+                yield product
+
+
+def _error_stats(errors: "np.ndarray") -> Dict:
+    if len(errors) == 0:
+        return {"mean": 0.0, "p99": 0.0, "max": 0.0}
+    return {"mean": round(float(errors.mean()), 6), "p99": round(float(np.quantile(errors, 0.99)), 6),
+            "max": round(float(errors.max()), 6)}
+
+
+def _relative(scores: "np.ndarray") -> "np.ndarray":
+    """Scores min-max scaled to [0, 1] (all 1 when they are equal); -inf and NaN become 0."""
+    finite = np.isfinite(scores)
+    out = np.zeros(len(scores))
+    if finite.any():
+        lo, hi = scores[finite].min(), scores[finite].max()
+        out[finite] = (scores[finite] - lo) / (hi - lo) if hi > lo else 1.0
+    return out
+
+
+def _unit(m: "np.ndarray") -> "np.ndarray":
+    norms = np.linalg.norm(m, axis=1, keepdims=True)
+    return m / np.where(norms > 0, norms, 1.0)
+
+
+def calibrate(matrix: "np.ndarray", codes: "np.ndarray", scale: "np.ndarray",
+              bits: "np.ndarray", sample: int = CALIBRATION_SAMPLE, seed: int = 0) -> Dict:
+    """
+    Cosine error of the quantized copies over a sample of rows:
+    int8 — 1 - cos(x, codes * scale) per row, and the error of the cosine
+    between random row pairs; binary — error of the pairwise cosine
+    estimated from the Hamming distance, cos(pi * hamming / dims), unless
+    more than SPARSE_ZERO_FRACTION of the sampled components are exactly
+    zero: the estimate does not hold for sparse vectors and is left out.
+    """
+    rng = np.random.default_rng(seed)
+    rows = np.sort(rng.choice(len(matrix), size=min(sample, len(matrix)), replace=False))
+    x = np.asarray(matrix[rows], dtype=np.float64)
+    keep = np.linalg.norm(x, axis=1) > 0
+    rows, x = rows[keep], _unit(x[keep])
+    approx = _unit(np.asarray(codes[rows], dtype=np.float64) * scale)
+    a, b = rng.integers(0, len(rows), size=(2, len(rows))) if len(rows) else (rows, rows)
+    true = (x[a] * x[b]).sum(axis=1)
+    int8_pair = (approx[a] * approx[b]).sum(axis=1)
+    zeros = float((x == 0).mean()) if x.size else 0.0
+    result = {
+        "sample_rows": int(len(rows)),
+        "zero_fraction": round(zeros, 6),
+        "int8_reconstruction_error": _error_stats(1 - (x * approx).sum(axis=1)),
+        "int8_pair_cosine_error": _error_stats(np.abs(int8_pair - true)),
+    }
+    if zeros > SPARSE_ZERO_FRACTION:
+        result["binary_pair_cosine_error"] = None
+        result["binary_estimate"] = "not meaningful for sparse vectors"
+        return result
+    signs = np.unpackbits(np.asarray(bits[rows]), axis=1)[:, :matrix.shape[1]]
+    hamming = (signs[a] != signs[b]).sum(axis=1)
+    binary_pair = np.cos(np.pi * hamming / matrix.shape[1])
+    result["binary_pair_cosine_error"] = _error_stats(np.abs(binary_pair - true))
+    return result
+
+
+def remove_quantized(directory: Path) -> None:
+    """Delete the quantized copies, so none can outlive the float32 store they were made from."""
+    for kind in KINDS:
+        for name in (f"{kind}.int8.npy", f"{kind}.int8_scale.npy", f"{kind}.binary.npy"):
+            (directory / name).unlink(missing_ok=True)
+    (directory / QUANT_REPORT_NAME).unlink(missing_ok=True)
+
+
+def quantize_store(directory: Path, sample: int = CALIBRATION_SAMPLE) -> Dict:
+    """
+    Write the int8 and binary copies of every matrix of the store in
+    `directory` (two streaming passes over each memmap: per-dimension max,
+    then QUANT_CHUNK rows at a time) and quantization.json. Returns the report.
+    """
+    store = VectorStore(directory)
+    report = {"generated_at": datetime.now().isoformat(), "model": store.model, "dims": store.dims,
+              "index_generated_at": store.meta["generated_at"], "binary_estimate": BINARY_ESTIMATE,
+              "kinds": {}}
+    for kind in KINDS:
+        matrix = store.matrix(kind)
+        rows, dims = matrix.shape
+        peak = np.zeros(dims, dtype=np.float32)
+        for lo in range(0, rows, QUANT_CHUNK):
+            np.maximum(peak, np.abs(matrix[lo:lo + QUANT_CHUNK]).max(axis=0), out=peak)
+        scale = np.where(peak > 0, peak / 127, 1.0).astype(np.float32)
+
+        staged = {form: staging_path(directory / f"{kind}.{form}.npy") for form in QUANT_FORMS}
+        codes = np.lib.format.open_memmap(staged["int8"], mode="w+", dtype=np.int8, shape=(rows, dims))
+        bits = np.lib.format.open_memmap(staged["binary"], mode="w+", dtype=np.uint8,
+                                         shape=(rows, (dims + 7) // 8))
+        for lo in range(0, rows, QUANT_CHUNK):
+            block = np.asarray(matrix[lo:lo + QUANT_CHUNK], dtype=np.float32)
+            codes[lo:lo + len(block)] = np.clip(np.rint(block / scale), -127, 127)
+            bits[lo:lo + len(block)] = np.packbits(block > 0, axis=1)
+        codes.flush()
+        bits.flush()
+        with open(staging_path(directory / f"{kind}.int8_scale.npy"), "wb") as f:
+            np.save(f, scale)
+
+        entry = {
+            "rows": rows,
+            "bytes": {"float32": rows * dims * 4, "int8": rows * dims + (dims * 4 if rows else 0), "binary": rows * ((dims + 7) // 8)},
+        }
+        if rows:
+            entry["calibration"] = calibrate(matrix, codes, scale, bits, sample)
+        report["kinds"][kind] = entry
+        del codes, bits
+        for form, path in staged.items():
+            os.replace(path, directory / f"{kind}.{form}.npy")
+        os.replace(staging_path(directory / f"{kind}.int8_scale.npy"), directory / f"{kind}.int8_scale.npy")
+
+    total = {form: sum(k["bytes"][form] for k in report["kinds"].values()) for form in ("float32", *QUANT_FORMS)}
+    report["bytes"] = total
+    report["compression"] = {form: round(total["float32"] / total[form], 1) if total[form] else None
+                             for form in QUANT_FORMS}
+    with open(staging_path(directory / QUANT_REPORT_NAME), "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    os.replace(staging_path(directory / QUANT_REPORT_NAME), directory / QUANT_REPORT_NAME)
+    return report
+
+
+class Checkpoints:
+    """
+    Append-only checkpoints of one phase1 run in `directory`:
+
+        manifest.jsonl   the run's header, then one line per finished part
+        part-00001/ ...  vector stores of up to part_size consecutive products
+
+    A part is listed in the manifest only once all of its files are in place;
+    anything else found on resume (a part cut short by a crash) is deleted.
+    The manifest is only appended to, or replaced whole by a staged copy, so
+    a crash at any point leaves a readable one.
+    resume=True continues the run whose header matches `header`; otherwise
+    any previous checkpoints are discarded.
+    """
+
+    MANIFEST = "manifest.jsonl"
+
+    def __init__(self, directory: Path, header: Dict, model: str, dims: int,
+                 part_size: int, shared_ids: Iterable[str] = (), resume: bool = False):
+        self.directory = directory
+        self.model = model
+        self.dims = dims
+        self.part_size = part_size
+        self.shared_ids = set(shared_ids)
+        self.parts: List[Dict] = []
+        self._writer: Optional[VectorStoreWriter] = None
+        self._ids: List[str] = []
+        manifest = directory / self.MANIFEST
+
+        if resume and manifest.exists():
+            with open(manifest, encoding="utf-8") as f:
+                lines = f.read().splitlines()
+            previous = json.loads(lines[0])
+            for key, value in header.items():
+                if key != "started_at" and previous.get(key) != value:
+                    raise ValueError(f"checkpoints in {directory} are from another run "
+                                     f"({key}: {previous.get(key)!r} != {value!r})")
+            for line in lines[1:]:
+                try:
+                    self.parts.append(json.loads(line))
+                except json.JSONDecodeError:                 # torn last line
+                    break
+            listed = {part["name"] for part in self.parts}
+            for path in directory.iterdir():
+                if path.is_dir() and path.name not in listed:
+                    for leftover in path.iterdir():
+                        leftover.unlink()
+                    path.rmdir()
+            self._write_manifest([previous, *self.parts])     # drops a torn last line
+        else:
+            if directory.exists():
+                for path in sorted(directory.rglob("*"), reverse=True):
+                    path.rmdir() if path.is_dir() else path.unlink()
+            directory.mkdir(parents=True, exist_ok=True)
+            self._write_manifest([header])
+
+    def _write_manifest(self, entries: List[Dict]) -> None:
+        manifest = self.directory / self.MANIFEST
+        with open(staging_path(manifest), "w", encoding="utf-8") as f:
+            f.write("".join(json.dumps(entry) + "\n" for entry in entries))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(staging_path(manifest), manifest)
+
+    @property
+    def done_ids(self) -> set:
+        return {pid for part in self.parts for pid in VectorStore(self.directory / part["name"]).index}
+
+    @property
+    def count(self) -> int:
+        return sum(part["products"] for part in self.parts)
+
+    def write(self, product: Dict) -> None:
+        if self._writer is None:
+            name = f"part-{len(self.parts) + 1:05d}"
+            self._writer = VectorStoreWriter(self.directory / name, self.model, self.dims, self.shared_ids)
+        self._writer.write(product)
+        self._ids.append(product.get("product_id", ""))
+        if self._writer.count >= self.part_size:
+            self._finish_part()
+
+    def _finish_part(self) -> None:
+        name = self._writer.directory.name
+        summary = self._writer.close()
+        entry = {"name": name, "products": summary["products"], "rows": summary["rows"],
+                 "first": self._ids[0], "last": self._ids[-1], "written_at": summary["generated_at"]}
+        with open(self.directory / self.MANIFEST, "a", encoding="utf-8") as f:
+            f.write(json.dumps(entry) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        self.parts.append(entry)
+        self._writer = None
+        self._ids = []
+
+    def close(self) -> None:
+        """Finish the part in progress (products written so far are complete)."""
+        if self._writer is not None:
+            if self._writer.count:
+                self._finish_part()
+            else:
+                self._writer.abort()
+                self._writer = None
+
+    def abort(self) -> None:
+        """Drop the part in progress; finished parts stay for --resume."""
+        if self._writer is not None:
+            self._writer.abort()
+            self._writer = None
+            self._ids = []
+
+    def iter_products(self, kinds: Iterable[str] = KINDS) -> Iterator[Dict]:
+        """Every checkpointed product, in run order, with float32 array vectors."""
+        for part in self.parts:
+            yield from VectorStore(self.directory / part["name"]).iter_products(kinds, arrays=True)
+
+    def remove(self) -> None:
+        for path in sorted(self.directory.rglob("*"), reverse=True):
+            path.rmdir() if path.is_dir() else path.unlink()
+        self.directory.rmdir()